@@ -0,0 +1,260 @@
+"""Замеры производительности модуля фитнес-трекера.
+
+Каждый этап обработки пакета замеряется отдельно на синтетических данных,
+результат печатается в формате JSON. С флагом `--baseline` результат
+сравнивается с сохранённым ранее замером.
+
+    python bench.py --size 100000 --save results.json
+    python bench.py --baseline results.json --threshold 0.2
+"""
+
+from contextlib import redirect_stdout
+from functools import partial
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import argparse
+import http.client
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import homework
+import loadgen
+
+HTTP_BATCH_SIZE = 1000
+
+
+def make_packages(
+    size: int, seed: int = 0
+) -> List[Tuple[str, List[str]]]:
+    """Создаёт синтетические пакеты со строковыми полями, как в CSV.
+
+    Пакеты берутся из генератора нагрузки `loadgen`, поэтому замеры идут
+    на тех же распределениях значений, что и длительные прогоны.
+    """
+
+    return list(loadgen.generate_packages(size, seed=seed))
+
+
+def timed(
+    func: Callable[[object], object], items: Sequence
+) -> Tuple[float, int]:
+    """Замеряет вызов `func` для каждого элемента `items`.
+
+    Returns:
+        Время в секундах и число операций.
+    """
+
+    started = time.perf_counter()
+    for item in items:
+        func(item)
+    return time.perf_counter() - started, len(items)
+
+
+class Dataset:
+    """Синтетические данные, общие для всех этапов."""
+
+    def __init__(self, size: int, seed: int) -> None:
+        self.packages = make_packages(size, seed)
+        self.parsed = [
+            (code, [float(value) for value in data])
+            for code, data in self.packages
+        ]
+        self.by_type = {
+            code: [data for kind, data in self.parsed if kind == code]
+            for code in homework.TYPE_DICT
+        }
+        self.messages = [
+            homework.read_package(*package).show_training_info()
+            for package in self.parsed
+        ]
+
+
+def bench_read_package(dataset: Dataset) -> Tuple[float, int]:
+    return timed(
+        lambda package: homework.read_package(*package), dataset.parsed
+    )
+
+
+def bench_decode_package(dataset: Dataset) -> Tuple[float, int]:
+    return timed(
+        lambda package: homework.decode_package(*package), dataset.packages
+    )
+
+
+def bench_info_package(dataset: Dataset) -> Tuple[float, int]:
+    return timed(
+        lambda package: homework.info_package(*package), dataset.packages
+    )
+
+
+def bench_construct(code: str, dataset: Dataset) -> Tuple[float, int]:
+    training = homework.TYPE_DICT[code]
+    return timed(lambda data: training(*data), dataset.by_type[code])
+
+
+def bench_get_spent_calories(
+    code: str, dataset: Dataset
+) -> Tuple[float, int]:
+    training = homework.TYPE_DICT[code]
+    objects = [training(*data) for data in dataset.by_type[code]]
+    return timed(training.get_spent_calories, objects)
+
+
+def bench_show_training_info(dataset: Dataset) -> Tuple[float, int]:
+    objects = [homework.read_package(*package) for package in dataset.parsed]
+    return timed(lambda training: training.show_training_info(), objects)
+
+
+def bench_show_training_info_type(
+    code: str, dataset: Dataset
+) -> Tuple[float, int]:
+    training = homework.TYPE_DICT[code]
+    objects = [training(*data) for data in dataset.by_type[code]]
+    return timed(training.show_training_info, objects)
+
+
+def bench_get_message(dataset: Dataset) -> Tuple[float, int]:
+    return timed(homework.InfoMessage.get_message, dataset.messages)
+
+
+def bench_end_to_end(dataset: Dataset) -> Tuple[float, int]:
+    with tempfile.NamedTemporaryFile(
+        'w', suffix='.csv', delete=False, encoding='utf-8'
+    ) as file:
+        for code, data in dataset.packages:
+            file.write(','.join([code, *data]) + '\n')
+    try:
+        started = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            count = homework.print_messages(file.name)
+        return time.perf_counter() - started, count
+    finally:
+        os.unlink(file.name)
+
+
+def bench_http_batch(dataset: Dataset) -> Tuple[float, int]:
+    """Замеряет пакетный HTTP API по одному соединению keep-alive."""
+
+    server = homework.BatchHTTPServer(('127.0.0.1', 0))
+    thread = threading.Thread(
+        target=server.serve_forever, kwargs={'poll_interval': 0.05}
+    )
+    thread.start()
+    bodies = [
+        json.dumps([
+            [code, *data] for code, data
+            in dataset.packages[start:start + HTTP_BATCH_SIZE]
+        ]).encode()
+        for start in range(0, len(dataset.packages), HTTP_BATCH_SIZE)
+    ]
+    connection = http.client.HTTPConnection(*server.server_address)
+    try:
+        started = time.perf_counter()
+        for body in bodies:
+            connection.request(
+                'POST', '/batch', body, {'Content-Type': 'application/json'}
+            )
+            connection.getresponse().read()
+        return time.perf_counter() - started, len(dataset.packages)
+    finally:
+        connection.close()
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def stages() -> Dict[str, Callable[[Dataset], Tuple[float, int]]]:
+    """Возвращает замеряемые этапы по именам.
+
+    Каждый этап сам готовит свои объекты и замеряет только целевой вызов.
+    """
+
+    result = {
+        'read_package': bench_read_package,
+        'decode_package': bench_decode_package,
+        'info_package': bench_info_package,
+    }
+    for code, training in homework.TYPE_DICT.items():
+        name = training.__name__
+        result[f'construct.{name}'] = partial(bench_construct, code)
+        result[f'get_spent_calories.{name}'] = partial(
+            bench_get_spent_calories, code
+        )
+        result[f'show_training_info.{name}'] = partial(
+            bench_show_training_info_type, code
+        )
+    result['show_training_info'] = bench_show_training_info
+    result['get_message'] = bench_get_message
+    result['end_to_end'] = bench_end_to_end
+    result['http_batch'] = bench_http_batch
+    return result
+
+
+def run_benchmarks(
+    size: int, repeat: int, seed: int = 0
+) -> Dict[str, Dict[str, float]]:
+    """Замеряет все этапы и возвращает лучший из `repeat` результат."""
+
+    dataset = Dataset(size, seed)
+    results = {}
+    for name, stage in stages().items():
+        best = min(elapsed / count for elapsed, count in (
+            stage(dataset) for _ in range(repeat)
+        ))
+        results[name] = {'ns_per_op': best * 1e9, 'ops_per_sec': 1 / best}
+    return results
+
+
+def compare(
+    results: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    threshold: float,
+) -> List[str]:
+    """Возвращает этапы, ставшие медленнее базового замера больше порога."""
+
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result['ns_per_op'] / baseline[name]['ns_per_op']
+        result['baseline_ratio'] = ratio
+        if ratio > 1 + threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    """Запускает замеры и возвращает код выхода."""
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=20000,
+                        help='число синтетических пакетов')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='число повторов каждого замера')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', help='JSON с базовым замером')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='допустимое замедление, 0.2 — на 20%%')
+    parser.add_argument('--save', help='сохранить результат в JSON-файл')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.size, args.repeat, args.seed)
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            regressions = compare(results, json.load(file), args.threshold)
+    report = {'size': args.size, 'results': results,
+              'regressions': regressions}
+    json.dump(report, sys.stdout, indent=2, ensure_ascii=False)
+    print()
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
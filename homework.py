@@ -1,5 +1,49 @@
+"""Модуль фитнес-трекера."""
+
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from contextlib import ExitStack
 from dataclasses import dataclass
+from datetime import date
+from functools import lru_cache
+from hashlib import blake2b
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import chain, compress, groupby
+from math import ceil, exp, inf, isfinite, log
+from multiprocessing.shared_memory import SharedMemory
+from operator import itemgetter
+from queue import Empty
+from typing import (
+    Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Set,
+    TextIO, Tuple, Type, TypeVar, Union, get_type_hints,
+)
+import argparse
+import ast
+import asyncio
 import csv
+import heapq
+import inspect
+import io
+import json
+import mmap
+import multiprocessing
+import os
+import signal
+import socket
+import sqlite3
+import struct
+import sys
+import tempfile
+import time
+
+SHARD_SIZE = 8 * 1024 * 1024
+WRITE_BATCH_SIZE = 4096
+READ_SIZE = 1024 * 1024
+
+T = TypeVar('T', bound=type)
+
+METRIC_METHODS = ('get_distance', 'get_mean_speed', 'get_spent_calories')
 
 
 @dataclass
@@ -10,6 +54,16 @@ class InfoMessage:
         get_message: выводит сообщение об тренировке
     """
 
+    __slots__ = ('training_type', 'duration', 'distance', 'speed', 'calories')
+
+    MESSAGE = (
+        'Тип тренировки: {}; '
+        'Длительность: {:.3f} ч.; '
+        'Дистанция: {:.3f} км; '
+        'Ср. скорость: {:.3f} км/ч; '
+        'Потрачено ккал: {:.3f}.'
+    )
+
     training_type: str
     duration: float
     distance: float
@@ -17,14 +71,342 @@ class InfoMessage:
     calories: float
 
     def get_message(self) -> str:
-        return (
-            f'Тип тренировки: {self.training_type}; '
-            f'Длительность: {self.duration:.3f} ч.; '
-            f'Дистанция: {self.distance:.3f} км; '
-            f'Ср. скорость: {self.speed:.3f} км/ч; '
-            f'Потрачено ккал: {self.calories:.3f}.'
+        return self.MESSAGE.format(
+            self.training_type,
+            self.duration,
+            self.distance,
+            self.speed,
+            self.calories,
+        )
+
+
+@dataclass
+class PackageError:
+    """Ошибка разбора пакета.
+
+    Attributes:
+        reason: код ошибки (`type`, `arity`, `format`, `range`)
+        message: описание ошибки
+    """
+
+    __slots__ = ('reason', 'message')
+
+    reason: str
+    message: str
+
+
+class PackageDecoder:
+    """Разбирает поля пакета для одного вида тренировки.
+
+    Поля берутся из `FIELDS` класса тренировки, их типы — из аннотаций
+    `__init__` (без аннотации — `float`), поля-делители — из `NONZERO`
+    класса. Всё это читается один раз при создании декодера.
+    Неправильный пакет возвращает `PackageError`, а не поднимает
+    исключение.
+
+    Attributes:
+        training: класс тренировки
+        types: типы полей в порядке аргументов класса
+    """
+
+    def __init__(self, training: Type['Training']) -> None:
+        hints = get_type_hints(training.__init__)
+        self.training = training
+        self.types = tuple(
+            hints.get(name, float) for name in training.FIELDS
+        )
+        self._name = training.__name__
+        self._kernel = training.kernel
+        self._arity = len(self.types)
+        self._nonzero = tuple(
+            (training.FIELDS.index(name), name) for name in training.NONZERO
+        )
+        self._integers = tuple(
+            (index, name) for index, (name, kind)
+            in enumerate(zip(training.FIELDS, self.types)) if kind is int
+        )
+
+    def parse(
+        self, data: Sequence[str]
+    ) -> Union[List[float], PackageError]:
+        """Возвращает числовые параметры пакета или описание ошибки.
+
+        Целые поля принимаются и в записи с дробной частью, равной нулю,
+        например `25.0`.
+        """
+
+        if len(data) != self._arity:
+            return PackageError(
+                'arity',
+                f'{self.training.__name__}: ожидалось {self._arity} '
+                f'параметров, получено {len(data)}',
+            )
+        try:
+            values = list(map(float, data))
+        except ValueError as err:
+            return PackageError('format', str(err))
+        if not all(map(isfinite, values)):
+            return PackageError('format', f'неверные числа: {data!r}')
+        for index, name in self._integers:
+            if not values[index].is_integer():
+                return PackageError(
+                    'format', f'{self._name}: {name} должно быть целым'
+                )
+            values[index] = int(values[index])
+        if min(values) < 0:
+            return PackageError('range', 'параметры не могут быть меньше 0')
+        for index, name in self._nonzero:
+            if not values[index]:
+                return PackageError(
+                    'range', f'{self._name}: {name} должно быть больше 0'
+                )
+        return values
+
+    def decode(
+        self, data: Sequence[str]
+    ) -> Union['Training', PackageError]:
+        """Возвращает объект тренировки или описание ошибки."""
+
+        values = self.parse(data)
+        if isinstance(values, PackageError):
+            return values
+        return self.training(*values)
+
+    def info(self, data: Sequence[str]) -> Union[InfoMessage, PackageError]:
+        """Возвращает сообщение о тренировке или описание ошибки.
+
+        Показатели считаются ядром класса тренировки, сам объект
+        тренировки не создаётся.
+        """
+
+        values = self.parse(data)
+        if isinstance(values, PackageError):
+            return values
+        return self.message(values)
+
+    def message(
+        self, values: Sequence[float]
+    ) -> Union[InfoMessage, PackageError]:
+        """Рассчитывает сообщение для уже разобранных параметров.
+
+        Арифметическая ошибка формулы, например переполнение, и
+        бесконечный или неопределённый результат возвращаются как
+        `PackageError` с кодом `range`.
+        """
+
+        try:
+            results = self._kernel(*values)
+        except ArithmeticError as err:
+            return PackageError('range', f'{self._name}: {err}')
+        if not all(map(isfinite, results)):
+            return PackageError(
+                'range', f'{self._name}: показатели вне допустимого диапазона'
+            )
+        return InfoMessage(self._name, values[1], *results)
+
+
+TYPE_DICT: Dict[str, Type['Training']] = {}
+TYPE_CODES: Dict[str, str] = {}
+DECODERS: Dict[str, PackageDecoder] = {}
+
+
+class _Inline(ast.NodeTransformer):
+    """Заменяет имена в формуле готовыми выражениями."""
+
+    def __init__(self, names: Dict[str, ast.expr]) -> None:
+        self.names = names
+
+    def visit_Name(self, node: ast.Name) -> ast.expr:
+        return self.names.get(node.id, node)
+
+
+def render_formula(
+    training: Type['Training'], formula: str, names: Dict[str, str]
+) -> str:
+    """Возвращает исходный код формулы с подставленными константами.
+
+    Args:
+        training: класс тренировки, из которого берутся константы
+        formula: формула из атрибутов `DISTANCE`, `SPEED` или `CALORIES`
+        names: выражения, подставляемые вместо переменных формулы
+
+    Константы — числовые атрибуты класса из заглавных букв — подставляются
+    в код числами, чтобы ядро не искало их в классе при каждом вызове.
+    """
+
+    tree = ast.parse(formula, mode='eval')
+    replacements = {
+        name: ast.parse(text, mode='eval').body
+        for name, text in names.items()
+    }
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Name) or node.id in replacements:
+            continue
+        value = getattr(training, node.id, None)
+        if not node.id.isupper() or not isinstance(value, (int, float)):
+            raise Exception(
+                f'{training.__name__}: неизвестное имя {node.id!r} '
+                f'в формуле {formula!r}'
+            )
+        # Отрицательная константа вставляется унарным минусом, чтобы
+        # `ast.unparse` расставил скобки (`(-2) ** 2`, а не `-2 ** 2`).
+        replacements[node.id] = (
+            ast.UnaryOp(ast.USub(), ast.Constant(-value)) if value < 0
+            else ast.Constant(value)
+        )
+    return ast.unparse(_Inline(replacements).visit(tree))
+
+
+def _compile(source: str, name: str, filename: str) -> Callable:
+    namespace = {
+        'array': array, 'InfoMessage': InfoMessage, 'Training': Training,
+    }
+    exec(compile(source, filename, 'exec'), namespace)
+    return namespace[name]
+
+
+def _batch_column(
+    training: Type['Training'], formula: str, sources: Dict[str, str]
+) -> str:
+    used = [
+        name for name in sources
+        if any(
+            isinstance(node, ast.Name) and node.id == name
+            for node in ast.walk(ast.parse(formula, mode='eval'))
+        )
+    ]
+    expression = render_formula(
+        training, formula, {name: name for name in sources}
+    )
+    if len(used) == 1:
+        loop = f'{used[0]} in {sources[used[0]]}'
+    else:
+        loop = (
+            f"{', '.join(used)} in "
+            f"zip({', '.join(sources[name] for name in used)})"
+        )
+    return f"array('d', [{expression} for {loop}])"
+
+
+def make_kernels(
+    training: Type['Training'],
+) -> Dict[str, Callable]:
+    """Собирает из формул класса ядра расчёта и методы показателей.
+
+    Returns:
+        Словарь с ядром для одного пакета (`kernel`), ядром для столбцов
+        (`batch_kernel`) и методами `get_distance`, `get_mean_speed`,
+        `get_spent_calories`, `show_training_info`.
+    """
+
+    fields = training.FIELDS
+    formulas = {
+        'distance': training.DISTANCE,
+        'speed': training.SPEED,
+        'calories': training.CALORIES,
+    }
+    filename = f'<kernel {training.__name__}>'
+    local = {name: name for name in (*fields, 'distance', 'speed')}
+    scalar = {
+        name: render_formula(training, formula, local)
+        for name, formula in formulas.items()
+    }
+    arguments = ', '.join(fields)
+    kernels = {'kernel': _compile(
+        f'def kernel({arguments}):\n'
+        f"    distance = {scalar['distance']}\n"
+        f"    speed = {scalar['speed']}\n"
+        f"    return distance, speed, {scalar['calories']}\n",
+        'kernel', filename,
+    )}
+
+    sources = {name: f'columns[{index}]' for index, name in enumerate(fields)}
+    distance = _batch_column(training, formulas['distance'], sources)
+    sources['distance'] = 'distances'
+    speed = _batch_column(training, formulas['speed'], sources)
+    sources['speed'] = 'speeds'
+    calories = _batch_column(training, formulas['calories'], sources)
+    kernels['batch_kernel'] = _compile(
+        'def batch_kernel(*columns):\n'
+        f'    distances = {distance}\n'
+        f'    speeds = {speed}\n'
+        f'    return distances, speeds, {calories}\n',
+        'batch_kernel', filename,
+    )
+
+    attributes = {name: f'self.{name}' for name in fields}
+    attributes['distance'] = 'self.get_distance()'
+    attributes['speed'] = 'self.get_mean_speed()'
+    for name, method in zip(formulas, METRIC_METHODS):
+        formula = render_formula(training, formulas[name], attributes)
+        kernels[method] = _compile(
+            f'def {method}(self):\n    return {formula}\n', method, filename
         )
 
+    # Сводка считает дистанцию и скорость один раз и передаёт их в
+    # формулу калорий, как ядро, без вызовов методов показателей. Если
+    # метод показателя подменён у объекта, сводка идёт через методы.
+    overridden = ' or '.join(
+        f"'{method}' in fields" for method in METRIC_METHODS
+    )
+    kernels['show_training_info'] = _compile(
+        'def show_training_info(self):\n'
+        '    fields = self.__dict__\n'
+        f'    if {overridden}:\n'
+        '        return Training.show_training_info(self)\n'
+        f"    {arguments} = {', '.join(attributes[name] for name in fields)}\n"
+        f"    distance = {scalar['distance']}\n"
+        f"    speed = {scalar['speed']}\n"
+        '    return InfoMessage(type(self).__name__, duration, distance, '
+        f"speed, {scalar['calories']})\n",
+        'show_training_info', filename,
+    )
+    for method, function in kernels.items():
+        if not method.endswith('kernel'):
+            function.__qualname__ = f'{training.__name__}.{method}'
+            function.__doc__ = getattr(Training, method).__doc__
+    return kernels
+
+
+def register_workout(code: str) -> Callable[[Type[T]], Type[T]]:
+    """Регистрирует класс тренировки под кодом пакета.
+
+    Поля пакета берутся из аргументов `__init__` класса, формулы — из
+    атрибутов `DISTANCE`, `SPEED` и `CALORIES`. По формулам собираются
+    ядра расчёта с подставленными константами и методы показателей.
+    Методы, заданные в самом классе, не заменяются; ядра пакетов всё
+    равно считают по формулам.
+
+        @register_workout('BIK')
+        class Cycling(Training):
+            CALORIES_SPEED_MULTIPLIER = 0.4
+            CALORIES = 'CALORIES_SPEED_MULTIPLIER * speed * weight * duration'
+
+    Args:
+        code: код тренировки в пакете
+    """
+
+    def register(training: Type[T]) -> Type[T]:
+        if code in TYPE_DICT:
+            raise Exception(f'Код тренировки {code!r} уже занят')
+        if training.CALORIES is None:
+            raise Exception(
+                f'{training.__name__}: не задана формула CALORIES'
+            )
+        training.FIELDS = tuple(inspect.signature(training).parameters)
+        for name, value in make_kernels(training).items():
+            if name in vars(training):
+                continue
+            if name.endswith('kernel'):
+                value = staticmethod(value)
+            setattr(training, name, value)
+        TYPE_DICT[code] = training
+        TYPE_CODES[training.__name__] = code
+        DECODERS[code] = PackageDecoder(training)
+        return training
+
+    return register
+
 
 class Training:
     """Базовый класс тренировки.
@@ -33,6 +415,12 @@ class Training:
         LEN_STEP: длина шага при ходьбе (измеряется в метрах)
         M_IN_KM: множитель для перевода из метров в километры
         MIN_IN_H: множитель для перевода из минут в часы
+        FIELDS: поля пакета в порядке аргументов класса
+        NONZERO: поля, на которые делят формулы; ноль в них отклоняется
+        COUNTERS: поля, которые в `LiveSession` копятся из отсчётов
+        DISTANCE, SPEED, CALORIES: формулы дистанции, средней скорости и
+            калорий для `register_workout`. В формулах доступны поля
+            пакета, `distance`, `speed` и константы класса.
 
     Returns:
         __init__: получаем переменные
@@ -46,6 +434,13 @@ class Training:
     M_IN_KM = 1000
     MIN_IN_H = 60
 
+    FIELDS = ('action', 'duration', 'weight')
+    NONZERO = ('duration',)
+    COUNTERS = ('action',)
+    DISTANCE = 'action * LEN_STEP / M_IN_KM'
+    SPEED = 'distance / duration'
+    CALORIES: Optional[str] = None
+
     def __init__(
         self,
         action: float,
@@ -56,6 +451,21 @@ class Training:
         self.duration = duration
         self.weight = weight
 
+    def __init_subclass__(cls, **kwargs: Any) -> None:
+        """Возвращает подклассу сводку через методы показателей.
+
+        Собранная `show_training_info` считает по формулам, поэтому
+        подкласс, переопределивший метод показателя, получает общую
+        сводку из `Training`.
+        """
+
+        super().__init_subclass__(**kwargs)
+        own = vars(cls)
+        if 'show_training_info' not in own and any(
+            method in own for method in METRIC_METHODS
+        ):
+            cls.show_training_info = Training.show_training_info
+
     def get_distance(self) -> float:
         """Рассчитывает среднюю скорость движения в км."""
 
@@ -97,35 +507,26 @@ class Training:
         )
 
 
+@register_workout('RUN')
 class Running(Training):
     """Тренировка: бег.
 
     Attributes:
         CALORIES_MEAN_SPEED_MULTIPLIER: множитель при средней скорости
         CALORIES_MEAN_SPEED_SHIFT: ее сдвиг
-
-    Returns:
-        get_spent_calories: Получает количество затраченных калорий
+        CALORIES: формула затраченных калорий
     """
 
     CALORIES_MEAN_SPEED_MULTIPLIER = 18
     CALORIES_MEAN_SPEED_SHIFT = 1.79
 
-    def get_spent_calories(self) -> float:
-        """Получает количество затраченных калорий."""
-
-        return (
-            (
-                self.CALORIES_MEAN_SPEED_MULTIPLIER * self.get_mean_speed()
-                + self.CALORIES_MEAN_SPEED_SHIFT
-            )
-            * self.weight
-            / self.M_IN_KM
-            * self.duration
-            * self.MIN_IN_H
-        )
+    CALORIES = (
+        '(CALORIES_MEAN_SPEED_MULTIPLIER * speed + CALORIES_MEAN_SPEED_SHIFT)'
+        ' * weight / M_IN_KM * duration * MIN_IN_H'
+    )
 
 
+@register_workout('WLK')
 class SportsWalking(Training):
     """Тренировка: спортивная ходьба.
 
@@ -135,10 +536,11 @@ class SportsWalking(Training):
         CALORIES_SPEED_HEIGHT_MULTIPLIER: ее сдвиг
         KMH_IN_MSEC: перевод в метры секунды
         CM_IN_M: перевод рост в метрах
+        NONZERO: рост тоже стоит в знаменателе формулы калорий
+        CALORIES: формула затраченных калорий
 
     Returns:
         __init__: получаем переменные
-        get_spent_calories: Получает количество затраченных калорий
     """
 
     CALORIES_WEIGHT_MULTIPLIER = 0.035
@@ -147,30 +549,22 @@ class SportsWalking(Training):
     KMH_IN_MSEC = 0.278  # множитель для перевода в метры секунды
     CM_IN_M = 100
 
+    NONZERO = ('duration', 'height')
+    CALORIES = (
+        '(CALORIES_WEIGHT_MULTIPLIER * weight'
+        ' + (speed * KMH_IN_MSEC) ** 2 / (height / CM_IN_M)'
+        ' * CALORIES_SPEED_HEIGHT_MULTIPLIER * weight)'
+        ' * duration * MIN_IN_H'
+    )
+
     def __init__(
         self, action: float, duration: float, weight: float, height: float
     ) -> None:
         super().__init__(action, duration, weight)
         self.height = height
 
-    def get_spent_calories(self) -> float:
-        """Получает количество затраченных калорий."""
-
-        return (
-            (
-                self.CALORIES_WEIGHT_MULTIPLIER * self.weight
-                + (
-                    (self.get_mean_speed() * self.KMH_IN_MSEC) ** 2
-                    / (self.height / self.CM_IN_M)
-                )
-                * self.CALORIES_SPEED_HEIGHT_MULTIPLIER
-                * self.weight
-            )
-            * self.duration
-            * self.MIN_IN_H
-        )
-
 
+@register_workout('SWM')
 class Swimming(Training):
     """Тренировка: плавание.
 
@@ -178,17 +572,25 @@ class Swimming(Training):
         CALORIES_MEAN_SPEED_SWIM: множитель при средней скорости
         CALORIES_MEAN_SWIM_MULTIPLIER: просто коэфицент для формулы
         LEN_STEP = 1.38: длина гребка (измеряется в метрах)
+        COUNTERS: гребки и пройденные бассейны копятся из отсчётов
+        SPEED: формула средней скорости по длине и числу бассейнов
+        CALORIES: формула затраченных калорий
 
     Returns:
         __init__: получаем переменные
-        get_mean_speed: Получает среднюю скорость движения
-        get_spent_calories: Получает количество затраченных калорий
     """
 
     CALORIES_MEAN_SPEED_SWIM = 1.1
     CALORIES_MEAN_SWIM_MULTIPLIER = 2
     LEN_STEP = 1.38
 
+    COUNTERS = ('action', 'count_pool')
+    SPEED = 'length_pool * count_pool / M_IN_KM / duration'
+    CALORIES = (
+        '(speed + CALORIES_MEAN_SPEED_SWIM) * CALORIES_MEAN_SWIM_MULTIPLIER'
+        ' * weight * duration'
+    )
+
     def __init__(
         self,
         action: float,
@@ -201,26 +603,6 @@ class Swimming(Training):
         self.length_pool = length_pool
         self.count_pool = count_pool
 
-    def get_mean_speed(self) -> float:
-        """Получает среднюю скорость движения."""
-
-        return (
-            self.length_pool * self.count_pool / self.M_IN_KM / self.duration
-        )
-
-    def get_spent_calories(self) -> float:
-        """Получает количество затраченных калорий."""
-
-        return (
-            (self.get_mean_speed() + self.CALORIES_MEAN_SPEED_SWIM)
-            * self.CALORIES_MEAN_SWIM_MULTIPLIER
-            * self.weight
-            * self.duration
-        )
-
-
-TYPE_DICT = {'SWM': Swimming, 'RUN': Running, 'WLK': SportsWalking}
-
 
 def read_package(workout_type: str, data: str) -> Training:
     """Читает данные полученные от датчиков.
@@ -236,23 +618,3565 @@ def read_package(workout_type: str, data: str) -> Training:
         raise Exception(f'Неправильные входные данные: {err}')
 
 
-def main(training: Training) -> float:
-    """Главная функция."""
+def read_batch(
+    workout_type: str, *columns: Sequence[float]
+) -> Tuple[array, array, array]:
+    """Рассчитывает показатели для блока однотипных тренировок.
 
-    print(training.show_training_info().get_message())
+    Args:
+        workout_type: тип тренировки
+        columns: столбцы параметров в порядке `FIELDS` класса тренировки
 
+    Returns:
+        Столбцы дистанции, средней скорости и потраченных калорий.
+    """
 
-if __name__ == '__main__':
-    with open('packag.csv') as reader:
-        packages = csv.reader()
+    try:
+        training = TYPE_DICT[workout_type]
+    except KeyError as err:
+        raise Exception(f'Неправильные входные данные: {err}')
+    if len(columns) != len(training.FIELDS):
+        raise Exception(
+            f'Неправильные входные данные: {training.__name__}: ожидалось '
+            f'{len(training.FIELDS)} столбцов, получено {len(columns)}'
+        )
+    if len(set(map(len, columns))) > 1:
+        raise Exception('Неправильные входные данные: разная длина столбцов')
+    try:
+        results = training.batch_kernel(*columns)
+    except (TypeError, ValueError, ArithmeticError) as err:
+        raise Exception(f'Неправильные входные данные: {err}')
+    if not all(map(isfinite, chain.from_iterable(results))):
+        raise Exception(
+            f'Неправильные входные данные: {training.__name__}: '
+            'показатели вне допустимого диапазона'
+        )
+    return results
 
-    for workout_type, data in packages:
-        try:
-            main(
-                read_package(
-                    workout_type, data,
-                    list(float)
-                ),
+
+RESULT_FIELDS = ('training_type', 'duration', 'distance', 'speed', 'calories')
+RESULT_WIDTH = 3  # дистанция, скорость и калории в слоте конвейера
+FAILED_RESULT = (float('nan'),) * RESULT_WIDTH  # расчёт пакета не удался
+NPY_MAGIC = b'\x93NUMPY\x01\x00'
+NPY_HEADER_SIZE = 128
+
+WORKER_FD_ENV = 'HOMEWORK_WORKER_FD'
+HTTP_MAX_BODY = 16 * 1024 * 1024
+MICRO_BATCH_MAX = 1024
+ARRIVAL_SMOOTHING = 0.1
+METRICS_INTERVAL = 1.0
+HTTP_IDLE_TIMEOUT = 60
+
+BINARY_MAGIC = b'HWPK\x01\x00\x00\x00'
+BINARY_CODES = ('SWM', 'RUN', 'WLK')
+BINARY_FIELDS = 1 + max(
+    len(TYPE_DICT[code].FIELDS) for code in BINARY_CODES
+)
+BINARY_INDEX = {code: float(index) for index, code in enumerate(BINARY_CODES)}
+BINARY_PADDING = [0.0] * BINARY_FIELDS
+
+
+def get_decoder(workout_type: str) -> Union[PackageDecoder, PackageError]:
+    """Возвращает декодер для кода тренировки или описание ошибки.
+
+    Код может нести id пакета после `@` (`RUN@watch-7/1042`), такой id
+    при разборе отбрасывается.
+    """
+
+    decoder = DECODERS.get(workout_type)
+    if decoder is None and '@' in workout_type:
+        decoder = DECODERS.get(workout_type.partition('@')[0])
+    if decoder is None:
+        return PackageError(
+            'type', f'неизвестный тип тренировки: {workout_type!r}'
+        )
+    return decoder
+
+
+def decode_package(
+    workout_type: str, data: Sequence[str]
+) -> Union[Training, PackageError]:
+    """Разбирает строковые поля пакета без подъёма исключений.
+
+    Args:
+        workout_type: тип тренировки
+        data: строковые параметры пакета
+    """
+
+    decoder = get_decoder(workout_type)
+    if isinstance(decoder, PackageError):
+        return decoder
+    return decoder.decode(data)
+
+
+def info_package(
+    workout_type: str, data: Sequence[str]
+) -> Union[InfoMessage, PackageError]:
+    """Разбирает пакет и рассчитывает сообщение без объекта тренировки."""
+
+    decoder = get_decoder(workout_type)
+    if isinstance(decoder, PackageError):
+        return decoder
+    return decoder.info(data)
+
+
+def package_athlete(workout_type: str) -> str:
+    """Возвращает id устройства из кода пакета `RUN@watch-7/1042`.
+
+    Пакеты без id относятся к спортсмену с пустым id.
+    """
+
+    return workout_type.partition('@')[2].partition('/')[0]
+
+
+def parse_package(
+    workout_type: str, data: Sequence[str]
+) -> Union[List[float], PackageError]:
+    """Разбирает строковые поля пакета в числа, не создавая тренировку."""
+
+    decoder = get_decoder(workout_type)
+    if isinstance(decoder, PackageError):
+        return decoder
+    return decoder.parse(data)
+
+
+class WorkoutStore:
+    """Хранилище пакетов по столбцам, отдельно для каждого кода тренировки.
+
+    Вместо объекта `Training` на каждый пакет хранит параметры в столбцах
+    `array('d')`; объекты и сообщения создаются только по запросу.
+    """
+
+    def __init__(self) -> None:
+        self._columns: Dict[str, List[array]] = {}
+
+    def __len__(self) -> int:
+        return sum(map(self.count, self._columns))
+
+    def count(self, workout_type: str) -> int:
+        """Возвращает число пакетов с данным кодом тренировки."""
+
+        columns = self._columns.get(workout_type)
+        return len(columns[0]) if columns else 0
+
+    def append(self, workout_type: str, data: Sequence[float]) -> None:
+        """Добавляет пакет в хранилище.
+
+        Raises:
+            Exception: неизвестный код тренировки или неверное число
+            параметров
+        """
+
+        columns = self._columns.get(workout_type)
+        if columns is None:
+            try:
+                training = TYPE_DICT[workout_type]
+            except KeyError as err:
+                raise Exception(f'Неправильные входные данные: {err}')
+            columns = self._columns[workout_type] = [
+                array('d')
+                for _ in inspect.signature(training).parameters
+            ]
+        if len(data) != len(columns):
+            raise Exception(
+                'Неправильные входные данные: '
+                f'ожидалось {len(columns)} параметров, получено {len(data)}'
+            )
+        for column, value in zip(columns, data):
+            column.append(value)
+
+    def columns(
+        self, workout_type: str, index: slice = slice(None)
+    ) -> List[array]:
+        """Возвращает столбцы параметров для среза пакетов одного типа."""
+
+        return [column[index] for column in self._columns[workout_type]]
+
+    def trainings(
+        self, workout_type: str, index: slice = slice(None)
+    ) -> Iterator[Training]:
+        """Лениво создаёт объекты тренировок для среза пакетов."""
+
+        training = TYPE_DICT[workout_type]
+        for data in zip(*self.columns(workout_type, index)):
+            yield training(*data)
+
+    def messages(
+        self, workout_type: str, index: slice = slice(None)
+    ) -> Iterator[InfoMessage]:
+        """Лениво формирует сообщения для среза пакетов.
+
+        Показатели считаются пакетно через `read_batch`, без создания
+        объектов `Training`.
+        """
+
+        columns = self.columns(workout_type, index)
+        name = TYPE_DICT[workout_type].__name__
+        for duration, distance, speed, calories in zip(
+            columns[1], *read_batch(workout_type, *columns)
+        ):
+            yield InfoMessage(name, duration, distance, speed, calories)
+
+
+@dataclass
+class Totals:
+    """Накопленные итоги тренировок за период.
+
+    Attributes:
+        distance: дистанция в км
+        calories: потраченные калории
+        duration: время тренировок в часах
+        count: число тренировок
+    """
+
+    __slots__ = ('distance', 'calories', 'duration', 'count')
+
+    distance: float
+    calories: float
+    duration: float
+    count: int
+
+    @property
+    def mean_speed(self) -> float:
+        """Средняя скорость за период в км/ч."""
+
+        return self.distance / self.duration if self.duration else 0.0
+
+    def add(self, info: InfoMessage) -> None:
+        """Добавляет тренировку к итогам."""
+
+        self.distance += info.distance
+        self.calories += info.calories
+        self.duration += info.duration
+        self.count += 1
+
+    def merge(self, other: 'Totals') -> None:
+        """Добавляет к итогам итоги другого периода или группы."""
+
+        self.distance += other.distance
+        self.calories += other.calories
+        self.duration += other.duration
+        self.count += other.count
+
+
+def _atomic_write(path: str, *chunks: Union[str, bytes]) -> None:
+    """Записывает `chunks` во временный файл и подменяет им `path`.
+
+    Читатель видит либо старое, либо новое содержимое файла целиком.
+    Части — все строки или все байты.
+    """
+
+    temporary = f'{path}.tmp'
+    if chunks and isinstance(chunks[0], bytes):
+        file = open(temporary, 'wb')
+    else:
+        file = open(temporary, 'w', encoding='utf-8')
+    with file:
+        for chunk in chunks:
+            file.write(chunk)
+    os.replace(temporary, path)
+
+
+class AthleteAggregator:
+    """Итоги тренировок по спортсменам, видам тренировок, дням и неделям.
+
+    Каждое сообщение обновляет два счётчика за постоянное время, поэтому
+    итоги не требуют повторного чтения старых сообщений. Состояние можно
+    сохранить в JSON-файл и загрузить после перезапуска.
+    """
+
+    def __init__(self) -> None:
+        self.daily: Dict[Tuple[str, str, str], Totals] = {}
+        self.weekly: Dict[Tuple[str, str, str], Totals] = {}
+
+    @staticmethod
+    def week(day: date) -> str:
+        """Возвращает ISO-неделю дня в виде `2024-W05`."""
+
+        year, week, _ = day.isocalendar()
+        return f'{year}-W{week:02d}'
+
+    def add(self, athlete: str, info: InfoMessage, day: date) -> None:
+        """Учитывает результат `show_training_info` спортсмена за день."""
+
+        for totals, key in (
+            (self.daily, (athlete, info.training_type, day.isoformat())),
+            (self.weekly, (athlete, info.training_type, self.week(day))),
+        ):
+            period = totals.get(key)
+            if period is None:
+                period = totals[key] = Totals(0.0, 0.0, 0.0, 0)
+            period.add(info)
+
+    def day_totals(
+        self, athlete: str, training_type: str, day: date
+    ) -> Totals:
+        """Возвращает итоги спортсмена за день."""
+
+        key = athlete, training_type, day.isoformat()
+        return self.daily.get(key, Totals(0.0, 0.0, 0.0, 0))
+
+    def week_totals(
+        self, athlete: str, training_type: str, day: date
+    ) -> Totals:
+        """Возвращает итоги спортсмена за неделю, в которую входит день."""
+
+        key = athlete, training_type, self.week(day)
+        return self.weekly.get(key, Totals(0.0, 0.0, 0.0, 0))
+
+    def prune(self, before: date) -> None:
+        """Удаляет итоги за дни и недели раньше `before`."""
+
+        day, week = before.isoformat(), self.week(before)
+        self.daily = {
+            key: value for key, value in self.daily.items() if key[2] >= day
+        }
+        self.weekly = {
+            key: value for key, value in self.weekly.items()
+            if key[2] >= week
+        }
+
+    def save(self, path: str) -> None:
+        """Атомарно сохраняет итоги в JSON-файл."""
+
+        state = {
+            name: [
+                [*key, value.distance, value.calories, value.duration,
+                 value.count]
+                for key, value in totals.items()
+            ]
+            for name, totals in (
+                ('daily', self.daily), ('weekly', self.weekly)
+            )
+        }
+        _atomic_write(path, json.dumps(state, ensure_ascii=False))
+
+    @classmethod
+    def load(cls, path: str) -> 'AthleteAggregator':
+        """Загружает итоги, сохранённые методом `save`."""
+
+        with open(path, encoding='utf-8') as file:
+            state = json.load(file)
+        aggregator = cls()
+        for name in ('daily', 'weekly'):
+            totals = getattr(aggregator, name)
+            for athlete, training_type, period, *values in state[name]:
+                totals[athlete, training_type, period] = Totals(*values)
+        return aggregator
+
+
+SKETCH_MIN_VALUE = 1e-9
+REPORT_GROUP_SIZE = 512  # оценка памяти на группу отчёта в байтах
+REPORT_FAN_IN = 64
+REPORT_QUANTILES = (0.5, 0.9, 0.99)
+
+
+class QuantileSketch:
+    """Приближённые квантили с ограниченной относительной ошибкой.
+
+    Значения раскладываются по логарифмическим корзинам с основанием
+    `gamma = (1 + alpha) / (1 - alpha)`: квантиль возвращается с
+    относительной ошибкой не больше `alpha`, а число корзин растёт
+    с логарифмом диапазона значений, а не с их числом.
+
+    Attributes:
+        alpha: допустимая относительная ошибка квантилей
+        count: число учтённых значений
+    """
+
+    __slots__ = (
+        'alpha', 'count', '_zeros', '_gamma', '_log_gamma', '_positive',
+        '_negative',
+    )
+
+    def __init__(self, alpha: float = 0.01) -> None:
+        if not 0 < alpha < 1:
+            raise Exception(
+                f'Неправильные входные данные: точность {alpha} вне (0, 1)'
+            )
+        self.alpha = alpha
+        self.count = 0
+        self._zeros = 0
+        self._gamma = (1 + alpha) / (1 - alpha)
+        self._log_gamma = log(self._gamma)
+        self._positive: Dict[int, int] = defaultdict(int)
+        self._negative: Dict[int, int] = defaultdict(int)
+
+    @property
+    def bins(self) -> int:
+        """Число непустых корзин."""
+
+        return len(self._positive) + len(self._negative) + bool(self._zeros)
+
+    def add(self, value: float, count: int = 1) -> None:
+        """Учитывает значение `count` раз, кроме бесконечностей и NaN."""
+
+        if not isfinite(value):
+            return
+        self.count += count
+        if value > SKETCH_MIN_VALUE:
+            self._positive[ceil(log(value) / self._log_gamma)] += count
+        elif value < -SKETCH_MIN_VALUE:
+            self._negative[ceil(log(-value) / self._log_gamma)] += count
+        else:
+            self._zeros += count
+
+    def merge(self, other: 'QuantileSketch') -> None:
+        """Добавляет значения другого наброска с той же точностью."""
+
+        if other.alpha != self.alpha:
+            raise Exception(
+                'Неправильные входные данные: '
+                f'точность {other.alpha} вместо {self.alpha}'
+            )
+        self.count += other.count
+        self._zeros += other._zeros
+        for bins, other_bins in (
+            (self._positive, other._positive),
+            (self._negative, other._negative),
+        ):
+            for key, number in other_bins.items():
+                bins[key] += number
+
+    def _bins(self) -> Iterator[Tuple[float, int]]:
+        """Возвращает оценки значений корзин и их счётчики по возрастанию."""
+
+        for key in sorted(self._negative, reverse=True):
+            yield -self._estimate(key), self._negative[key]
+        if self._zeros:
+            yield 0.0, self._zeros
+        for key in sorted(self._positive):
+            yield self._estimate(key), self._positive[key]
+
+    def _estimate(self, key: int) -> float:
+        """Возвращает середину корзины `(gamma^(key-1), gamma^key]`."""
+
+        return 2 * exp(key * self._log_gamma) / (self._gamma + 1)
+
+    def quantile(self, q: float) -> float:
+        """Возвращает квантиль уровня `q` из [0, 1], 0 без значений."""
+
+        if not 0 <= q <= 1:
+            raise Exception(
+                f'Неправильные входные данные: уровень {q} вне [0, 1]'
             )
-        except (KeyError, TypeError, ValueError) as err:
-            print(f'Неправильные входные данные: {err}')
+        rank = q * (self.count - 1)
+        seen = 0
+        value = 0.0
+        for value, number in self._bins():
+            seen += number
+            if seen > rank:
+                break
+        return value
+
+
+@dataclass
+class TypeReport:
+    """Отчёт по одному виду тренировок.
+
+    Attributes:
+        training_type: вид тренировки
+        totals: итоги всех тренировок вида
+        athletes: число спортсменов
+        speed: квантили скорости по уровням
+        calories: квантили калорий за тренировку по уровням
+        top: спортсмены с наибольшими калориями и их калории
+    """
+
+    training_type: str
+    totals: Totals
+    athletes: int
+    speed: Dict[float, float]
+    calories: Dict[float, float]
+    top: List[Tuple[str, float]]
+
+
+class SpillingReport:
+    """Отчёт по видам тренировок и спортсменам для данных больше памяти.
+
+    Итоги копятся в словаре по ключу (вид тренировки, спортсмен). Когда
+    групп становится больше `max_groups`, словарь сортируется и
+    сбрасывается во временный файл-серию, а в конце серии сливаются
+    `heapq.merge` с суммированием итогов одной группы. Квантили скорости
+    и калорий считаются набросками `QuantileSketch` без сортировки.
+
+    Attributes:
+        max_groups: наибольшее число групп в памяти
+        top: размер списка спортсменов с наибольшими калориями
+        spills: число сброшенных на диск серий
+    """
+
+    def __init__(
+        self,
+        memory: int,
+        top: int = 10,
+        alpha: float = 0.01,
+        directory: Optional[str] = None,
+    ) -> None:
+        self.max_groups = max(1, memory // REPORT_GROUP_SIZE)
+        self.top = top
+        self.spills = 0
+        self._alpha = alpha
+        self._groups: Dict[Tuple[str, str], Totals] = {}
+        self._sketches: Dict[str, Tuple[QuantileSketch, QuantileSketch]] = {}
+        self._runs: List[str] = []
+        self._written = 0
+        self._directory = tempfile.TemporaryDirectory(
+            prefix='homework-report-', dir=directory
+        )
+
+    def __enter__(self) -> 'SpillingReport':
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def add(self, athlete: str, info: InfoMessage) -> None:
+        """Учитывает результат `show_training_info` спортсмена."""
+
+        key = info.training_type, athlete
+        totals = self._groups.get(key)
+        if totals is None:
+            if len(self._groups) >= self.max_groups:
+                self._spill()
+            totals = self._groups[key] = Totals(0.0, 0.0, 0.0, 0)
+        totals.add(info)
+        sketches = self._sketches.get(info.training_type)
+        if sketches is None:
+            sketches = self._sketches[info.training_type] = (
+                QuantileSketch(self._alpha), QuantileSketch(self._alpha)
+            )
+        sketches[0].add(info.speed)
+        sketches[1].add(info.calories)
+
+    def _spill(self) -> None:
+        """Сбрасывает отсортированные группы из памяти в новую серию."""
+
+        self._runs.append(self._write_run(sorted(self._groups.items())))
+        self._groups = {}
+        self.spills += 1
+
+    def _write_run(
+        self, groups: Iterable[Tuple[Tuple[str, str], Totals]]
+    ) -> str:
+        """Записывает отсортированные группы в файл серии."""
+
+        path = os.path.join(self._directory.name, f'{self._written}.csv')
+        self._written += 1
+        with open(path, 'w', newline='', encoding='utf-8') as file:
+            writer = csv.writer(file)
+            for key, totals in groups:
+                writer.writerow([
+                    *key, totals.distance, totals.calories, totals.duration,
+                    totals.count,
+                ])
+        return path
+
+    @staticmethod
+    def _read_run(path: str) -> Iterator[Tuple[Tuple[str, str], Totals]]:
+        """Читает серию и удаляет её файл после чтения."""
+
+        with open(path, newline='', encoding='utf-8') as file:
+            for training_type, athlete, *values in csv.reader(file):
+                distance, calories, duration, count = values
+                yield (training_type, athlete), Totals(
+                    float(distance), float(calories), float(duration),
+                    int(count),
+                )
+        os.unlink(path)
+
+    @staticmethod
+    def _merge(
+        runs: Iterable[Iterator[Tuple[Tuple[str, str], Totals]]]
+    ) -> Iterator[Tuple[Tuple[str, str], Totals]]:
+        """Сливает отсортированные серии, складывая итоги одной группы."""
+
+        merged = heapq.merge(*runs, key=itemgetter(0))
+        for key, items in groupby(merged, key=itemgetter(0)):
+            _, totals = next(items)
+            for _, other in items:
+                totals.merge(other)
+            yield key, totals
+
+    def groups(self) -> Iterator[Tuple[Tuple[str, str], Totals]]:
+        """Возвращает итоги групп по порядку вида тренировки и спортсмена.
+
+        За раз сливается не больше `REPORT_FAN_IN` серий, лишние серии
+        сначала сливаются в промежуточные. Итоги выдаются один раз.
+        """
+
+        while len(self._runs) > REPORT_FAN_IN:
+            runs = self._runs[:REPORT_FAN_IN]
+            del self._runs[:REPORT_FAN_IN]
+            self._runs.append(
+                self._write_run(self._merge(map(self._read_run, runs)))
+            )
+        runs, self._runs = self._runs, []
+        memory, self._groups = sorted(self._groups.items()), {}
+        yield from self._merge([*map(self._read_run, runs), iter(memory)])
+
+    def _type_report(
+        self,
+        training_type: str,
+        groups: Iterable[Tuple[Tuple[str, str], Totals]],
+        quantiles: Sequence[float],
+    ) -> TypeReport:
+        """Собирает отчёт по группам одного вида тренировок."""
+
+        totals = Totals(0.0, 0.0, 0.0, 0)
+        top: List[Tuple[float, str]] = []
+        athletes = 0
+        for (_, athlete), group in groups:
+            totals.merge(group)
+            athletes += 1
+            item = group.calories, athlete
+            if len(top) < self.top:
+                heapq.heappush(top, item)
+            elif top and item > top[0]:
+                heapq.heapreplace(top, item)
+        speed, calories = self._sketches[training_type]
+        return TypeReport(
+            training_type, totals, athletes,
+            {q: speed.quantile(q) for q in quantiles},
+            {q: calories.quantile(q) for q in quantiles},
+            [
+                (athlete, value) for value, athlete
+                in sorted(top, key=lambda item: (-item[0], item[1]))
+            ],
+        )
+
+    def report(
+        self, quantiles: Sequence[float] = REPORT_QUANTILES
+    ) -> Iterator[TypeReport]:
+        """Сливает группы и выдаёт отчёты по видам тренировок по порядку."""
+
+        for training_type, groups in groupby(
+            self.groups(), key=lambda item: item[0][0]
+        ):
+            yield self._type_report(training_type, groups, quantiles)
+
+    def close(self) -> None:
+        """Удаляет временные файлы серий."""
+
+        self._directory.cleanup()
+
+
+class LiveSession:
+    """Потоковый расчёт показателей идущей тренировки по отсчётам датчика.
+
+    Отсчёт — время в секундах и прирост счётчиков `COUNTERS` класса
+    тренировки с прошлого отсчёта (шаги или гребки, для плавания ещё и
+    пройденные бассейны). Остальные параметры пакета, кроме длительности,
+    задаются при создании сессии. Для каждого отсчёта за постоянное время
+    считаются показатели за всю тренировку и за скользящее окно по тем же
+    формулам, что и у пакетов. Окно хранится кольцом из `buckets` корзин,
+    поэтому память сессии не зависит от частоты и числа отсчётов. Окно
+    точнее, когда интервал между отсчётами много меньше длины окна.
+
+    Attributes:
+        training: класс тренировки
+        window: длина окна в секундах
+        start: время начала тренировки, по умолчанию время первого отсчёта
+    """
+
+    __slots__ = (
+        'training', 'window', 'start', '_width', '_buckets', '_slots',
+        '_window_sums', '_totals', '_head', '_last', '_arguments',
+        '_duration_index', '_counter_indexes',
+    )
+
+    def __init__(
+        self,
+        workout_type: str,
+        *fields: float,
+        window: float = 300.0,
+        buckets: int = 60,
+        start: Optional[float] = None,
+    ) -> None:
+        try:
+            training = TYPE_DICT[workout_type]
+        except KeyError as err:
+            raise Exception(f'Неправильные входные данные: {err}')
+        counters = training.COUNTERS
+        constants = [
+            name for name in training.FIELDS
+            if name != 'duration' and name not in counters
+        ]
+        if len(fields) != len(constants):
+            raise Exception(
+                f'Неправильные входные данные: {training.__name__}: '
+                f'ожидались параметры {", ".join(constants)}'
+            )
+        for name, value in zip(constants, fields):
+            if not isfinite(value) or value < 0 or (
+                not value and name in training.NONZERO
+            ):
+                raise Exception(
+                    f'Неправильные входные данные: {training.__name__}: '
+                    f'недопустимое значение {name}: {value!r}'
+                )
+        if not window > 0 or buckets < 1:
+            raise Exception(
+                'Неправильные входные данные: длина окна и число корзин '
+                'должны быть больше 0'
+            )
+        self.training = training
+        self.window = window
+        self.start = start
+        self._width = window / buckets
+        self._buckets = buckets
+        self._slots = [[0.0] * len(counters) for _ in range(buckets)]
+        self._window_sums = [0.0] * len(counters)
+        self._totals = [0.0] * len(counters)
+        self._head = 0
+        self._last = start
+        values = dict(zip(constants, fields))
+        self._arguments = [values.get(name, 0.0) for name in training.FIELDS]
+        self._duration_index = training.FIELDS.index('duration')
+        self._counter_indexes = [
+            training.FIELDS.index(name) for name in counters
+        ]
+
+    def check(
+        self, timestamp: float, *counts: float
+    ) -> Optional[PackageError]:
+        """Возвращает описание ошибки отсчёта или `None`."""
+
+        if len(counts) != len(self._totals):
+            return PackageError(
+                'arity',
+                f'ожидались счётчики {", ".join(self.training.COUNTERS)}',
+            )
+        if not isfinite(timestamp) or not all(map(isfinite, counts)):
+            return PackageError('format', 'неверные числа в отсчёте')
+        return None
+
+    def add(
+        self, timestamp: float, *counts: float
+    ) -> Tuple[InfoMessage, InfoMessage]:
+        """Учитывает отсчёт за интервал, закончившийся в `timestamp`.
+
+        Отсчёты с временем раньше предыдущего относятся к текущему
+        интервалу.
+
+        Returns:
+            Сообщения за скользящее окно и за всю тренировку.
+
+        Raises:
+            ArithmeticError: показатели вне допустимого диапазона
+        """
+
+        error = self.check(timestamp, *counts)
+        if error is not None:
+            raise Exception(f'Неправильные входные данные: {error.message}')
+        if self._last is None:
+            self.start = self._last = timestamp
+        timestamp = self._last = max(timestamp, self._last)
+
+        # Интервал попадает в корзину своего конца, устаревшие корзины
+        # вычитаются из суммы окна. Очищается не больше `buckets` корзин.
+        slot = int((timestamp - self.start) // self._width)
+        buckets = self._buckets
+        sums = self._window_sums
+        if slot > self._head:
+            for stale in range(
+                max(self._head + 1, slot - buckets + 1), slot + 1
+            ):
+                values = self._slots[stale % buckets]
+                for index, value in enumerate(values):
+                    sums[index] -= value
+                    values[index] = 0.0
+            self._head = slot
+        values = self._slots[self._head % buckets]
+        totals = self._totals
+        for index, count in enumerate(counts):
+            values[index] += count
+            sums[index] += count
+            totals[index] += count
+
+        elapsed = timestamp - self.start
+        return (
+            self._message(sums, min(self.window, elapsed)),
+            self._message(totals, elapsed),
+        )
+
+    def _message(self, counts: List[float], seconds: float) -> InfoMessage:
+        hours = seconds / 3600
+        if hours <= 0:
+            return InfoMessage(self.training.__name__, 0.0, 0.0, 0.0, 0.0)
+        arguments = self._arguments
+        arguments[self._duration_index] = hours
+        for index, count in zip(self._counter_indexes, counts):
+            arguments[index] = count
+        results = self.training.kernel(*arguments)
+        if not all(map(isfinite, results)):
+            raise OverflowError('показатели вне допустимого диапазона')
+        return InfoMessage(self.training.__name__, hours, *results)
+
+
+class PackageFile:
+    """Файл пакетов в двоичном формате, отображённый в память.
+
+    После заголовка `BINARY_MAGIC` идут записи из шести чисел `double`
+    (little-endian): номер кода тренировки в `BINARY_CODES` и до пяти
+    параметров пакета, недостающие параметры равны нулю. Столбцы
+    отдаются как `memoryview` поверх отображения файла без копирования.
+    Перед `close` все полученные столбцы нужно освободить.
+
+    Attributes:
+        count: число пакетов в файле
+    """
+
+    def __init__(self, path: str) -> None:
+        if sys.byteorder != 'little':
+            raise Exception('Двоичный формат поддерживается только на '
+                            'little-endian платформах')
+        with open(path, 'rb') as file:
+            size = os.fstat(file.fileno()).st_size - len(BINARY_MAGIC)
+            if size < 0 or size % (8 * BINARY_FIELDS):
+                raise Exception(
+                    f'Неправильный формат файла пакетов: {path}: размер '
+                    'не кратен записи, файл пуст или обрезан'
+                )
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(BINARY_MAGIC)] != BINARY_MAGIC:
+            self._map.close()
+            raise Exception(f'Неправильный формат файла пакетов: {path}')
+        self._values = memoryview(self._map)[len(BINARY_MAGIC):].cast('d')
+        self.count = len(self._values) // BINARY_FIELDS
+
+    def __enter__(self) -> 'PackageFile':
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def column(self, index: int) -> memoryview:
+        """Возвращает столбец записи без копирования.
+
+        Args:
+            index: 0 — номер кода тренировки, 1–5 — параметры пакета
+        """
+
+        return self._values[index::BINARY_FIELDS]
+
+    def columns(self, workout_type: str) -> List[array]:
+        """Возвращает столбцы параметров пакетов одного типа.
+
+        В отличие от `column`, столбцы копируются: записи разных типов
+        в файле перемешаны, поэтому пакеты одного типа отбираются
+        проходом по всему столбцу кодов и по каждому нужному столбцу.
+        """
+
+        code = BINARY_CODES.index(workout_type)
+        codes = self.column(0)
+        selectors = [value == code for value in codes]
+        arity = len(DECODERS[workout_type].types)
+        try:
+            return [
+                array('d', compress(self.column(index), selectors))
+                for index in range(1, arity + 1)
+            ]
+        finally:
+            codes.release()
+
+    def read_batch(self, workout_type: str) -> Tuple[array, array, array]:
+        """Рассчитывает показатели для всех пакетов одного типа."""
+
+        return read_batch(workout_type, *self.columns(workout_type))
+
+    def close(self) -> None:
+        """Освобождает отображение файла."""
+
+        self._values.release()
+        self._map.close()
+
+
+def pack_package(
+    buffer: array, workout_type: str, data: Sequence[str]
+) -> Optional[PackageError]:
+    """Дописывает пакет в `buffer` записью двоичного формата `PackageFile`.
+
+    Returns:
+        Описание ошибки для неправильного пакета, иначе `None`.
+    """
+
+    values = parse_package(workout_type, data)
+    if isinstance(values, PackageError):
+        return values
+    code = BINARY_INDEX.get(workout_type.partition('@')[0])
+    if code is None:
+        return PackageError(
+            'type',
+            f'тип тренировки {workout_type!r} не поддерживается '
+            'двоичным форматом',
+        )
+    buffer.append(code)
+    buffer.extend(values)
+    buffer.extend(BINARY_PADDING[len(values) + 1:])
+    return None
+
+
+def convert_to_binary(
+    lines: Iterable[str],
+    path: str,
+    dead_letters: Optional['DeadLetterSink'] = None,
+) -> Tuple[int, int]:
+    """Переводит пакеты из CSV в двоичный формат `PackageFile`.
+
+    Args:
+        lines: строки CSV с пакетами
+        path: путь к создаваемому двоичному файлу
+        dead_letters: карантин для неправильных пакетов
+
+    Returns:
+        Число записанных и число отклонённых пакетов.
+    """
+
+    written = rejected = 0
+    buffer = array('d')
+    with open(path, 'wb') as file:
+        file.write(BINARY_MAGIC)
+        for number, workout_type, data in read_rows(lines):
+            error = pack_package(buffer, workout_type, data)
+            if error is not None:
+                rejected += 1
+                if dead_letters is not None:
+                    dead_letters.reject(number, workout_type, data, error)
+                continue
+            written += 1
+            if len(buffer) >= WRITE_BATCH_SIZE * BINARY_FIELDS:
+                buffer.tofile(file)
+                del buffer[:]
+        buffer.tofile(file)
+    return written, rejected
+
+
+def main(training: Training) -> float:
+    """Главная функция."""
+
+    print(training.show_training_info().get_message())
+
+
+def read_rows(
+    lines: Iterable[str], position: Optional[Callable[[], int]] = None
+) -> Iterator[Tuple[int, str, List[str]]]:
+    """Лениво читает пакеты из строк CSV.
+
+    Args:
+        lines: строки вида `RUN,15000,1,75`
+        position: возвращает позицию последней прочитанной строки вместо
+            её номера, например смещение в байтах у `FileFollower`
+
+    Yields:
+        Номер строки пакета во входном потоке, код тренировки и список
+        его параметров.
+    """
+
+    reader = csv.reader(lines)
+    if position is None:
+        for row in reader:
+            if row:
+                yield reader.line_num, row[0], row[1:]
+        return
+    for row in reader:
+        if row:
+            yield position(), row[0], row[1:]
+
+
+class MessageWriter:
+    """Буферизованный вывод сообщений о тренировках.
+
+    Сообщения копятся в буфере и записываются в поток одним вызовом
+    `write`, когда в буфере набирается `batch_size` строк. Для терминала
+    по умолчанию строки пишутся сразу.
+
+    Attributes:
+        batch_size: число строк в буфере до записи в поток
+    """
+
+    def __init__(
+        self,
+        stream: Optional[TextIO] = None,
+        batch_size: Optional[int] = None,
+    ) -> None:
+        self._stream = sys.stdout if stream is None else stream
+        if batch_size is None:
+            batch_size = 1 if self._stream.isatty() else WRITE_BATCH_SIZE
+        self.batch_size = batch_size
+        self._buffer: List[str] = []
+
+    def __enter__(self) -> 'MessageWriter':
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.flush()
+
+    def write_line(self, line: str) -> None:
+        """Добавляет строку в буфер."""
+
+        self._buffer.append(line)
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def write(self, message: InfoMessage) -> None:
+        """Добавляет сообщение о тренировке в буфер."""
+
+        self.write_line(message.get_message())
+
+    def write_columns(
+        self,
+        training_type: str,
+        duration: Iterable[float],
+        distance: Iterable[float],
+        speed: Iterable[float],
+        calories: Iterable[float],
+    ) -> None:
+        """Добавляет сообщения для столбцов пакетного расчёта."""
+
+        template = InfoMessage.MESSAGE.format
+        for row in zip(duration, distance, speed, calories):
+            self.write_line(template(training_type, *row))
+
+    def reject(
+        self,
+        number: int,
+        workout_type: str,
+        data: Sequence[str],
+        error: PackageError,
+    ) -> None:
+        """Пишет ошибку разбора пакета в тот же поток, что и сообщения."""
+
+        self.write_line(f'Неправильные входные данные: {error.message}')
+
+    def flush(self) -> None:
+        """Записывает буфер в поток."""
+
+        if self._buffer:
+            self._buffer.append('')
+            self._stream.write('\n'.join(self._buffer))
+            self._buffer.clear()
+        self._stream.flush()
+
+
+def _npy_header(descr: str, count: int) -> bytes:
+    """Возвращает заголовок `.npy` версии 1.0 фиксированной длины."""
+
+    header = (
+        f"{{'descr': '{descr}', 'fortran_order': False, "
+        f"'shape': ({count},), }}"
+    ).encode('ascii')
+    padding = NPY_HEADER_SIZE - len(NPY_MAGIC) - 2 - len(header) - 1
+    return (
+        NPY_MAGIC
+        + struct.pack('<H', NPY_HEADER_SIZE - len(NPY_MAGIC) - 2)
+        + header + b' ' * padding + b'\n'
+    )
+
+
+class ResultWriter:
+    """Запись результатов в столбцы формата `.npy`.
+
+    Для каждого поля `InfoMessage` в каталоге создаётся свой файл:
+    `training_type.npy` со строками фиксированной длины и файлы с числами
+    `double` для остальных полей. Значения копятся в буфере и дописываются
+    большими блоками, размер массива в заголовке обновляется при `close`.
+    Файлы читаются `numpy.load(..., mmap_mode='r')` или `ResultColumns`.
+
+    Attributes:
+        count: число записанных результатов
+    """
+
+    def __init__(self, directory: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+        width = max(len(training.__name__) for training in TYPE_DICT.values())
+        self._type_descr = f'|S{width}'
+        self._files = {
+            name: open(os.path.join(directory, f'{name}.npy'), 'wb')
+            for name in RESULT_FIELDS
+        }
+        self._names = {
+            training.__name__: training.__name__.encode('ascii').ljust(
+                width, b'\0'
+            )
+            for training in TYPE_DICT.values()
+        }
+        self._types: List[bytes] = []
+        self._values = {name: array('d') for name in RESULT_FIELDS[1:]}
+        self._appends = tuple(
+            self._values[name].append for name in RESULT_FIELDS[1:]
+        )
+        self.count = 0
+        for file in self._files.values():
+            file.write(b'\0' * NPY_HEADER_SIZE)
+
+    def __enter__(self) -> 'ResultWriter':
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def write(self, message: InfoMessage) -> None:
+        """Добавляет результат в буфер."""
+
+        types = self._types
+        types.append(self._names[message.training_type])
+        duration, distance, speed, calories = self._appends
+        duration(message.duration)
+        distance(message.distance)
+        speed(message.speed)
+        calories(message.calories)
+        if len(types) >= WRITE_BATCH_SIZE:
+            self.flush()
+
+    def write_columns(
+        self,
+        training_type: str,
+        duration: Sequence[float],
+        distance: Sequence[float],
+        speed: Sequence[float],
+        calories: Sequence[float],
+    ) -> None:
+        """Добавляет столбцы пакетного расчёта."""
+
+        self._types.extend([self._names[training_type]] * len(duration))
+        for name, column in zip(
+            RESULT_FIELDS[1:], (duration, distance, speed, calories)
+        ):
+            self._values[name].extend(column)
+        self.flush()
+
+    def reject(
+        self,
+        number: int,
+        workout_type: str,
+        data: Sequence[str],
+        error: PackageError,
+    ) -> None:
+        """Печатает ошибку разбора пакета в stderr."""
+
+        print(f'Неправильные входные данные: {error.message}', file=sys.stderr)
+
+    def flush(self) -> None:
+        """Дописывает буфер в файлы."""
+
+        if not self._types:
+            return
+        self._files['training_type'].write(b''.join(self._types))
+        for name, values in self._values.items():
+            values.tofile(self._files[name])
+            del values[:]
+        self.count += len(self._types)
+        self._types.clear()
+
+    def close(self) -> None:
+        """Дописывает буфер, обновляет заголовки и закрывает файлы."""
+
+        self.flush()
+        for name, file in self._files.items():
+            descr = self._type_descr if name == 'training_type' else '<f8'
+            file.seek(0)
+            file.write(_npy_header(descr, self.count))
+            file.close()
+
+
+class ResultColumns:
+    """Столбцы результатов, записанные `ResultWriter`, отображённые в память.
+
+    Числовые столбцы отдаются как `memoryview` без копирования. Перед
+    `close` все полученные столбцы нужно освободить.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self._maps: Dict[str, mmap.mmap] = {}
+        self._views: Dict[str, memoryview] = {}
+        for name in RESULT_FIELDS:
+            with open(os.path.join(directory, f'{name}.npy'), 'rb') as file:
+                mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[name] = mapped
+            if mapped[:len(NPY_MAGIC)] != NPY_MAGIC:
+                self.close()
+                raise Exception(f'Неправильный формат файла: {name}.npy')
+            start = len(NPY_MAGIC) + 2
+            header_size = start + struct.unpack(
+                '<H', mapped[len(NPY_MAGIC):start]
+            )[0]
+            header = ast.literal_eval(
+                mapped[start:header_size].decode('ascii')
+            )
+            view = memoryview(mapped)[header_size:]
+            if name != 'training_type':
+                view = view.cast('d')
+            else:
+                self._type_width = int(header['descr'][2:])
+            self._views[name] = view
+        self.count = len(self._views['duration'])
+
+    def __enter__(self) -> 'ResultColumns':
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def column(self, name: str) -> memoryview:
+        """Возвращает числовой столбец без копирования."""
+
+        if name == 'training_type':
+            raise Exception('Для типа тренировки используйте training_type')
+        return self._views[name][:]
+
+    def training_type(self, index: int) -> str:
+        """Возвращает тип тренировки результата с номером `index`."""
+
+        width = self._type_width
+        raw = self._views['training_type'][index * width:(index + 1) * width]
+        return bytes(raw).rstrip(b'\0').decode('ascii')
+
+    def message(self, index: int) -> InfoMessage:
+        """Собирает `InfoMessage` для результата с номером `index`."""
+
+        views = self._views
+        return InfoMessage(
+            self.training_type(index),
+            *(views[name][index] for name in RESULT_FIELDS[1:]),
+        )
+
+    def close(self) -> None:
+        """Освобождает отображения файлов."""
+
+        for view in self._views.values():
+            view.release()
+        for mapped in self._maps.values():
+            mapped.close()
+
+
+class DeadLetterSink:
+    """Карантин для отклонённых пакетов.
+
+    Пишет пакеты в CSV-файл вместе с номером строки во входном потоке
+    (в режиме `--follow` — смещением строки в байтах), кодом и описанием
+    ошибки и считает ошибки по кодам.
+
+    Attributes:
+        counters: число отклонённых пакетов по кодам ошибок
+    """
+
+    def __init__(self, path: str) -> None:
+        self._file = open(path, 'a', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._file)
+        self.counters = Counter()
+
+    def __enter__(self) -> 'DeadLetterSink':
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def reject(
+        self,
+        number: int,
+        workout_type: str,
+        data: Sequence[str],
+        error: PackageError,
+    ) -> None:
+        """Сохраняет отклонённый пакет."""
+
+        self.counters[error.reason] += 1
+        self._writer.writerow(
+            [number, error.reason, error.message, workout_type, *data]
+        )
+
+    def close(self) -> None:
+        """Закрывает файл карантина."""
+
+        self._file.close()
+
+
+class StageMetrics:
+    """Счётчики и гистограммы задержек этапов обработки пакетов.
+
+    Этапы: `parse` — чтение строки, `decode` — разбор пакета,
+    `calories` — расчёт показателей, `format` — текст сообщения.
+    Значения хранятся отдельно для каждого кода тренировки.
+
+    Attributes:
+        BUCKETS: верхние границы корзин гистограммы в секундах
+    """
+
+    BUCKETS = (
+        1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 1e-3, 1e-2, inf
+    )
+
+    def __init__(self) -> None:
+        self._buckets: Dict[Tuple[str, str], List[int]] = {}
+        self._sums: Dict[Tuple[str, str], float] = defaultdict(float)
+        self.rejected = Counter()
+
+    def observe(self, stage: str, workout_type: str, seconds: float) -> None:
+        """Учитывает длительность этапа для одного пакета.
+
+        Id пакета (`RUN@watch-7/1042`) отрезается от кода тренировки.
+        """
+
+        workout_type = workout_type.partition('@')[0]
+        if workout_type not in TYPE_DICT:
+            workout_type = 'unknown'
+        key = stage, workout_type
+        buckets = self._buckets.get(key)
+        if buckets is None:
+            buckets = self._buckets[key] = [0] * len(self.BUCKETS)
+        buckets[bisect_left(self.BUCKETS, seconds)] += 1
+        self._sums[key] += seconds
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Возвращает копию всех значений в виде словаря."""
+
+        stages: Dict[str, Dict[str, Any]] = defaultdict(dict)
+        for (stage, workout_type), buckets in self._buckets.items():
+            stages[stage][workout_type] = {
+                'count': sum(buckets),
+                'sum': self._sums[stage, workout_type],
+                'buckets': dict(zip(map(str, self.BUCKETS), buckets)),
+            }
+        return {'stages': dict(stages), 'rejected': dict(self.rejected)}
+
+    def to_prometheus(self) -> str:
+        """Возвращает значения в текстовом формате Prometheus."""
+
+        lines = ['# TYPE homework_stage_seconds histogram']
+        for (stage, workout_type), buckets in sorted(self._buckets.items()):
+            labels = f'stage="{stage}",type="{workout_type}"'
+            total = 0
+            for bound, count in zip(self.BUCKETS, buckets):
+                total += count
+                le = '+Inf' if bound == inf else repr(bound)
+                lines.append(
+                    f'homework_stage_seconds_bucket{{{labels},le="{le}"}} '
+                    f'{total}'
+                )
+            lines.append(
+                f'homework_stage_seconds_sum{{{labels}}} '
+                f'{self._sums[stage, workout_type]!r}'
+            )
+            lines.append(f'homework_stage_seconds_count{{{labels}}} {total}')
+        lines.append('# TYPE homework_rejected_total counter')
+        for reason, count in sorted(self.rejected.items()):
+            lines.append(
+                f'homework_rejected_total{{reason="{reason}"}} {count}'
+            )
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path: str) -> None:
+        """Атомарно записывает значения в файл для сборщика метрик."""
+
+        _atomic_write(path, self.to_prometheus())
+
+
+def _info_fields(
+    workout_type: str, *data: str
+) -> Union[InfoMessage, PackageError]:
+    return info_package(workout_type, data)
+
+
+class ResultCache:
+    """Ограниченный LRU-кэш результатов для повторяющихся пакетов.
+
+    Ключ — код тренировки без id и строковые параметры пакета как есть,
+    поэтому пакеты с разными id дают одно попадание, а разбирается пакет
+    только при промахе. Параметры не нормализуются: даже обрезка пробелов
+    стоит на промахе дороже, чем экономит на редких попаданиях, так что
+    ` 15000` и `15000` — разные ключи. Значение — сообщение о тренировке
+    или ошибка разбора. Хранение и вытеснение идут через `lru_cache`,
+    чтобы промах стоил как можно меньше. Сообщения из кэша общие для всех
+    повторов пакета, их не следует изменять.
+
+    Промах дороже расчёта без кэша примерно на 0,5 мкс, а попадание
+    экономит около 2 мкс, поэтому при редких повторах кэш только мешает.
+    Поток пакетов спрашивает у `next_window`,
+    как считать следующие `WINDOW` пакетов. Если доля попаданий за окно
+    меньше `MIN_HIT_RATIO`, кэш отключается на `PAUSE_WINDOWS` окон,
+    пакеты которых считаются напрямую, а затем пробуется снова.
+
+    Attributes:
+        capacity: наибольшее число хранимых результатов
+        hits: число попаданий в кэш
+        misses: число промахов
+        evictions: число вытесненных результатов
+        bypassed: кэш отключён из-за редких попаданий
+    """
+
+    WINDOW = 8192
+    PAUSE_WINDOWS = 8
+    MIN_HIT_RATIO = 0.25
+
+    def __init__(self, capacity: int = 65536) -> None:
+        self.capacity = capacity
+        self.bypassed = False
+        self._paused = 0
+        self._window_start = (0, 0)
+        self._lookup = lru_cache(capacity)(_info_fields)
+
+    def __len__(self) -> int:
+        return self._lookup.cache_info().currsize
+
+    @property
+    def hits(self) -> int:
+        return self._lookup.cache_info().hits
+
+    @property
+    def misses(self) -> int:
+        return self._lookup.cache_info().misses
+
+    @property
+    def evictions(self) -> int:
+        # Каждый промах добавляет результат, лишние уже вытеснены.
+        info = self._lookup.cache_info()
+        return info.misses - info.currsize
+
+    @property
+    def hit_ratio(self) -> float:
+        """Доля попаданий среди всех обращений."""
+
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get_info(
+        self, workout_type: str, data: Sequence[str]
+    ) -> Union[InfoMessage, PackageError]:
+        """Возвращает результат обработки пакета, вычисляя его при промахе."""
+
+        if '@' in workout_type:
+            workout_type = workout_type.partition('@')[0]
+        return self._lookup(workout_type, *data)
+
+    def next_window(
+        self,
+    ) -> Callable[[str, Sequence[str]], Union[InfoMessage, PackageError]]:
+        """Возвращает функцию расчёта для следующих `WINDOW` пакетов.
+
+        Это `get_info`, а при редких попаданиях за прошедшее окно —
+        `info_package` в обход кэша.
+        """
+
+        info = self._lookup.cache_info()
+        if self.bypassed:
+            self._paused -= 1
+            self.bypassed = self._paused > 0
+        else:
+            hits, misses = self._window_start
+            window_hits = info.hits - hits
+            self.bypassed = window_hits < self.MIN_HIT_RATIO * (
+                window_hits + info.misses - misses
+            )
+            self._paused = self.PAUSE_WINDOWS
+        self._window_start = info.hits, info.misses
+        return info_package if self.bypassed else self.get_info
+
+    def stats(self) -> Dict[str, float]:
+        """Возвращает счётчики кэша для мониторинга."""
+
+        return {
+            'size': len(self),
+            'capacity': self.capacity,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hit_ratio,
+            'bypassed': self.bypassed,
+        }
+
+
+class SeenIndex:
+    """Постоянный индекс id уже обработанных пакетов.
+
+    Id пакета записывается после кода тренировки через `@`:
+    `RUN@watch-7/1042,15000,1,75`. Проверка идёт в два шага: фильтр Блума
+    в памяти отвечает «точно нет» для новых id без обращения к диску, а
+    при ответе «возможно» id ищется в таблице SQLite. Поэтому ложные
+    срабатывания фильтра не теряют пакеты, а лишь стоят одного запроса.
+    Id запоминается только после записи сообщения принятого пакета, а в
+    SQLite попадает пачками в `flush` после сброса вывода, поэтому
+    отклонённый или не записанный пакет можно прислать снова. Фильтр
+    сохраняется рядом с базой (`<path>.bloom`) при `close` и дополняется
+    из базы при открытии, если прошлый запуск не успел его сохранить.
+
+    Attributes:
+        path: путь к базе SQLite
+        memory: размер фильтра Блума в байтах
+        hashes: число хеш-функций фильтра
+        added: число новых id
+        skipped: число пропущенных повторов
+    """
+
+    BLOOM_MAGIC = b'HWSEEN\x01\x00'
+    BLOOM_HEADER = struct.Struct('<8sQIq')
+    BATCH_SIZE = 65536
+    MAX_HASHES = 8
+
+    def __init__(
+        self,
+        path: str,
+        memory: int = 16 * 1024 * 1024,
+        capacity: int = 10_000_000,
+    ) -> None:
+        self.path = path
+        self.memory = memory
+        self.hashes = min(
+            self.MAX_HASHES, max(1, round(memory * 8 / capacity * log(2)))
+        )
+        self._digest_size = 8 * self.hashes
+        self.added = self.skipped = 0
+        self._bits = memory * 8
+        self._pending: Set[str] = set()
+        self._current: Optional[str] = None
+        self._db = sqlite3.connect(path)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS seen (id TEXT PRIMARY KEY)'
+        )
+        self._bloom = self._load_bloom()
+
+    def __enter__(self) -> 'SeenIndex':
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def _load_bloom(self) -> bytearray:
+        bloom = None
+        last_row = 0
+        try:
+            with open(f'{self.path}.bloom', 'rb') as file:
+                magic, bits, hashes, last_row = self.BLOOM_HEADER.unpack(
+                    file.read(self.BLOOM_HEADER.size)
+                )
+                if (magic, bits, hashes) == (
+                    self.BLOOM_MAGIC, self._bits, self.hashes
+                ):
+                    bloom = bytearray(file.read())
+        except (OSError, struct.error):
+            pass
+        if bloom is None or len(bloom) != self.memory:
+            bloom = bytearray(self.memory)
+            last_row = 0
+        for package_id, in self._db.execute(
+            'SELECT id FROM seen WHERE rowid > ?', (last_row,)
+        ):
+            for position in self._positions(package_id):
+                bloom[position >> 3] |= 1 << (position & 7)
+        return bloom
+
+    def _positions(self, package_id: str) -> List[int]:
+        bits = self._bits
+        return [value % bits for value in array('Q', blake2b(
+            package_id.encode(), digest_size=self._digest_size
+        ).digest())]
+
+    def _maybe_seen(self, positions: List[int]) -> bool:
+        bloom = self._bloom
+        return all(
+            bloom[position >> 3] & (1 << (position & 7))
+            for position in positions
+        )
+
+    def _stored(self, package_id: str) -> bool:
+        return package_id in self._pending or self._db.execute(
+            'SELECT 1 FROM seen WHERE id = ?', (package_id,)
+        ).fetchone() is not None
+
+    def __contains__(self, package_id: str) -> bool:
+        return self._maybe_seen(self._positions(package_id)) and (
+            self._stored(package_id)
+        )
+
+    def add(self, package_id: str) -> bool:
+        """Отмечает id как обработанный.
+
+        Returns:
+            `True`, если id встретился впервые.
+        """
+
+        bloom = self._bloom
+        new = False
+        for position in self._positions(package_id):
+            mask = 1 << (position & 7)
+            if not bloom[position >> 3] & mask:
+                bloom[position >> 3] |= mask
+                new = True
+        if not new and self._stored(package_id):
+            return False
+        self._pending.add(package_id)
+        self.added += 1
+        return True
+
+    def filter(
+        self, packages: Iterable[Tuple[int, str, Sequence[str]]]
+    ) -> Iterator[Tuple[int, str, Sequence[str]]]:
+        """Пропускает пакеты с уже принятыми id.
+
+        Пакеты без id проходят без проверки, у остальных id отрезается от
+        кода тренировки. Id выданного пакета отмечается в `accepted`.
+        """
+
+        for number, workout_type, data in packages:
+            code, marker, package_id = workout_type.partition('@')
+            self._current = package_id if marker else None
+            if marker:
+                if package_id in self:
+                    self.skipped += 1
+                    continue
+                workout_type = code
+            yield number, workout_type, data
+
+    def accepted(
+        self,
+        messages: Iterable[InfoMessage],
+        flush_output: Callable[[], None] = lambda: None,
+    ) -> Iterator[InfoMessage]:
+        """Отмечает id пакетов, сообщения которых записаны.
+
+        Сообщение относится к последнему пакету из `filter`, его id
+        отмечается, когда запрошено следующее сообщение, то есть после
+        записи этого. Перед записью в базу полной пачки id вызывается
+        `flush_output`, чтобы база не опережала вывод.
+        """
+
+        for message in messages:
+            package_id = self._current
+            yield message
+            if package_id is None or not self.add(package_id):
+                continue
+            if len(self._pending) >= self.BATCH_SIZE:
+                flush_output()
+                self.flush()
+
+    def flush(self) -> None:
+        """Записывает новые id в базу."""
+
+        if not self._pending:
+            return
+        with self._db:
+            self._db.executemany(
+                'INSERT OR IGNORE INTO seen (id) VALUES (?)',
+                ((package_id,) for package_id in sorted(self._pending)),
+            )
+        self._pending.clear()
+
+    def close(self) -> None:
+        """Записывает новые id, атомарно сохраняет фильтр и закрывает базу."""
+
+        self.flush()
+        last_row, = self._db.execute(
+            'SELECT coalesce(max(rowid), 0) FROM seen'
+        ).fetchone()
+        _atomic_write(
+            f'{self.path}.bloom',
+            self.BLOOM_HEADER.pack(
+                self.BLOOM_MAGIC, self._bits, self.hashes, last_row
+            ),
+            self._bloom,
+        )
+        self._db.close()
+
+
+def process_packages(
+    packages: Iterable[Tuple[int, str, Sequence[str]]],
+    dead_letters: Optional[Union[DeadLetterSink, MessageWriter]] = None,
+    metrics: Optional[StageMetrics] = None,
+    cache: Optional[ResultCache] = None,
+) -> Iterator[InfoMessage]:
+    """Превращает поток пакетов в поток сообщений о тренировках.
+
+    Пакеты приходят вместе с номером строки, как их выдаёт `read_rows`.
+    Пакеты с неправильными данными пропускаются: они передаются в
+    `dead_letters`, а без него печатается сообщение об ошибке.
+    С `metrics` время этапов замеряется для каждого пакета, с `cache`
+    повторяющиеся пакеты берутся из кэша.
+    """
+
+    reject = _print_rejected if dead_letters is None else dead_letters.reject
+    if metrics is not None:
+        yield from _process_packages_timed(packages, reject, metrics)
+        return
+    if cache is not None:
+        yield from _process_packages_cached(packages, reject, cache)
+        return
+    for number, workout_type, data in packages:
+        info = info_package(workout_type, data)
+        if isinstance(info, PackageError):
+            reject(number, workout_type, data, info)
+            continue
+        yield info
+
+
+def _print_rejected(
+    number: int, workout_type: str, data: Sequence[str], error: PackageError
+) -> None:
+    """Печатает ошибку разбора пакета, когда карантина нет."""
+
+    print(f'Неправильные входные данные: {error.message}')
+
+
+def _process_packages_cached(
+    packages: Iterable[Tuple[int, str, Sequence[str]]],
+    reject: Callable[[int, str, Sequence[str], PackageError], None],
+    cache: ResultCache,
+) -> Iterator[InfoMessage]:
+    compute = cache.get_info
+    window = cache.WINDOW
+    for count, (number, workout_type, data) in enumerate(packages, 1):
+        if not count % window:
+            compute = cache.next_window()
+        info = compute(workout_type, data)
+        if isinstance(info, PackageError):
+            reject(number, workout_type, data, info)
+            continue
+        yield info
+
+
+def _process_packages_timed(
+    packages: Iterable[Tuple[int, str, Sequence[str]]],
+    reject: Callable[[int, str, Sequence[str], PackageError], None],
+    metrics: StageMetrics,
+) -> Iterator[InfoMessage]:
+    clock = time.perf_counter
+    packages = iter(packages)
+    while True:
+        started = clock()
+        package = next(packages, None)
+        if package is None:
+            return
+        parsed = clock()
+        number, workout_type, data = package
+        decoder = get_decoder(workout_type)
+        if isinstance(decoder, PackageError):
+            values = decoder
+        else:
+            values = decoder.parse(data)
+        decoded = clock()
+        metrics.observe('parse', workout_type, parsed - started)
+        metrics.observe('decode', workout_type, decoded - parsed)
+        if isinstance(values, PackageError):
+            info = values
+        else:
+            info = decoder.message(values)
+            metrics.observe('calories', workout_type, clock() - decoded)
+        if isinstance(info, PackageError):
+            metrics.rejected[info.reason] += 1
+            reject(number, workout_type, data, info)
+            continue
+        yield info
+
+
+def split_shards(path: str, shard_size: int) -> List[Tuple[int, int]]:
+    """Делит файл на диапазоны байтов, выровненные по границам строк.
+
+    Args:
+        path: путь к файлу с пакетами
+        shard_size: примерный размер одного диапазона в байтах
+    """
+
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, 'rb') as file:
+        for position in range(shard_size, size, shard_size):
+            if position <= bounds[-1]:
+                continue
+            file.seek(position - 1)
+            file.readline()
+            if file.tell() >= size:
+                break
+            bounds.append(file.tell())
+    bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+
+def process_shard(shard: Tuple[str, int, int]) -> Tuple[str, int]:
+    """Обрабатывает диапазон файла в процессе-обработчике.
+
+    Args:
+        shard: путь к файлу, начало и конец диапазона в байтах
+
+    Returns:
+        Текст вывода для диапазона и число обработанных пакетов.
+    """
+
+    path, start, end = shard
+    with open(path, 'rb') as file:
+        file.seek(start)
+        lines = file.read(end - start).decode('utf-8').splitlines()
+    return render_lines(lines)
+
+
+def render_lines(lines: Iterable[str]) -> Tuple[str, int]:
+    """Возвращает текст вывода для строк с пакетами и число пакетов.
+
+    Ошибки разбора попадают в текст на место своих пакетов.
+    """
+
+    count = 0
+    output = io.StringIO()
+    with MessageWriter(output) as writer:
+        for message in process_packages(read_rows(lines), writer):
+            writer.write(message)
+            count += 1
+    return output.getvalue(), count
+
+
+def process_file_parallel(
+    path: str, workers: int, shard_size: int = SHARD_SIZE
+) -> Iterator[Tuple[str, int]]:
+    """Обрабатывает файл в пуле процессов, сохраняя порядок пакетов.
+
+    Args:
+        path: путь к файлу с пакетами
+        workers: число процессов-обработчиков
+        shard_size: примерный размер одного диапазона в байтах
+
+    Yields:
+        Текст вывода и число пакетов для каждого диапазона по порядку.
+    """
+
+    shards = ((path, start, end) for start, end in split_shards(
+        path, shard_size
+    ))
+    with multiprocessing.Pool(workers) as pool:
+        yield from pool.imap(process_shard, shards)
+
+
+def _slot_offsets(slot: int, rows: int) -> Tuple[int, int]:
+    start = slot * rows * (BINARY_FIELDS + RESULT_WIDTH)
+    return start, start + rows * BINARY_FIELDS
+
+
+def _pipeline_get(queue: Any, parent: int) -> Any:
+    """Ждёт задачу, завершая процесс, если основной процесс пропал."""
+
+    while True:
+        try:
+            return queue.get(timeout=1.0)
+        except Empty:
+            if os.getppid() != parent:
+                raise SystemExit(1)
+
+
+def pipeline_parser(
+    name: str,
+    path: str,
+    shards: Sequence[Tuple[int, int, int]],
+    rows: int,
+    free: Any,
+    parsed: Any,
+    done: Any,
+    parent: int,
+) -> None:
+    """Разбирает диапазоны файла в слоты общей памяти.
+
+    Пакеты пишутся в свободный слот записями формата `PackageFile`, в
+    очередь передаются только номер слота, номер диапазона и части и
+    тексты ошибок для отклонённых пакетов. После диапазона в `done`
+    отправляется число его частей.
+    """
+
+    memory = SharedMemory(name)
+    view = memory.buf.cast('d')
+
+    def send(shard: int, chunk: int, buffer: array, errors: list) -> None:
+        slot = _pipeline_get(free, parent)
+        start, _ = _slot_offsets(slot, rows)
+        view[start:start + len(buffer)] = buffer
+        parsed.put((slot, shard, chunk, len(buffer) // BINARY_FIELDS, errors))
+
+    try:
+        for shard, start, end in shards:
+            with open(path, 'rb') as file:
+                file.seek(start)
+                lines = file.read(end - start).decode('utf-8').splitlines()
+            chunk = 0
+            buffer = array('d')
+            errors: List[Tuple[int, str]] = []
+            for _, workout_type, data in read_rows(lines):
+                error = pack_package(buffer, workout_type, data)
+                if error is not None:
+                    position = len(buffer) // BINARY_FIELDS
+                    errors.append((position, error.message))
+                elif len(buffer) == rows * BINARY_FIELDS:
+                    send(shard, chunk, buffer, errors)
+                    chunk += 1
+                    buffer = array('d')
+                    errors = []
+            if buffer or errors:
+                send(shard, chunk, buffer, errors)
+                chunk += 1
+            done.put((None, shard, chunk, 0, []))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        view.release()
+        memory.close()
+
+
+def _compute_rows(
+    records: List[float],
+    kernels: Sequence[Callable],
+    arities: Sequence[int],
+) -> array:
+    """Считает показатели записей слота по одной ядром для пакета.
+
+    Пакет, на котором ядро упало или дало бесконечность, отмечается
+    `FAILED_RESULT`.
+    """
+
+    results = array('d')
+    for base in range(0, len(records), BINARY_FIELDS):
+        code = int(records[base])
+        values = records[base + 1:base + 1 + arities[code]]
+        try:
+            result = kernels[code](*values)
+        except ArithmeticError:
+            result = FAILED_RESULT
+        if not all(map(isfinite, result)):
+            result = FAILED_RESULT
+        results.extend(result)
+    return results
+
+
+def _compute_columns(
+    training: Type['Training'], records: memoryview, count: int
+) -> Optional[array]:
+    """Считает показатели слота с пакетами одного типа ядром для столбцов.
+
+    Returns:
+        Результаты записей подряд или `None`, если ядро упало или дало
+        бесконечность и пакеты нужно считать по одному.
+    """
+
+    columns = [
+        records[field::BINARY_FIELDS].tolist()
+        for field in range(1, len(training.FIELDS) + 1)
+    ]
+    try:
+        distances, speeds, calories = training.batch_kernel(*columns)
+    except ArithmeticError:
+        return None
+    # Сумма бесконечна, если бесконечен хоть один показатель; при
+    # переполнении самой суммы слот просто считается по одному пакету.
+    if not isfinite(sum(distances) + sum(speeds) + sum(calories)):
+        return None
+    results = array('d', bytes(RESULT_WIDTH * count * 8))
+    results[0::RESULT_WIDTH] = distances
+    results[1::RESULT_WIDTH] = speeds
+    results[2::RESULT_WIDTH] = calories
+    return results
+
+
+def pipeline_compute(
+    name: str, rows: int, parsed: Any, done: Any, parent: int
+) -> None:
+    """Считает показатели пакетов прямо в слотах общей памяти.
+
+    Слот с пакетами одного типа считается ядром для столбцов, смешанный —
+    ядром для пакета по одной записи: в чистом Python перестановка
+    записей по типам стоит дороже, чем выигрыш от ядра для столбцов.
+    Дистанция, скорость и калории пишутся в область результатов того же
+    слота в порядке записей.
+    """
+
+    memory = SharedMemory(name)
+    view = memory.buf.cast('d')
+    trainings = [TYPE_DICT[code] for code in BINARY_CODES]
+    kernels = [training.kernel for training in trainings]
+    arities = [len(training.FIELDS) for training in trainings]
+    try:
+        while (task := _pipeline_get(parsed, parent)) is not None:
+            slot, _, _, count, _ = task
+            start, results_start = _slot_offsets(slot, rows)
+            records = view[start:start + count * BINARY_FIELDS]
+            codes = records[::BINARY_FIELDS].tolist()
+            results = None
+            if codes and codes.count(codes[0]) == count:
+                results = _compute_columns(
+                    trainings[int(codes[0])], records, count
+                )
+            if results is None:
+                results = _compute_rows(records.tolist(), kernels, arities)
+            records.release()
+            view[results_start:results_start + len(results)] = results
+            done.put(task)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        view.release()
+        memory.close()
+
+
+def _render_failed(record: Sequence[float]) -> str:
+    """Повторяет расчёт пакета, на котором ядро конвейера упало.
+
+    Ошибка расчёта отмечается в слоте значениями NaN, а текст сообщения
+    берётся у декодера, чтобы он совпадал с выводом без конвейера.
+    """
+
+    code = BINARY_CODES[int(record[0])]
+    decoder = DECODERS[code]
+    result = decoder.message(record[1:1 + len(TYPE_DICT[code].FIELDS)])
+    if isinstance(result, PackageError):
+        return f'Неправильные входные данные: {result.message}'
+    return result.get_message()
+
+
+def _render_slot(
+    view: memoryview,
+    slot: int,
+    rows: int,
+    count: int,
+    errors: Sequence[Tuple[int, str]],
+) -> Tuple[str, int]:
+    start, results_start = _slot_offsets(slot, rows)
+    records = view[start:start + count * BINARY_FIELDS].tolist()
+    results = view[
+        results_start:results_start + count * RESULT_WIDTH
+    ].tolist()
+    names = [TYPE_DICT[code].__name__ for code in BINARY_CODES]
+    template = InfoMessage.MESSAGE.format
+    lines = [
+        template(
+            names[int(records[row * BINARY_FIELDS])],
+            records[row * BINARY_FIELDS + 2],
+            *results[row * RESULT_WIDTH:(row + 1) * RESULT_WIDTH],
+        )
+        if results[row * RESULT_WIDTH] == results[row * RESULT_WIDTH]
+        else _render_failed(records[row * BINARY_FIELDS:])
+        for row in range(count)
+    ]
+    for position, message in reversed(errors):
+        lines.insert(position, f'Неправильные входные данные: {message}')
+    failed = sum(
+        results[row * RESULT_WIDTH] != results[row * RESULT_WIDTH]
+        for row in range(count)
+    )
+    return ''.join(f'{line}\n' for line in lines), count - failed
+
+
+class SharedPipeline:
+    """Конвейер процессов над общей памятью.
+
+    Процессы разбора пишут пакеты в слоты `SharedMemory`, процессы расчёта
+    считают показатели прямо в слотах, а текущий процесс выводит
+    сообщения по порядку и возвращает слоты в кольцо. У каждого процесса
+    разбора своё кольцо из `slots` слотов по `rows` пакетов, поэтому
+    медленный диапазон не занимает слоты соседних. Между процессами
+    передаются только номера слотов. Общая память освобождается в
+    `close` при любом завершении, а процессы, потерявшие основной
+    процесс, завершаются сами.
+
+    Attributes:
+        rows: число пакетов в слоте
+        shards: диапазоны файла с номерами
+        processes: процессы разбора и расчёта
+    """
+
+    def __init__(
+        self,
+        path: str,
+        parsers: int = 1,
+        computers: int = 1,
+        rows: int = WRITE_BATCH_SIZE,
+        slots: int = 4,
+        shard_size: int = SHARD_SIZE,
+    ) -> None:
+        self.rows = rows
+        self.shards = [
+            (index, start, end)
+            for index, (start, end) in enumerate(
+                split_shards(path, shard_size)
+            )
+        ]
+        parsers = max(1, min(parsers, len(self.shards)))
+        self._memory = SharedMemory(create=True, size=(
+            8 * parsers * slots * rows * (BINARY_FIELDS + RESULT_WIDTH)
+        ))
+        self._view = self._memory.buf.cast('d')
+        self._free = [multiprocessing.Queue() for _ in range(parsers)]
+        for parser, free in enumerate(self._free):
+            for slot in range(parser * slots, (parser + 1) * slots):
+                free.put(slot)
+        self._parsed = multiprocessing.Queue()
+        self._done = multiprocessing.Queue()
+        parent = os.getpid()
+        name = self._memory.name
+        self.processes = [
+            multiprocessing.Process(
+                target=pipeline_parser, daemon=True, args=(
+                    name, path, self.shards[parser::parsers], rows,
+                    self._free[parser], self._parsed, self._done, parent,
+                ),
+            )
+            for parser in range(parsers)
+        ] + [
+            multiprocessing.Process(
+                target=pipeline_compute, daemon=True,
+                args=(name, rows, self._parsed, self._done, parent),
+            )
+            for _ in range(computers)
+        ]
+        self._computers = computers
+
+    def __enter__(self) -> 'SharedPipeline':
+        for process in self.processes:
+            process.start()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def _wait(self) -> tuple:
+        while True:
+            try:
+                return self._done.get(timeout=1.0)
+            except Empty:
+                for process in self.processes:
+                    if process.exitcode not in (None, 0):
+                        raise Exception(
+                            f'Процесс конвейера {process.name} завершился '
+                            f'с кодом {process.exitcode}'
+                        )
+
+    def _tasks(self) -> Iterator[tuple]:
+        """Выдаёт рассчитанные части в порядке диапазонов и частей."""
+
+        pending: Dict[Tuple[int, int], tuple] = {}
+        ends: Dict[int, int] = {}
+        shard = chunk = 0
+        while shard < len(self.shards):
+            if ends.get(shard) == chunk:
+                shard, chunk = shard + 1, 0
+                continue
+            task = pending.pop((shard, chunk), None)
+            if task is not None:
+                yield task
+                chunk += 1
+                continue
+            slot, done_shard, done_chunk, _, _ = task = self._wait()
+            if slot is None:
+                ends[done_shard] = done_chunk
+            else:
+                pending[done_shard, done_chunk] = task
+
+    def results(self) -> Iterator[Tuple[str, int]]:
+        """Выдаёт текст вывода и число пакетов для каждой части по порядку."""
+
+        parsers = len(self._free)
+        for slot, shard, _, count, errors in self._tasks():
+            yield _render_slot(self._view, slot, self.rows, count, errors)
+            self._free[shard % parsers].put(slot)
+        for _ in range(self._computers):
+            self._parsed.put(None)
+        for process in self.processes:
+            process.join()
+
+    def close(self) -> None:
+        """Останавливает процессы и освобождает общую память."""
+
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+            if process.pid is not None:
+                process.join()
+        self._view.release()
+        self._memory.close()
+        self._memory.unlink()
+
+
+def process_file_shared(
+    path: str, parsers: int = 1, computers: int = 1, **options: int
+) -> Iterator[Tuple[str, int]]:
+    """Обрабатывает файл конвейером `SharedPipeline`, сохраняя порядок.
+
+    Yields:
+        Текст вывода и число пакетов для каждой части по порядку.
+    """
+
+    with SharedPipeline(path, parsers, computers, **options) as pipeline:
+        yield from pipeline.results()
+
+
+def render_package(workout_type: str, data: Sequence[str]) -> str:
+    """Возвращает сообщение о тренировке или текст ошибки для пакета."""
+
+    info = info_package(workout_type, data)
+    if isinstance(info, PackageError):
+        return f'Неправильные входные данные: {info.message}'
+    return info.get_message()
+
+
+class _BatchQueue:
+    """Очередь микропакета одного вида тренировки и её оценки."""
+
+    __slots__ = (
+        'code', 'decoder', 'values', 'futures', 'gap', 'last', 'cost',
+        'batch_size', 'delay', 'timer',
+    )
+
+    def __init__(
+        self, code: str, decoder: PackageDecoder, gap: float
+    ) -> None:
+        self.code = code
+        self.decoder = decoder
+        self.values: List[List[float]] = []
+        self.futures: List[asyncio.Future] = []
+        self.gap = gap
+        self.last: Optional[float] = None
+        self.cost = 0.0
+        self.batch_size = 1
+        self.delay = 0.0
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class MicroBatcher:
+    """Собирает пакеты потока в микропакеты по видам тренировок.
+
+    Пакеты одного вида копятся в очереди и считаются вместе через
+    `read_batch`. Размер микропакета подстраивается под частоту
+    поступления пакетов вида: редкие пакеты считаются сразу по одному,
+    при частых копится столько, сколько приходит за половину
+    `max_latency`. Срок сброса — время набора микропакета при текущей
+    частоте, но не больше `max_latency` за вычетом оценки времени
+    расчёта, поэтому пакет не ждёт дольше целевой задержки.
+
+    Attributes:
+        max_latency: целевая наибольшая задержка пакета в секундах
+        max_batch: наибольший размер микропакета
+        batches: число посчитанных микропакетов
+        packages: число посчитанных пакетов
+    """
+
+    def __init__(
+        self, max_latency: float = 0.005, max_batch: int = MICRO_BATCH_MAX
+    ) -> None:
+        if max_latency <= 0 or max_batch < 1:
+            raise Exception(
+                'Неправильные входные данные: задержка и размер '
+                'микропакета должны быть больше 0'
+            )
+        self.max_latency = max_latency
+        self.max_batch = max_batch
+        self.batches = 0
+        self.packages = 0
+        self._queues: Dict[PackageDecoder, _BatchQueue] = {}
+
+    def submit(
+        self, workout_type: str, data: Sequence[str]
+    ) -> asyncio.Future:
+        """Ставит пакет в очередь его вида тренировки.
+
+        Returns:
+            Будущее с `InfoMessage` или `PackageError` для пакета.
+        """
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        decoder = get_decoder(workout_type)
+        values = (
+            decoder if isinstance(decoder, PackageError)
+            else decoder.parse(data)
+        )
+        if isinstance(values, PackageError):
+            future.set_result(values)
+            return future
+        queue = self._queues.get(decoder)
+        if queue is None:
+            queue = self._queues[decoder] = _BatchQueue(
+                TYPE_CODES[decoder.training.__name__], decoder,
+                self.max_latency,
+            )
+        now = loop.time()
+        if queue.last is not None:
+            queue.gap += ARRIVAL_SMOOTHING * (now - queue.last - queue.gap)
+        queue.last = now
+        if not queue.values:
+            self._start(queue, loop)
+        queue.values.append(values)
+        queue.futures.append(future)
+        if len(queue.values) >= queue.batch_size:
+            self._flush(queue)
+        return future
+
+    async def info(
+        self, workout_type: str, data: Sequence[str]
+    ) -> Union[InfoMessage, PackageError]:
+        """Возвращает сообщение о тренировке, посчитанное в микропакете."""
+
+        return await self.submit(workout_type, data)
+
+    def _start(
+        self, queue: _BatchQueue, loop: asyncio.AbstractEventLoop
+    ) -> None:
+        """Выбирает размер и срок сброса нового микропакета.
+
+        Размер — число пакетов, приходящих за половину `max_latency` при
+        сглаженной частоте поступления, срок — время их набора.
+        """
+
+        expected = self.max_latency / 2 / queue.gap if queue.gap else inf
+        queue.batch_size = int(max(1, min(self.max_batch, expected)))
+        if queue.batch_size == 1:
+            return
+        queue.delay = max(0.0, min(
+            queue.batch_size * queue.gap,
+            self.max_latency - queue.cost * queue.batch_size,
+        ))
+        queue.timer = loop.call_later(queue.delay, self._flush, queue)
+
+    def _flush(self, queue: _BatchQueue) -> None:
+        """Считает накопленный микропакет и передаёт результаты."""
+
+        if queue.timer is not None:
+            queue.timer.cancel()
+            queue.timer = None
+        values, futures = queue.values, queue.futures
+        if not values:
+            return
+        queue.values, queue.futures = [], []
+        started = time.perf_counter()
+        try:
+            for future, message in zip(futures, self._compute(queue, values)):
+                if not future.done():
+                    future.set_result(message)
+        except Exception as err:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(err)
+        cost = (time.perf_counter() - started) / len(values)
+        queue.cost += ARRIVAL_SMOOTHING * (cost - queue.cost)
+        self.batches += 1
+        self.packages += len(values)
+
+    @staticmethod
+    def _compute(
+        queue: _BatchQueue, values: List[List[float]]
+    ) -> List[Union[InfoMessage, PackageError]]:
+        """Считает микропакет, при ошибке расчёта — по одному пакету.
+
+        Если `read_batch` падает на одном из пакетов, остальные пакеты
+        микропакета получают свои сообщения, а ошибочный — `PackageError`.
+        """
+
+        if len(values) > 1:
+            name = queue.decoder.training.__name__
+            columns = [array('d', column) for column in zip(*values)]
+            try:
+                return [
+                    InfoMessage(name, duration, *metrics)
+                    for duration, *metrics in zip(
+                        columns[1], *read_batch(queue.code, *columns)
+                    )
+                ]
+            except Exception:
+                pass
+        return [queue.decoder.message(row) for row in values]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Возвращает текущие размеры микропакетов и глубину очередей."""
+
+        return {
+            'batches': self.batches,
+            'packages': self.packages,
+            'types': {
+                queue.code: {
+                    'batch_size': queue.batch_size,
+                    'queue_depth': len(queue.values),
+                    'arrival_rate': 1 / queue.gap if queue.gap else inf,
+                    'flush_delay': queue.delay,
+                }
+                for queue in self._queues.values()
+            },
+        }
+
+    def to_prometheus(self) -> str:
+        """Возвращает значения в текстовом формате Prometheus."""
+
+        snapshot = self.snapshot()
+        lines = []
+        for name, key in (
+            ('homework_batch_size', 'batch_size'),
+            ('homework_batch_queue_depth', 'queue_depth'),
+            ('homework_batch_arrival_rate', 'arrival_rate'),
+            ('homework_batch_flush_delay_seconds', 'flush_delay'),
+        ):
+            lines.append(f'# TYPE {name} gauge')
+            for code, values in sorted(snapshot['types'].items()):
+                value = '+Inf' if values[key] == inf else repr(values[key])
+                lines.append(f'{name}{{type="{code}"}} {value}')
+        for name, key in (
+            ('homework_batches_total', 'batches'),
+            ('homework_batched_packages_total', 'packages'),
+        ):
+            lines.append(f'# TYPE {name} counter')
+            lines.append(f'{name} {snapshot[key]}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path: str) -> None:
+        """Атомарно записывает значения в файл для сборщика метрик."""
+
+        _atomic_write(path, self.to_prometheus())
+
+
+class TrainingServer:
+    """TCP-сервер, принимающий пакеты построчно.
+
+    Каждая строка соединения — пакет в формате CSV (`RUN,15000,1,75`),
+    в ответ на неё сервер пишет строку с сообщением о тренировке.
+    Пакеты соединения проходят через ограниченную очередь: когда она
+    заполнена, сервер перестаёт читать сокет и клиент упирается в окно TCP.
+
+    С `batcher` пакеты считаются микропакетами `MicroBatcher`: соединение
+    не ждёт ответа на пакет, прежде чем передать следующий, а ответы
+    пишутся в порядке пакетов.
+
+    Attributes:
+        max_connections: наибольшее число одновременных соединений
+        queue_size: размер очереди пакетов одного соединения
+        batcher: планировщик микропакетов или `None`
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        queue_size: int = 1000,
+        batcher: Optional[MicroBatcher] = None,
+    ) -> None:
+        self.max_connections = max_connections
+        self.queue_size = queue_size
+        self.batcher = batcher
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._readers: Set[asyncio.Task] = set()
+        self._handlers: Set[asyncio.Task] = set()
+
+    async def start(self, host: str, port: int) -> asyncio.AbstractServer:
+        """Начинает принимать соединения."""
+
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server
+
+    async def close(self) -> None:
+        """Останавливает сервер, дописав ответы на уже принятые пакеты."""
+
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for task in self._readers:
+            task.cancel()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+
+    @staticmethod
+    def _parse_line(line: bytes) -> Union[List[str], PackageError]:
+        """Разбирает строку соединения в поля пакета."""
+
+        try:
+            return next(csv.reader([line.decode('utf-8')]), [])
+        except (UnicodeDecodeError, csv.Error) as err:
+            return PackageError('format', f'строка не разобрана: {err}')
+
+    @staticmethod
+    def _reply(info: Union[InfoMessage, PackageError, None]) -> str:
+        if info is None:
+            return ''
+        if isinstance(info, PackageError):
+            return f'Неправильные входные данные: {info.message}'
+        return info.get_message()
+
+    async def _respond(
+        self, line: bytes, writer: asyncio.StreamWriter
+    ) -> None:
+        """Отвечает на пакет, ошибка пакета не обрывает соединение."""
+
+        row = self._parse_line(line)
+        if isinstance(row, PackageError) or not row:
+            message = self._reply(row or None)
+        else:
+            try:
+                message = render_package(row[0], row[1:])
+            except Exception as err:
+                message = (
+                    f'Неправильные входные данные: пакет не обработан: {err}'
+                )
+        writer.write(f'{message}\n'.encode())
+
+    def _submit(self, row: List[str]) -> asyncio.Future:
+        """Передаёт пакет в `batcher`, ошибку — готовым `PackageError`."""
+
+        try:
+            return self.batcher.submit(row[0], row[1:])
+        except Exception as err:
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(
+                PackageError('format', f'пакет не обработан: {err}')
+            )
+            return future
+
+    async def _respond_batched(
+        self,
+        queue: asyncio.Queue,
+        task: asyncio.Task,
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        """Передаёт пакеты соединения в `batcher`, не дожидаясь ответов.
+
+        Ожидающих ответов не больше `queue_size`, как и непрочитанных
+        пакетов, поэтому медленный клиент по-прежнему упирается в окно TCP.
+        """
+
+        loop = asyncio.get_running_loop()
+        pending: asyncio.Queue = asyncio.Queue(self.queue_size)
+        writing = asyncio.create_task(
+            self._write_pending(pending, task, writer)
+        )
+        try:
+            while (line := await queue.get()) is not None:
+                row = self._parse_line(line)
+                if isinstance(row, PackageError) or not row:
+                    future = loop.create_future()
+                    future.set_result(row or None)
+                else:
+                    future = self._submit(row)
+                await pending.put(future)
+        finally:
+            await pending.put(None)
+            await writing
+
+    async def _write_pending(
+        self,
+        pending: asyncio.Queue,
+        task: asyncio.Task,
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        """Пишет ответы в порядке пакетов.
+
+        Готовые ответы копятся и уходят одной записью, пока следующий
+        ответ не готов или очередь не опустела. При обрыве соединения
+        чтение отменяется, а оставшиеся ответы выбираются без записи.
+        """
+
+        lines: List[str] = []
+        connected = True
+        while (future := await pending.get()) is not None:
+            if not connected:
+                continue
+            if lines and not future.done():
+                connected = await self._write_lines(lines, task, writer)
+            try:
+                info = await future
+            except Exception as err:
+                info = PackageError('format', f'пакет не обработан: {err}')
+            lines.append(self._reply(info))
+            if pending.empty() or len(lines) >= WRITE_BATCH_SIZE:
+                connected = await self._write_lines(lines, task, writer)
+        if lines and connected:
+            await self._write_lines(lines, task, writer)
+
+    @staticmethod
+    async def _write_lines(
+        lines: List[str], task: asyncio.Task, writer: asyncio.StreamWriter
+    ) -> bool:
+        """Записывает и очищает накопленные ответы.
+
+        Returns:
+            `False`, если соединение оборвано; чтение тогда отменяется.
+        """
+
+        writer.write(('\n'.join(lines) + '\n').encode())
+        lines.clear()
+        try:
+            await writer.drain()
+        except ConnectionError:
+            task.cancel()
+            return False
+        return True
+
+    async def _read(
+        self, reader: asyncio.StreamReader, queue: asyncio.Queue
+    ) -> None:
+        try:
+            async for line in reader:
+                await queue.put(line)
+        except (asyncio.CancelledError, ConnectionError, ValueError):
+            pass
+        finally:
+            await queue.put(None)
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        if len(self._handlers) >= self.max_connections:
+            writer.write('Превышено число соединений\n'.encode())
+            writer.close()
+            return
+        handler = asyncio.current_task()
+        self._handlers.add(handler)
+        queue = asyncio.Queue(self.queue_size)
+        task = asyncio.create_task(self._read(reader, queue))
+        self._readers.add(task)
+        try:
+            if self.batcher is not None:
+                await self._respond_batched(queue, task, writer)
+            else:
+                while (line := await queue.get()) is not None:
+                    await self._respond(line, writer)
+                    await writer.drain()
+        except ConnectionError:
+            task.cancel()
+            while not queue.empty():
+                queue.get_nowait()
+        finally:
+            self._readers.discard(task)
+            self._handlers.discard(handler)
+            writer.close()
+
+
+async def write_batch_metrics(batcher: MicroBatcher, path: str) -> None:
+    """Раз в `METRICS_INTERVAL` секунд сохраняет метрики микропакетов."""
+
+    while True:
+        batcher.write_prometheus(path)
+        await asyncio.sleep(METRICS_INTERVAL)
+
+
+async def serve(
+    host: str, port: int, metrics: Optional[str] = None, **options: Any
+) -> None:
+    """Запускает TCP-сервер до получения SIGINT или SIGTERM.
+
+    С `metrics` метрики планировщика микропакетов периодически
+    записываются в этот файл.
+    """
+
+    server = TrainingServer(**options)
+    await server.start(host, port)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    writing = None
+    if metrics and server.batcher is not None:
+        writing = asyncio.create_task(
+            write_batch_metrics(server.batcher, metrics)
+        )
+    await stop.wait()
+    await server.close()
+    if writing is not None:
+        writing.cancel()
+        server.batcher.write_prometheus(metrics)
+
+
+class WorkerDaemon(TrainingServer):
+    """Постоянный обработчик пакетов на Unix-сокете.
+
+    Кроме строк с пакетами, как у `TrainingServer`, принимает команды,
+    начинающиеся с `!`:
+
+    - `!PING` — ответ `OK <pid> <число принятых пакетов>` для проверки
+      состояния;
+    - `!FILE <путь>` — обработка файла, ответы пишутся частями по мере
+      расчёта, файл читается и считается в отдельном потоке;
+    - `!RELOAD` — плавный перезапуск, как по SIGHUP.
+
+    Attributes:
+        handled: число принятых пакетов, включая отклонённые
+        reload: событие запроса перезапуска
+    """
+
+    def __init__(
+        self, max_connections: int = 100, queue_size: int = 1000
+    ) -> None:
+        super().__init__(max_connections, queue_size)
+        self.handled = 0
+        self.reload = asyncio.Event()
+
+    async def start_unix(self, path: str) -> asyncio.AbstractServer:
+        """Начинает принимать соединения на сокете `path`.
+
+        Если процесс запущен перезапуском, используется унаследованный
+        слушающий сокет, и соединения, пришедшие во время перезапуска,
+        не теряются.
+        """
+
+        fd = os.environ.pop(WORKER_FD_ENV, None)
+        if fd is not None:
+            listener = socket.socket(fileno=int(fd))
+        else:
+            if os.path.exists(path):
+                os.unlink(path)
+            listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            listener.bind(path)
+        options = {}
+        if sys.version_info >= (3, 13):
+            options['cleanup_socket'] = False
+        self._server = await asyncio.start_unix_server(
+            self._handle, sock=listener, **options
+        )
+        return self._server
+
+    def inherit_socket(self) -> int:
+        """Возвращает копию слушающего сокета для нового процесса."""
+
+        fd = os.dup(self._server.sockets[0].fileno())
+        os.set_inheritable(fd, True)
+        return fd
+
+    async def _respond(
+        self, line: bytes, writer: asyncio.StreamWriter
+    ) -> None:
+        if not line.startswith(b'!'):
+            self.handled += 1
+            await super()._respond(line, writer)
+            return
+        command, _, argument = (
+            line[1:].decode('utf-8', 'surrogateescape').strip().partition(' ')
+        )
+        if command == 'PING':
+            writer.write(f'OK {os.getpid()} {self.handled}\n'.encode())
+        elif command == 'FILE':
+            await self._respond_file(argument, writer)
+        elif command == 'RELOAD':
+            writer.write(b'OK reload\n')
+            self.reload.set()
+        else:
+            writer.write(f'Неизвестная команда: {command!r}\n'.encode())
+
+    async def _respond_file(
+        self, path: str, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            file = open(path, newline='', encoding='utf-8')
+        except OSError as error:
+            writer.write(f'Ошибка чтения файла: {error}\n'.encode())
+            return
+        with file:
+            while lines := await asyncio.to_thread(file.readlines, READ_SIZE):
+                text, _ = await asyncio.to_thread(render_lines, lines)
+                self.handled += len(lines)
+                writer.write(text.encode())
+                await writer.drain()
+
+
+async def work(path: str, **options: int) -> Optional[int]:
+    """Запускает обработчик на Unix-сокете до остановки или перезапуска.
+
+    SIGINT и SIGTERM останавливают обработчик, SIGHUP перезапускает.
+    Обработчик перестаёт принимать соединения и дожидается ответов на
+    уже принятые.
+
+    Returns:
+        Слушающий сокет для нового процесса при перезапуске, иначе `None`.
+    """
+
+    daemon = WorkerDaemon(**options)
+    await daemon.start_unix(path)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    loop.add_signal_handler(signal.SIGHUP, daemon.reload.set)
+    await asyncio.wait(
+        [asyncio.create_task(event.wait()) for event in (stop, daemon.reload)],
+        return_when=asyncio.FIRST_COMPLETED,
+    )
+    fd = daemon.inherit_socket() if daemon.reload.is_set() else None
+    await daemon.close()
+    if fd is None and os.path.exists(path):
+        os.unlink(path)
+    return fd
+
+
+def _batch_package(package: Any) -> Union[InfoMessage, PackageError]:
+    if isinstance(package, str):
+        row = next(csv.reader([package]), [])
+    elif isinstance(package, list):
+        row = [str(value) for value in package]
+    else:
+        row = []
+    if not row:
+        return PackageError(
+            'format', 'пакет должен быть непустым массивом или строкой'
+        )
+    return info_package(row[0], row[1:])
+
+
+def batch_results(packages: Sequence[Any]) -> Dict[str, Any]:
+    """Рассчитывает пакеты из JSON-запроса.
+
+    Пакет — массив `["RUN", 15000, 1, 75]` или строка CSV `"RUN,15000,1,75"`.
+    Результаты идут в порядке пакетов: поля `InfoMessage` или код и
+    описание ошибки пакета. Пакет, на котором расчёт упал, тоже получает
+    ошибку и не мешает остальным.
+    """
+
+    results = []
+    rejected = 0
+    for package in packages:
+        try:
+            info = _batch_package(package)
+        except Exception as err:
+            info = PackageError('format', f'пакет не обработан: {err}')
+        if isinstance(info, PackageError):
+            results.append({'error': info.reason, 'message': info.message})
+            rejected += 1
+            continue
+        results.append({
+            'training_type': info.training_type,
+            'duration': info.duration,
+            'distance': info.distance,
+            'speed': info.speed,
+            'calories': info.calories,
+        })
+    return {
+        'results': results,
+        'accepted': len(results) - rejected,
+        'rejected': rejected,
+    }
+
+
+class BatchRequestHandler(BaseHTTPRequestHandler):
+    """Обработчик пакетного HTTP API.
+
+    `POST /batch` принимает JSON-массив пакетов и отвечает результатами
+    `batch_results`, `GET /health` отвечает `{"status": "ok"}`.
+    Соединение остаётся открытым между запросами (HTTP/1.1 keep-alive)
+    и закрывается после `HTTP_IDLE_TIMEOUT` секунд простоя.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    timeout = HTTP_IDLE_TIMEOUT
+    # Заголовки и тело уходят отдельными записями, без Нейгла второй
+    # записи не приходится ждать подтверждения первой.
+    disable_nagle_algorithm = True
+    server: 'BatchHTTPServer'
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _send_json(self, status: int, payload: Any) -> None:
+        body = json.dumps(
+            payload, ensure_ascii=False, allow_nan=False
+        ).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _reject(self, status: int, message: str, close: bool = False) -> None:
+        """Отвечает ошибкой, с `close` закрывая соединение после ответа.
+
+        Соединение закрывается, когда тело запроса осталось непрочитанным.
+        """
+
+        self.close_connection = self.close_connection or close
+        self._send_json(status, {'error': message})
+
+    def do_GET(self) -> None:
+        if self.path == '/health':
+            self._send_json(200, {'status': 'ok'})
+        else:
+            self._reject(404, f'неизвестный путь: {self.path}')
+
+    def do_POST(self) -> None:
+        if self.path != '/batch':
+            self._reject(404, f'неизвестный путь: {self.path}', close=True)
+            return
+        try:
+            length = int(self.headers['Content-Length'])
+        except (TypeError, ValueError):
+            self._reject(411, 'нужен заголовок Content-Length', close=True)
+            return
+        if not 0 <= length <= self.server.max_body:
+            self._reject(
+                413,
+                f'тело запроса больше {self.server.max_body} байт',
+                close=True,
+            )
+            return
+        try:
+            packages = json.loads(self.rfile.read(length))
+        except ValueError as err:
+            self._reject(400, f'неверный JSON: {err}')
+            return
+        if not isinstance(packages, list):
+            self._reject(400, 'ожидался массив пакетов')
+            return
+        try:
+            body = batch_results(packages)
+        except Exception as err:
+            self._reject(500, f'ошибка обработки пакетов: {err}')
+            return
+        self._send_json(200, body)
+
+
+class BatchHTTPServer(ThreadingHTTPServer):
+    """HTTP-сервер пакетного API, каждое соединение — в своём потоке.
+
+    Attributes:
+        max_body: наибольший размер тела запроса в байтах
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self, address: Tuple[str, int], max_body: int = HTTP_MAX_BODY
+    ) -> None:
+        super().__init__(address, BatchRequestHandler)
+        self.max_body = max_body
+
+
+def serve_http(host: str, port: int, max_body: int = HTTP_MAX_BODY) -> None:
+    """Запускает HTTP API до получения SIGINT или SIGTERM."""
+
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    with BatchHTTPServer((host, port), max_body) as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+class FileFollower:
+    """Чтение новых строк растущего файла с сохранением позиции.
+
+    Позиция последней обработанной строки хранится в файле контрольной
+    точки, поэтому после перезапуска чтение продолжается с того же места.
+    Незаконченная последняя строка ждёт, пока её допишут. Если новых
+    данных нет, чтение засыпает на `interval` секунд.
+
+    Attributes:
+        path: путь к файлу с пакетами
+        checkpoint: путь к файлу контрольной точки
+        interval: пауза между проверками файла в секундах
+        offset: позиция в байтах после последней выданной полной строки
+        position: позиция в байтах начала последней выданной строки
+    """
+
+    def __init__(
+        self,
+        path: str,
+        checkpoint: Optional[str] = None,
+        interval: float = 1.0,
+    ) -> None:
+        self.path = path
+        self.checkpoint = checkpoint
+        self.interval = interval
+        self.offset = self.position = 0
+        self._stopped = False
+        if checkpoint is not None and os.path.exists(checkpoint):
+            with open(checkpoint, encoding='utf-8') as file:
+                self.offset = int(file.read() or 0)
+
+    def save(self) -> None:
+        """Атомарно сохраняет позицию в файл контрольной точки."""
+
+        if self.checkpoint is None:
+            return
+        _atomic_write(self.checkpoint, str(self.offset))
+
+    def stop(self, *args: Any) -> None:
+        """Завершает чтение после текущей порции данных.
+
+        Подходит в качестве обработчика сигнала.
+        """
+
+        self._stopped = True
+
+    def lines(
+        self, before_checkpoint: Callable[[], None] = lambda: None
+    ) -> Iterator[str]:
+        """Выдаёт новые полные строки файла.
+
+        Args:
+            before_checkpoint: вызывается перед сохранением позиции, когда
+                все выданные строки уже обработаны (например, сброс
+                буфера вывода)
+        """
+
+        with open(self.path, 'rb') as file:
+            file.seek(self.offset)
+            pending = b''
+            while True:
+                chunk = file.read(READ_SIZE)
+                if not chunk:
+                    if self._stopped:
+                        return
+                    if os.fstat(file.fileno()).st_size < self.offset:
+                        file.seek(0)
+                        self.offset, pending = 0, b''
+                    time.sleep(self.interval)
+                    continue
+                position = self.offset
+                *complete, pending = (pending + chunk).split(b'\n')
+                for line in complete:
+                    self.position = position
+                    yield line.decode('utf-8')
+                    position += len(line) + 1
+                self.offset = file.tell() - len(pending)
+                before_checkpoint()
+                self.save()
+                if self._stopped:
+                    return
+
+
+def write_messages(
+    messages: Iterable[InfoMessage],
+    writer: Union[MessageWriter, ResultWriter],
+    metrics: Optional[StageMetrics] = None,
+) -> int:
+    """Пишет сообщения через `writer`, замеряя форматирование с `metrics`.
+
+    Returns:
+        Число записанных сообщений.
+    """
+
+    count = 0
+    if metrics is None:
+        for message in messages:
+            writer.write(message)
+            count += 1
+        return count
+    clock = time.perf_counter
+    for message in messages:
+        started = clock()
+        writer.write(message)
+        metrics.observe(
+            'format', TYPE_CODES[message.training_type], clock() - started
+        )
+        count += 1
+    return count
+
+
+def open_input(stack: ExitStack, path: str) -> TextIO:
+    """Открывает CSV-файл с пакетами или stdin (`-`) для чтения строк.
+
+    Файл закрывается вместе со `stack`, stdin остаётся открытым.
+    """
+
+    if path == '-':
+        return sys.stdin
+    return stack.enter_context(open(path, newline='', encoding='utf-8'))
+
+
+def print_messages(
+    path: str,
+    dead_letters: Optional[DeadLetterSink] = None,
+    metrics: Optional[StageMetrics] = None,
+    cache: Optional[ResultCache] = None,
+    follower: Optional[FileFollower] = None,
+    writer: Optional[Union[MessageWriter, ResultWriter]] = None,
+    seen: Optional[SeenIndex] = None,
+    flush_lines: Optional[int] = None,
+) -> int:
+    """Печатает сообщения для пакетов из файла или stdin (`-`).
+
+    С `follower` файл читается по мере роста, а вывод сбрасывается перед
+    каждым сохранением позиции. С `writer` результаты пишутся через него
+    вместо текстового вывода в stdout. С `seen` пропускаются пакеты с id,
+    обработанными в прошлых запусках. `flush_lines` задаёт число строк
+    между сбросами stdout, по умолчанию оно выбирается `MessageWriter`.
+
+    Returns:
+        Число обработанных пакетов.
+    """
+
+    with ExitStack() as stack:
+        if writer is None:
+            writer = stack.enter_context(MessageWriter(batch_size=flush_lines))
+        if follower is not None:
+            lines = follower.lines(
+                writer.flush if seen is None
+                else lambda: (writer.flush(), seen.flush())
+            )
+        else:
+            lines = open_input(stack, path)
+        packages = read_rows(
+            lines, None if follower is None else lambda: follower.position
+        )
+        if seen is not None:
+            packages = seen.filter(packages)
+        messages = process_packages(
+            packages, dead_letters or writer, metrics, cache
+        )
+        if seen is not None:
+            messages = seen.accepted(messages, writer.flush)
+        return write_messages(messages, writer, metrics)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Описывает аргументы командной строки."""
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        'path', nargs='?', default='-',
+        help='CSV-файл с пакетами, `-` для чтения из stdin',
+    )
+    parser.add_argument(
+        '-w', '--workers', type=int, default=1,
+        help='число процессов для обработки файла, 0 — по числу ядер',
+    )
+    parser.add_argument(
+        '--pipeline', action='store_true',
+        help='обрабатывать файл конвейером процессов над общей памятью',
+    )
+    parser.add_argument(
+        '--parsers', type=int, default=1, metavar='N',
+        help='число процессов разбора в режиме --pipeline',
+    )
+    parser.add_argument(
+        '--computers', type=int, metavar='N',
+        help='число процессов расчёта в режиме --pipeline',
+    )
+    parser.add_argument(
+        '--serve', metavar='HOST:PORT',
+        help='принимать пакеты по TCP вместо чтения файла',
+    )
+    parser.add_argument(
+        '--batch-latency', type=float, default=0.0, metavar='MS',
+        help='считать пакеты --serve микропакетами с такой задержкой',
+    )
+    parser.add_argument(
+        '--batch-max', type=int, default=MICRO_BATCH_MAX, metavar='N',
+        help='наибольший размер микропакета',
+    )
+    parser.add_argument(
+        '--http', metavar='HOST:PORT',
+        help='принимать пакеты JSON-массивами по HTTP (POST /batch)',
+    )
+    parser.add_argument(
+        '--max-body', type=int, default=HTTP_MAX_BODY // (1024 * 1024),
+        metavar='MB', help='наибольший размер HTTP-запроса в МиБ',
+    )
+    parser.add_argument(
+        '--worker', metavar='SOCKET',
+        help='запустить постоянный обработчик на Unix-сокете',
+    )
+    parser.add_argument(
+        '--max-connections', type=int, default=100,
+        help='наибольшее число соединений с сервером',
+    )
+    parser.add_argument(
+        '--dead-letter', metavar='PATH',
+        help='CSV-файл для отклонённых пакетов',
+    )
+    parser.add_argument(
+        '--metrics', metavar='PATH',
+        help='файл для метрик этапов или микропакетов в формате Prometheus',
+    )
+    parser.add_argument(
+        '--cache', type=int, default=0, metavar='SIZE',
+        help='размер кэша результатов для повторяющихся пакетов',
+    )
+    parser.add_argument(
+        '--seen', metavar='PATH',
+        help='база id обработанных пакетов для пропуска повторов',
+    )
+    parser.add_argument(
+        '--seen-memory', type=int, default=16, metavar='MB',
+        help='размер фильтра Блума индекса id в МиБ',
+    )
+    parser.add_argument(
+        '--seen-capacity', type=int, default=10_000_000, metavar='N',
+        help='ожидаемое число id для подбора числа хеш-функций',
+    )
+    parser.add_argument(
+        '--results-dir', metavar='DIR',
+        help='записать результаты столбцами .npy в каталог вместо текста',
+    )
+    parser.add_argument(
+        '--to-binary', metavar='PATH',
+        help='перевести пакеты в двоичный формат и записать в файл',
+    )
+    parser.add_argument(
+        '--flush-lines', type=int, metavar='N',
+        help='сбрасывать вывод каждые N строк (по умолчанию 1 для '
+        f'терминала и {WRITE_BATCH_SIZE} для файла или канала)',
+    )
+    parser.add_argument(
+        '-f', '--follow', action='store_true',
+        help='следить за дописыванием файла',
+    )
+    parser.add_argument(
+        '--checkpoint', metavar='PATH',
+        help='файл с позицией чтения для режима --follow',
+    )
+    parser.add_argument(
+        '--poll-interval', type=float, default=1.0, metavar='SECONDS',
+        help='пауза между проверками файла в режиме --follow',
+    )
+    parser.add_argument(
+        '--report', action='store_true',
+        help='напечатать отчёт по видам тренировок и спортсменам',
+    )
+    parser.add_argument(
+        '--report-memory', type=int, default=64, metavar='MB',
+        help='память для групп отчёта в МиБ, остальное сбрасывается на диск',
+    )
+    parser.add_argument(
+        '--report-top', type=int, default=10, metavar='N',
+        help='число спортсменов с наибольшими калориями в отчёте',
+    )
+    parser.add_argument(
+        '--live', metavar='CODE,PARAMS',
+        help='читать отсчёты идущей тренировки, например `RUN,75`',
+    )
+    parser.add_argument(
+        '--window', type=float, default=300.0, metavar='SECONDS',
+        help='длина скользящего окна в режиме --live',
+    )
+    return parser
+
+
+def process_file(args: argparse.Namespace) -> int:
+    """Обрабатывает файл в одном процессе с карантином и метриками.
+
+    Returns:
+        Число обработанных пакетов.
+    """
+
+    metrics = StageMetrics() if args.metrics else None
+    cache = ResultCache(args.cache) if args.cache else None
+    with ExitStack() as stack:
+        # Индекс закрывается последним, когда вывод уже сброшен.
+        seen = None
+        if args.seen:
+            seen = stack.enter_context(SeenIndex(
+                args.seen, args.seen_memory * 1024 * 1024, args.seen_capacity
+            ))
+        dead_letters = None
+        if args.dead_letter:
+            dead_letters = stack.enter_context(
+                DeadLetterSink(args.dead_letter)
+            )
+        writer = None
+        if args.results_dir:
+            writer = stack.enter_context(ResultWriter(args.results_dir))
+        follower = None
+        if args.follow:
+            follower = FileFollower(
+                args.path, args.checkpoint, args.poll_interval
+            )
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(signum, follower.stop)
+        count = print_messages(
+            args.path, dead_letters, metrics, cache, follower, writer, seen,
+            args.flush_lines,
+        )
+    if metrics is not None:
+        metrics.write_prometheus(args.metrics)
+    print_summary(cache, dead_letters, seen)
+    return count
+
+
+def print_summary(
+    cache: Optional[ResultCache],
+    dead_letters: Optional[DeadLetterSink],
+    seen: Optional[SeenIndex],
+) -> None:
+    """Печатает в stderr счётчики кэша, карантина и индекса id."""
+
+    if cache is not None:
+        print(
+            f'Кэш: попаданий {cache.hits}, промахов {cache.misses}, '
+            f'вытеснено {cache.evictions}, '
+            f'доля попаданий {cache.hit_ratio:.3f}'
+            + (', отключён из-за редких попаданий' if cache.bypassed else ''),
+            file=sys.stderr,
+        )
+    if dead_letters is not None:
+        reasons = ', '.join(
+            f'{reason}: {number}'
+            for reason, number in sorted(dead_letters.counters.items())
+        )
+        print(
+            f'Отклонено пакетов: {sum(dead_letters.counters.values())} '
+            f'({reasons})',
+            file=sys.stderr,
+        )
+    if seen is not None:
+        print(
+            f'Новых id: {seen.added}, пропущено повторов: {seen.skipped}',
+            file=sys.stderr,
+        )
+
+
+def fill_report(
+    report: SpillingReport,
+    packages: Iterable[Tuple[int, str, Sequence[str]]],
+    dead_letters: Optional[DeadLetterSink] = None,
+) -> Tuple[int, int]:
+    """Учитывает пакеты в отчёте, спортсмен берётся из id пакета.
+
+    Returns:
+        Число учтённых и отклонённых пакетов.
+    """
+
+    count = rejected = 0
+    for number, workout_type, data in packages:
+        info = info_package(workout_type, data)
+        if isinstance(info, PackageError):
+            if dead_letters is not None:
+                dead_letters.reject(number, workout_type, data, info)
+            rejected += 1
+            continue
+        report.add(package_athlete(workout_type), info)
+        count += 1
+    return count, rejected
+
+
+def format_report(section: TypeReport) -> List[str]:
+    """Возвращает строки отчёта по виду тренировок."""
+
+    totals = section.totals
+    lines = [
+        f'{section.training_type}: тренировок {totals.count}, '
+        f'спортсменов {section.athletes}, '
+        f'дистанция {totals.distance:.3f} км, '
+        f'время {totals.duration:.3f} ч, '
+        f'калории {totals.calories:.3f}, '
+        f'средняя скорость {totals.mean_speed:.3f} км/ч.'
+    ]
+    for title, quantiles in (
+        ('Скорость, км/ч', section.speed),
+        ('Калории за тренировку', section.calories),
+    ):
+        values = ', '.join(
+            f'p{q * 100:g} {value:.3f}' for q, value in quantiles.items()
+        )
+        lines.append(f'  {title}: {values}.')
+    if section.top:
+        athletes = ', '.join(
+            f'{athlete or "-"} {calories:.3f}'
+            for athlete, calories in section.top
+        )
+        lines.append(f'  Больше всего калорий: {athletes}.')
+    return lines
+
+
+def print_report(args: argparse.Namespace) -> int:
+    """Печатает отчёт по видам тренировок и спортсменам для файла или stdin.
+
+    Группы, не помещающиеся в `--report-memory`, сбрасываются на диск
+    отсортированными сериями и сливаются при печати.
+
+    Returns:
+        Число учтённых пакетов.
+    """
+
+    with ExitStack() as stack:
+        lines = open_input(stack, args.path)
+        dead_letters = None
+        if args.dead_letter:
+            dead_letters = stack.enter_context(
+                DeadLetterSink(args.dead_letter)
+            )
+        report = stack.enter_context(SpillingReport(
+            args.report_memory * 1024 * 1024, args.report_top
+        ))
+        count, rejected = fill_report(report, read_rows(lines), dead_letters)
+        writer = stack.enter_context(MessageWriter())
+        for section in report.report():
+            for line in format_report(section):
+                writer.write_line(line)
+    print(
+        f'Отклонено пакетов: {rejected}, '
+        f'сброшено серий на диск: {report.spills}',
+        file=sys.stderr,
+    )
+    return count
+
+
+def print_live(args: argparse.Namespace) -> int:
+    """Печатает показатели идущей тренировки по отсчётам из файла или stdin.
+
+    Строка отсчёта — время в секундах и приросты счётчиков:
+    `1700000060,150`. На каждый отсчёт печатаются показатели за окно и
+    за всю тренировку.
+
+    Returns:
+        Число учтённых отсчётов.
+    """
+
+    workout_type, *fields = next(csv.reader([args.live]))
+    session = LiveSession(
+        workout_type, *map(float, fields), window=args.window
+    )
+    count = 0
+    with ExitStack() as stack:
+        writer = stack.enter_context(
+            MessageWriter(batch_size=args.flush_lines)
+        )
+        lines = open_input(stack, args.path)
+        for row in csv.reader(lines):
+            if not row:
+                continue
+            try:
+                values = [float(value) for value in row]
+            except ValueError as err:
+                writer.write_line(f'Неправильные входные данные: {err}')
+                continue
+            error = session.check(*values)
+            if error is None:
+                try:
+                    window, total = session.add(*values)
+                except ArithmeticError as err:
+                    error = PackageError('range', str(err))
+            if error is not None:
+                writer.write_line(
+                    f'Неправильные входные данные: {error.message}'
+                )
+                continue
+            writer.write_line(
+                f'Окно {args.window:g} с: {window.get_message()}'
+            )
+            writer.write_line(f'Всего: {total.get_message()}')
+            count += 1
+    return count
+
+
+def check_args(
+    parser: argparse.ArgumentParser, args: argparse.Namespace
+) -> None:
+    """Проверяет совместимость аргументов командной строки."""
+
+    if (
+        args.dead_letter or args.metrics or args.cache or args.seen
+        or args.results_dir
+    ) and (args.workers != 1 or args.pipeline):
+        parser.error(
+            '--dead-letter, --metrics, --cache, --seen и --results-dir '
+            'работают только с одним процессом'
+        )
+    if args.metrics and args.cache:
+        parser.error('--metrics нельзя совмещать с --cache')
+    if args.follow and (args.path == '-' or args.workers != 1):
+        parser.error('--follow работает только с файлом в одном процессе')
+    if args.pipeline and (args.path == '-' or args.follow):
+        parser.error('--pipeline работает только с готовым файлом')
+    if args.batch_latency and not args.serve:
+        parser.error('--batch-latency работает только с --serve')
+    if args.report and (
+        args.workers != 1 or args.pipeline or args.follow or args.cache
+        or args.metrics or args.seen or args.results_dir
+    ):
+        parser.error('--report совместим только с --dead-letter')
+    if args.flush_lines is not None and (
+        args.flush_lines < 1 or args.workers != 1 or args.pipeline
+    ):
+        parser.error(
+            '--flush-lines должно быть больше 0 и работает только '
+            'с одним процессом'
+        )
+
+
+def convert_file(args: argparse.Namespace) -> None:
+    """Переводит CSV-файл или stdin в двоичный формат пакетов."""
+
+    with ExitStack() as stack:
+        lines = open_input(stack, args.path)
+        dead_letters = None
+        if args.dead_letter:
+            dead_letters = stack.enter_context(
+                DeadLetterSink(args.dead_letter)
+            )
+        written, rejected = convert_to_binary(
+            lines, args.to_binary, dead_letters
+        )
+    print(
+        f'Записано пакетов: {written}, отклонено: {rejected}',
+        file=sys.stderr,
+    )
+
+
+def run_server(args: argparse.Namespace) -> None:
+    """Запускает TCP-сервер, HTTP API или обработчик на Unix-сокете.
+
+    При перезапуске обработчика процесс заменяется новым интерпретатором,
+    которому слушающий сокет передаётся через переменную окружения.
+    """
+
+    if args.serve:
+        host, _, port = args.serve.rpartition(':')
+        batcher = None
+        if args.batch_latency:
+            batcher = MicroBatcher(args.batch_latency / 1000, args.batch_max)
+        asyncio.run(serve(
+            host or 'localhost', int(port), metrics=args.metrics,
+            max_connections=args.max_connections, batcher=batcher,
+        ))
+        return
+    if args.http:
+        host, _, port = args.http.rpartition(':')
+        serve_http(host or 'localhost', int(port), args.max_body * 1024 * 1024)
+        return
+    fd = asyncio.run(work(args.worker, max_connections=args.max_connections))
+    if fd is not None:
+        os.environ[WORKER_FD_ENV] = str(fd)
+        os.execv(sys.executable, [sys.executable, *sys.argv])
+
+
+def run(argv: Optional[Sequence[str]] = None) -> None:
+    """Обрабатывает файл с пакетами и печатает сообщения о тренировках.
+
+    Args:
+        argv: аргументы командной строки, по умолчанию `sys.argv[1:]`
+    """
+
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    check_args(parser, args)
+    if args.to_binary:
+        convert_file(args)
+        return
+    if args.live:
+        print_live(args)
+        return
+    if args.report:
+        print_report(args)
+        return
+    if args.serve or args.http or args.worker:
+        run_server(args)
+        return
+    workers = args.workers or os.cpu_count() or 1
+
+    started = time.perf_counter()
+    if args.pipeline:
+        # SIGTERM прерывает конвейер, как Ctrl+C, чтобы общая память
+        # освободилась в SharedPipeline.close.
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        computers = args.computers or max(1, workers - args.parsers - 1)
+        results = process_file_shared(args.path, args.parsers, computers)
+    elif workers > 1 and args.path != '-':
+        results = process_file_parallel(args.path, workers)
+    else:
+        results = None
+    if results is None:
+        count = process_file(args)
+    else:
+        count = 0
+        for text, shard_count in results:
+            sys.stdout.write(text)
+            count += shard_count
+    elapsed = time.perf_counter() - started
+    print(
+        f'Обработано пакетов: {count} за {elapsed:.3f} с '
+        f'({count / elapsed if elapsed else 0:.0f} пакетов/с)',
+        file=sys.stderr,
+    )
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,534 @@
+"""Генератор нагрузки и длительный прогон модуля фитнес-трекера.
+
+Создаёт сколько угодно синтетических пакетов SWM, RUN и WLK с заданной
+долей видов тренировок и неправильных строк. Пакеты можно записать в файл
+или подать обработчику: в stdin процесса `homework.py`, через готовый
+файл, на TCP-сервер (`--serve`) или Unix-обработчик (`--worker`).
+Раз в интервал в stderr печатается строка JSON с пропускной способностью,
+квантилями задержки и памятью обработчика, в конце в stdout — итог.
+
+    python loadgen.py --count 1000000 --output packages.csv
+    python loadgen.py --duration 3600 --rate 20000 --target stdin
+    python loadgen.py --duration 600 --target tcp:127.0.0.1:8765 --pid 1234
+    python loadgen.py --count 500000 --target file -- --workers 4
+"""
+
+from bisect import bisect
+from collections import deque
+from contextlib import ExitStack
+from itertools import accumulate, takewhile
+from typing import (
+    Callable, Deque, Dict, Iterator, List, Optional, Sequence, Tuple,
+)
+import argparse
+import json
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import homework
+
+MIX = {'SWM': 1.0, 'RUN': 1.0, 'WLK': 1.0}
+MALFORMED_KINDS = ('type', 'arity', 'format', 'range')
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+CHUNK_SIZE = 256
+READ_SIZE = 64 * 1024
+HOMEWORK = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'homework.py')
+
+
+def body_weight(rnd: random.Random) -> float:
+    return round(min(140.0, max(40.0, rnd.gauss(75, 13))), 1)
+
+
+def running_fields(rnd: random.Random) -> List[float]:
+    """Бег: шаги по каденсу 150–185 в минуту за 12 минут – 3 часа."""
+
+    duration = round(min(3.0, max(0.2, rnd.gauss(0.8, 0.35))), 3)
+    action = int(duration * 60 * rnd.uniform(150, 185))
+    return [action, duration, body_weight(rnd)]
+
+
+def walking_fields(rnd: random.Random) -> List[float]:
+    """Ходьба: каденс 95–130 шагов в минуту и рост около 172 см."""
+
+    duration = round(min(3.0, max(0.2, rnd.gauss(1.0, 0.4))), 3)
+    action = int(duration * 60 * rnd.uniform(95, 130))
+    height = round(min(210.0, max(140.0, rnd.gauss(172, 9))), 1)
+    return [action, duration, body_weight(rnd), height]
+
+
+def swimming_fields(rnd: random.Random) -> List[float]:
+    """Плавание: бассейн 25 или 50 м, 25–60 с на 25 м, 1,2–2,2 м на гребок.
+
+    Число бассейнов и гребков согласовано с длительностью и длиной
+    бассейна, как в настоящей выгрузке.
+    """
+
+    duration = round(rnd.uniform(0.25, 1.5), 3)
+    length_pool = rnd.choices((25, 50), (3, 1))[0]
+    seconds = rnd.uniform(25, 60) * length_pool / 25
+    count_pool = max(1, int(duration * 3600 / seconds))
+    action = int(count_pool * length_pool / rnd.uniform(1.2, 2.2))
+    return [action, duration, body_weight(rnd), length_pool, count_pool]
+
+
+PACKAGE_FIELDS: Dict[str, Callable[[random.Random], List[float]]] = {
+    'SWM': swimming_fields,
+    'RUN': running_fields,
+    'WLK': walking_fields,
+}
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """Разбирает долю видов тренировок вида `RUN=2,WLK=1,SWM=1`."""
+
+    mix = {}
+    for item in text.split(','):
+        code, _, weight = item.partition('=')
+        if code not in PACKAGE_FIELDS or float(weight or 1) < 0:
+            raise argparse.ArgumentTypeError(f'неверная доля: {item!r}')
+        mix[code] = float(weight or 1)
+    if not sum(mix.values()):
+        raise argparse.ArgumentTypeError('сумма долей должна быть больше 0')
+    return mix
+
+
+def malform(
+    rnd: random.Random, code: str, data: List[str]
+) -> Tuple[str, List[str]]:
+    """Портит пакет ошибкой `type`, `arity`, `format` или `range`."""
+
+    kind = rnd.choice(MALFORMED_KINDS)
+    if kind == 'type':
+        return 'BIKE', data
+    if kind == 'arity':
+        return code, data[:-1]
+    data[rnd.randrange(len(data))] = 'abc' if kind == 'format' else '-1'
+    return code, data
+
+
+def generate_packages(
+    count: Optional[int] = None,
+    mix: Optional[Dict[str, float]] = None,
+    malformed: float = 0.0,
+    athletes: int = 0,
+    seed: int = 0,
+) -> Iterator[Tuple[str, List[str]]]:
+    """Выдаёт синтетические пакеты со строковыми полями, как в CSV.
+
+    Args:
+        count: число пакетов, `None` — без ограничения
+        mix: относительные доли видов тренировок
+        malformed: доля неправильных пакетов от 0 до 1
+        athletes: число устройств в id пакетов, 0 — пакеты без id
+        seed: зерно генератора, одно зерно даёт одни и те же пакеты
+    """
+
+    rnd = random.Random(seed)
+    mix = mix or MIX
+    codes = list(mix)
+    bounds = list(accumulate(mix.values()))
+    total = bounds[-1]
+    number = 0
+    while count is None or number < count:
+        code = codes[bisect(bounds, rnd.random() * total)]
+        data = [str(value) for value in PACKAGE_FIELDS[code](rnd)]
+        if athletes:
+            code = f'{code}@watch-{rnd.randrange(athletes)}/{number}'
+        if malformed and rnd.random() < malformed:
+            code, data = malform(rnd, code, data)
+        yield code, data
+        number += 1
+
+
+def package_lines(
+    packages: Iterator[Tuple[str, List[str]]]
+) -> Iterator[str]:
+    for code, data in packages:
+        yield ','.join([code, *data]) + '\n'
+
+
+def rss_kb(pid: int, field: str = 'VmRSS') -> Optional[int]:
+    """Возвращает память процесса в КиБ из `/proc`, если она доступна.
+
+    `VmRSS` — текущая память, `VmHWM` — пиковая.
+    """
+
+    try:
+        with open(f'/proc/{pid}/status', encoding='ascii') as file:
+            for line in file:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+class LoadStats:
+    """Счётчики прогона и задержки ответов.
+
+    Отправитель добавляет в `pending` время отправки и размер каждой
+    порции пакетов, читатель снимает порции по мере ответов: обработчики
+    отвечают строкой на каждый пакет в порядке пакетов. С ограничением
+    частоты временем отправки считается плановое время порции, поэтому
+    задержка не занижается, когда отправитель ждёт обработчик.
+
+    Attributes:
+        sent: число отправленных пакетов
+        received: число полученных ответов
+        latency: задержки ответов за весь прогон в секундах
+        intervals: строки отчётов за интервалы
+        peak_rss: наибольшая замеченная память обработчика в КиБ
+    """
+
+    def __init__(self, pid: Optional[int] = None) -> None:
+        self.pid = pid
+        self.sent = 0
+        self.received = 0
+        self.latency = homework.QuantileSketch()
+        self.intervals: List[Dict[str, float]] = []
+        self.peak_rss: Optional[int] = None
+        self.pending: Deque[List[float]] = deque()
+        self._window = homework.QuantileSketch()
+        self._window_received = 0
+
+    def receive(self, lines: int, now: float) -> None:
+        """Учитывает `lines` ответов, полученных в момент `now`."""
+
+        self.received += lines
+        self._window_received += lines
+        while lines and self.pending:
+            chunk = self.pending[0]
+            taken = min(lines, int(chunk[1]))
+            self.latency.add(now - chunk[0], taken)
+            self._window.add(now - chunk[0], taken)
+            lines -= taken
+            chunk[1] -= taken
+            if not chunk[1]:
+                self.pending.popleft()
+
+    def sample_rss(self) -> Optional[int]:
+        """Возвращает текущую память обработчика и обновляет пиковую."""
+
+        if self.pid is None:
+            return None
+        peak = rss_kb(self.pid, 'VmHWM')
+        if peak is not None:
+            self.peak_rss = max(self.peak_rss or 0, peak)
+        return rss_kb(self.pid)
+
+    def interval(self, elapsed: float, length: float) -> Dict[str, float]:
+        """Закрывает интервал длиной `length` и возвращает его отчёт."""
+
+        report = {
+            'elapsed': round(elapsed, 3),
+            'sent': self.sent,
+            'received': self.received,
+            'throughput': round(self._window_received / length, 1),
+        }
+        if self._window.count:
+            report.update(latency_ms(self._window, (0.5, 0.99)))
+        rss = self.sample_rss()
+        if rss is not None:
+            report['rss_kb'] = rss
+        self.intervals.append(report)
+        self._window = homework.QuantileSketch()
+        self._window_received = 0
+        return report
+
+
+def latency_ms(
+    sketch: homework.QuantileSketch, quantiles: Sequence[float]
+) -> Dict[str, float]:
+    return {
+        f'p{q * 100:g}_ms': round(sketch.quantile(q) * 1000, 3)
+        for q in quantiles
+    }
+
+
+class Target:
+    """Точка входа обработчика: запись пакетов и чтение ответов.
+
+    Attributes:
+        write: отправляет байты обработчику
+        finish: сообщает, что пакетов больше не будет
+        read: читает очередную порцию ответов, `b''` — конец
+        pid: процесс обработчика для замера памяти
+    """
+
+    def __init__(
+        self,
+        write: Callable[[bytes], object],
+        finish: Callable[[], None],
+        read: Callable[[], bytes],
+        pid: Optional[int] = None,
+        process: Optional[subprocess.Popen] = None,
+    ) -> None:
+        self.write = write
+        self.finish = finish
+        self.read = read
+        self.pid = pid
+        self.process = process
+
+
+def chunk_lines(rate: float) -> int:
+    """Число пакетов в порции, отправляемой обработчику за раз."""
+
+    return max(1, min(CHUNK_SIZE, int(rate // 100))) if rate else CHUNK_SIZE
+
+
+def spawn(argv: Sequence[str], stdin: int) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, HOMEWORK, *argv],
+        stdin=stdin, stdout=subprocess.PIPE,
+    )
+
+
+def open_target(
+    stack: ExitStack, args: argparse.Namespace
+) -> Target:
+    """Подключается к обработчику, указанному в `--target`."""
+
+    kind, _, address = args.target.partition(':')
+    if kind in ('tcp', 'unix'):
+        if kind == 'tcp':
+            host, _, port = address.rpartition(':')
+            client = socket.create_connection((host or 'localhost', int(port)))
+        else:
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            client.connect(address)
+        stack.enter_context(client)
+        return Target(
+            client.sendall, lambda: client.shutdown(socket.SHUT_WR),
+            lambda: client.recv(READ_SIZE), args.pid,
+        )
+    if kind == 'stdin':
+        argv = ['-', *args.homework_args]
+        if not any(arg.startswith('--flush-lines') for arg in argv):
+            # Без этого задержка измеряет заполнение буфера вывода
+            # обработчика, а не обработку порции.
+            argv += ['--flush-lines', str(chunk_lines(args.rate))]
+        process = spawn(argv, subprocess.PIPE)
+        stack.callback(process.wait)
+        stack.callback(process.stdin.close)
+        return Target(
+            process.stdin.write, process.stdin.close,
+            lambda: process.stdout.read1(READ_SIZE), process.pid, process,
+        )
+    raise argparse.ArgumentTypeError(f'неизвестная цель: {args.target!r}')
+
+
+def send(
+    target: Target,
+    lines: Iterator[str],
+    stats: LoadStats,
+    rate: float,
+    deadline: float,
+) -> None:
+    """Отправляет пакеты порциями с частотой `rate` до срока `deadline`."""
+
+    chunk_size = chunk_lines(rate)
+    clock = time.perf_counter
+    started = clock()
+    try:
+        while clock() < deadline:
+            chunk = [line for _, line in zip(range(chunk_size), lines)]
+            if not chunk:
+                break
+            planned = started + stats.sent / rate if rate else clock()
+            if planned > clock():
+                time.sleep(planned - clock())
+            stats.pending.append([planned, len(chunk)])
+            stats.sent += len(chunk)
+            target.write(''.join(chunk).encode())
+    except OSError:
+        pass
+    finally:
+        try:
+            target.finish()
+        except OSError:
+            pass
+
+
+def soak(
+    target: Target,
+    lines: Iterator[str],
+    duration: float,
+    rate: float = 0.0,
+    interval: float = 10.0,
+    report: Optional[Callable[[Dict[str, float]], None]] = None,
+) -> Tuple[LoadStats, float]:
+    """Подаёт пакеты обработчику и собирает счётчики и задержки.
+
+    Returns:
+        Счётчики прогона и его длительность в секундах.
+    """
+
+    stats = LoadStats(target.pid)
+    clock = time.perf_counter
+    started = clock()
+    sender = threading.Thread(
+        target=send, args=(target, lines, stats, rate, started + duration),
+        daemon=True,
+    )
+    sender.start()
+    next_report = started + interval
+    while data := target.read():
+        now = clock()
+        stats.receive(data.count(b'\n'), now)
+        if now >= next_report:
+            line = stats.interval(now - started, now - next_report + interval)
+            next_report = now + interval
+            if report is not None:
+                report(line)
+    sender.join()
+    return stats, clock() - started
+
+
+def summary(
+    stats: LoadStats, elapsed: float, process: Optional[subprocess.Popen]
+) -> Dict[str, object]:
+    """Собирает итог прогона.
+
+    Устойчивая пропускная способность — наименьшая и медианная за полные
+    интервалы: средняя за прогон скрывает провалы.
+    """
+
+    result: Dict[str, object] = {
+        'sent': stats.sent,
+        'received': stats.received,
+        'elapsed': round(elapsed, 3),
+        'throughput': round(stats.received / elapsed, 1) if elapsed else 0,
+    }
+    rates = sorted(line['throughput'] for line in stats.intervals)
+    if rates:
+        result['throughput_min'] = rates[0]
+        result['throughput_median'] = rates[len(rates) // 2]
+    if stats.latency.count:
+        result.update(latency_ms(stats.latency, QUANTILES))
+    stats.sample_rss()
+    peak = stats.peak_rss
+    if process is not None:
+        process.wait()
+        peak = max(peak or 0, resource.getrusage(
+            resource.RUSAGE_CHILDREN
+        ).ru_maxrss)
+    if peak is not None:
+        result['peak_rss_kb'] = peak
+    return result
+
+
+def run_file(
+    args: argparse.Namespace, lines: Iterator[str]
+) -> Dict[str, object]:
+    """Записывает пакеты во временный файл и прогоняет по нему обработчик.
+
+    Задержка отдельных пакетов здесь не замеряется: файл читается целиком.
+    """
+
+    with tempfile.NamedTemporaryFile(
+        'w', suffix='.csv', delete=False, encoding='utf-8'
+    ) as file:
+        file.writelines(lines)
+    try:
+        process = spawn([file.name, *args.homework_args], subprocess.DEVNULL)
+        target = Target(
+            lambda data: None, lambda: None,
+            lambda: process.stdout.read1(READ_SIZE), process.pid, process,
+        )
+        with process:
+            stats, elapsed = soak(
+                target, iter(()), args.duration, interval=args.interval,
+                report=print_interval,
+            )
+            stats.sent = args.count
+            return summary(stats, elapsed, process)
+    finally:
+        os.unlink(file.name)
+
+
+def print_interval(line: Dict[str, float]) -> None:
+    print(json.dumps(line), file=sys.stderr, flush=True)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('--count', type=int,
+                        help='число пакетов, по умолчанию 100000 '
+                             'без --duration')
+    parser.add_argument('--duration', type=float,
+                        help='длительность прогона в секундах')
+    parser.add_argument('--mix', type=parse_mix, default=MIX,
+                        help='доли видов тренировок: RUN=2,WLK=1,SWM=1')
+    parser.add_argument('--malformed', type=float, default=0.0,
+                        help='доля неправильных пакетов, 0.01 — 1%%')
+    parser.add_argument('--athletes', type=int, default=0,
+                        help='число устройств в id пакетов, 0 — без id')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', metavar='PATH',
+                        help='только записать пакеты в файл, `-` — stdout')
+    parser.add_argument('--target', default='stdin',
+                        help='stdin, file, tcp:HOST:PORT или unix:PATH')
+    parser.add_argument('--rate', type=float, default=0.0,
+                        help='пакетов в секунду, 0 — без ограничения')
+    parser.add_argument('--interval', type=float, default=10.0,
+                        help='длина интервала отчёта в секундах')
+    parser.add_argument('--pid', type=int,
+                        help='процесс сервера для замера памяти')
+    parser.add_argument('homework_args', nargs='*', metavar='ARG',
+                        help='аргументы homework.py после `--`')
+    return parser
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    """Генерирует пакеты или прогоняет их через обработчик."""
+
+    args = build_parser().parse_args(argv)
+    count = args.count
+    if count is None and args.duration is None:
+        count = 100_000
+    if args.duration is None:
+        args.duration = float('inf')
+    elif args.target == 'file' and count is None:
+        print('Для --target file нужно --count', file=sys.stderr)
+        return 2
+    deadline = time.perf_counter() + args.duration
+    lines = package_lines(generate_packages(
+        count, args.mix, args.malformed, args.athletes, args.seed
+    ))
+    if args.output:
+        with ExitStack() as stack:
+            file = sys.stdout if args.output == '-' else stack.enter_context(
+                open(args.output, 'w', encoding='utf-8')
+            )
+            file.writelines(takewhile(
+                lambda _: time.perf_counter() < deadline, lines
+            ))
+        return 0
+    if args.target == 'file':
+        result = run_file(args, lines)
+    else:
+        with ExitStack() as stack:
+            target = open_target(stack, args)
+            stats, elapsed = soak(
+                target, lines, args.duration, args.rate, args.interval,
+                print_interval,
+            )
+            result = summary(stats, elapsed, target.process)
+    json.dump(result, sys.stdout, indent=2)
+    print()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
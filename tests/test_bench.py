@@ -0,0 +1,26 @@
+import bench
+
+
+def test_run_benchmarks():
+    results = bench.run_benchmarks(size=30, repeat=1)
+    for stage in [
+        'read_package', 'decode_package', 'construct.Running',
+        'get_spent_calories.Swimming', 'show_training_info',
+        'show_training_info.SportsWalking',
+        'get_message', 'end_to_end',
+    ]:
+        assert results[stage]['ns_per_op'] > 0, (
+            f'Замер этапа `{stage}` должен быть в результатах.'
+        )
+
+
+def test_compare():
+    baseline = {'a': {'ns_per_op': 100.0}, 'b': {'ns_per_op': 100.0}}
+    results = {
+        'a': {'ns_per_op': 110.0},
+        'b': {'ns_per_op': 150.0},
+        'c': {'ns_per_op': 1.0},
+    }
+    assert bench.compare(results, baseline, 0.2) == ['b'], (
+        'Регрессией считается замедление больше порога.'
+    )
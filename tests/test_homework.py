@@ -1,4 +1,7 @@
 import re
+import asyncio
+import io
+from datetime import date
 import pytest
 import types
 import inspect
@@ -419,3 +422,1129 @@ def test_main_output(input_data, expected):
     assert get_message_output == expected, (
         'Метод `main` должен печатать результат в консоль.\n'
     )
+
+
+@pytest.mark.parametrize('workout_type, rows', [
+    ('SWM', [[720, 1, 80, 25, 40], [420, 4, 20, 42, 4]]),
+    ('RUN', [[9000, 1, 75], [420, 4, 20], [1206, 12, 6]]),
+    ('WLK', [[9000, 1, 75, 180], [3000.33, 2.512, 75.8, 180.1]]),
+])
+def test_read_batch(workout_type, rows):
+    distance, speed, calories = homework.read_batch(
+        workout_type, *zip(*rows)
+    )
+    for index, row in enumerate(rows):
+        training = homework.read_package(workout_type, row)
+        assert distance[index] == pytest.approx(training.get_distance()), (
+            'Пакетный расчёт дистанции должен совпадать с `get_distance`.'
+        )
+        assert speed[index] == pytest.approx(training.get_mean_speed()), (
+            'Пакетный расчёт скорости должен совпадать с `get_mean_speed`.'
+        )
+        assert calories[index] == pytest.approx(
+            training.get_spent_calories()
+        ), (
+            'Пакетный расчёт калорий должен совпадать '
+            'с `get_spent_calories`.'
+        )
+
+
+def test_read_batch_wrong_input():
+    with pytest.raises(Exception):
+        homework.read_batch('BIKE', [1], [1], [1])
+    with pytest.raises(Exception):
+        homework.read_batch('RUN', [1, 2], [1], [1])
+    with pytest.raises(Exception, match='Неправильные входные данные'):
+        homework.read_batch('RUN', [15000], [0], [75])
+    with pytest.raises(Exception, match='Неправильные входные данные'):
+        homework.read_batch('WLK', [1e308], [1], [75], [180])
+    with pytest.raises(Exception, match='Неправильные входные данные'):
+        homework.read_batch('RUN', [1e300], [1e-300], [75])
+
+
+def test_run(tmp_path, capsys):
+    path = tmp_path / 'packages.csv'
+    path.write_text(
+        'SWM,720,1,80,25,40\n'
+        'RUN,abc,1,75\n'
+        '\n'
+        'WLK,9000,1,75,180\n',
+        encoding='utf-8',
+    )
+    homework.run([str(path)])
+    output = capsys.readouterr()
+    assert output.out.splitlines() == [
+        'Тип тренировки: Swimming; '
+        'Длительность: 1.000 ч.; '
+        'Дистанция: 0.994 км; '
+        'Ср. скорость: 1.000 км/ч; '
+        'Потрачено ккал: 336.000.',
+        "Неправильные входные данные: could not convert string to float: "
+        "'abc'",
+        'Тип тренировки: SportsWalking; '
+        'Длительность: 1.000 ч.; '
+        'Дистанция: 5.850 км; '
+        'Ср. скорость: 5.850 км/ч; '
+        'Потрачено ккал: 349.252.',
+    ], 'Функция `run` должна печатать сообщения для каждого пакета.'
+    assert 'Обработано пакетов: 2' in output.err, (
+        'Функция `run` должна сообщать о скорости обработки.'
+    )
+
+
+def test_split_shards(tmp_path):
+    path = tmp_path / 'packages.csv'
+    content = b'RUN,15000,1,75\nSWM,720,1,80,25,40\nWLK,9000,1,75,180\n' * 50
+    path.write_bytes(content)
+    shards = homework.split_shards(str(path), 100)
+    assert shards[0][0] == 0 and shards[-1][1] == len(content)
+    for (_, end), (start, _) in zip(shards, shards[1:]):
+        assert end == start, 'Диапазоны должны идти подряд.'
+        assert content[start - 1:start] == b'\n', (
+            'Диапазоны должны начинаться с новой строки.'
+        )
+
+
+def test_process_file_parallel(tmp_path, capsys):
+    path = tmp_path / 'packages.csv'
+    path.write_text(
+        'RUN,15000,1,75\nSWM,720,1,80,25,40\nBIKE,1,1\n'
+        'WLK,9000,1,75,180\n' * 20,
+        encoding='utf-8',
+    )
+    homework.print_messages(str(path))
+    expected = capsys.readouterr().out
+    shards = homework.process_file_parallel(str(path), 2, shard_size=64)
+    assert ''.join(text for text, _ in shards) == expected, (
+        'Параллельная обработка должна сохранять порядок вывода.'
+    )
+
+
+def test_training_server():
+    async def session():
+        server = homework.TrainingServer(max_connections=1, queue_size=2)
+        tcp_server = await server.start('127.0.0.1', 0)
+        port = tcp_server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b'RUN,1206,12,6\nBIKE,1,1\n' * 5)
+        await writer.drain()
+        second_reader, _ = await asyncio.open_connection('127.0.0.1', port)
+        rejected = await second_reader.read()
+        writer.write_eof()
+        answer = await reader.read()
+        writer.close()
+        await server.close()
+        return rejected.decode(), answer.decode().splitlines()
+
+    rejected, answer = asyncio.run(session())
+    assert rejected == 'Превышено число соединений\n', (
+        'Сервер должен ограничивать число соединений.'
+    )
+    assert answer == [
+        'Тип тренировки: Running; '
+        'Длительность: 12.000 ч.; '
+        'Дистанция: 0.784 км; '
+        'Ср. скорость: 0.065 км/ч; '
+        'Потрачено ккал: 12.812.',
+        'Неправильные входные данные: '
+        "неизвестный тип тренировки: 'BIKE'",
+    ] * 5, 'Сервер должен отвечать на каждый пакет по порядку.'
+
+
+@pytest.mark.parametrize('batched', [False, True])
+def test_training_server_bad_packages(monkeypatch, batched):
+    render_package = homework.render_package
+    parse = homework.PackageDecoder.parse
+
+    def failing_render(workout_type, data):
+        if workout_type == 'WLK':
+            raise RuntimeError('сбой расчёта')
+        return render_package(workout_type, data)
+
+    def failing_parse(self, data):
+        if self.training is homework.SportsWalking:
+            raise RuntimeError('сбой расчёта')
+        return parse(self, data)
+
+    monkeypatch.setattr(homework, 'render_package', failing_render)
+    monkeypatch.setattr(homework.PackageDecoder, 'parse', failing_parse)
+
+    async def session():
+        server = homework.TrainingServer(
+            batcher=homework.MicroBatcher() if batched else None
+        )
+        tcp_server = await server.start('127.0.0.1', 0)
+        port = tcp_server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(
+            b'RUN,\xff\xfe,1,75\nWLK,9000,1,75,180\nRUN,15000,1,75\n'
+        )
+        writer.write_eof()
+        answer = await reader.read()
+        writer.close()
+        await server.close()
+        return answer.decode().splitlines()
+
+    answer = asyncio.run(session())
+    assert len(answer) == 3, 'Ошибка пакета не должна обрывать соединение.'
+    assert all(
+        line.startswith('Неправильные входные данные: ')
+        for line in answer[:2]
+    ), 'На ошибочный пакет сервер должен отвечать строкой ошибки.'
+    assert answer[2] == render_package('RUN', ['15000', '1', '75'])
+
+
+@pytest.mark.parametrize('input_data, field, value', [
+    (['SWM', [720, 1, 80, 25, 40]], 'count_pool', 20),
+    (['RUN', [9000, 1, 75]], 'duration', 2),
+    (['WLK', [9000, 1, 75, 180]], 'height', 160),
+])
+def test_training_metrics_follow_fields(input_data, field, value):
+    training = homework.read_package(*input_data)
+    first = training.show_training_info()
+    assert training.show_training_info() == first, (
+        'Повторный расчёт должен давать тот же результат.'
+    )
+    setattr(training, field, value)
+    workout_type, data = input_data
+    expected = homework.read_package(
+        workout_type,
+        [value if name == field else old for name, old in zip(
+            inspect.signature(type(training)).parameters, data
+        )],
+    ).show_training_info()
+    assert training.show_training_info() == expected, (
+        'Показатели должны считаться по текущим параметрам тренировки.'
+    )
+
+
+def test_training_metric_overrides():
+    running = homework.Running(15000, 1, 75)
+    running.get_spent_calories = lambda: 100
+    assert running.show_training_info().calories == 100, (
+        'Сводка должна учитывать метод, подменённый у объекта.'
+    )
+
+    class Trail(homework.Running):
+        def get_spent_calories(self):
+            return 2 * super().get_spent_calories()
+
+    expected = 2 * homework.Running(15000, 1, 75).get_spent_calories()
+    assert Trail(15000, 1, 75).show_training_info().calories == expected, (
+        'Сводка должна учитывать метод, переопределённый в подклассе.'
+    )
+
+
+def test_workout_store():
+    packages = [
+        ('SWM', [720, 1, 80, 25, 40]),
+        ('RUN', [15000, 1, 75]),
+        ('WLK', [9000, 1, 75, 180]),
+        ('RUN', [1206, 12, 6]),
+        ('WLK', [3000.33, 2.512, 75.8, 180.1]),
+    ]
+    store = homework.WorkoutStore()
+    for workout_type, data in packages:
+        store.append(workout_type, data)
+    assert len(store) == 5 and store.count('RUN') == 2
+    for code in ('SWM', 'RUN', 'WLK'):
+        expected = [
+            homework.read_package(code, data).show_training_info()
+            for workout_type, data in packages if workout_type == code
+        ]
+        assert list(store.messages(code)) == expected, (
+            '`WorkoutStore.messages` должен совпадать с '
+            '`show_training_info`.'
+        )
+        assert [
+            training.show_training_info()
+            for training in store.trainings(code)
+        ] == expected
+    assert list(store.messages('RUN', slice(1, None))) == [
+        homework.Running(1206, 12, 6).show_training_info()
+    ]
+    with pytest.raises(Exception):
+        store.append('RUN', [1, 2])
+    with pytest.raises(Exception):
+        store.append('BIKE', [1, 2, 3])
+
+
+def test_InfoMessage_slots():
+    info_message = homework.InfoMessage('Running', 1, 1, 1, 1)
+    assert not hasattr(info_message, '__dict__'), (
+        '`InfoMessage` должен хранить поля в `__slots__`.'
+    )
+
+
+@pytest.mark.parametrize('input_data, expected', [
+    (['SWM', ['720', '1', '80', '25', '40']], 'Swimming'),
+    (['RUN', [' 15000', '1.5', '7.5e1']], 'Running'),
+    (['WLK', ['9000', '1', '75', '180']], 'SportsWalking'),
+    (['BIKE', ['1', '1', '1']], 'type'),
+    (['RUN', ['15000', '1']], 'arity'),
+    (['RUN', ['15000', 'nan', '75']], 'format'),
+    (['SWM', ['720', '1', '80', '25.5', '40']], 'format'),
+    (['SWM', ['720', '1', '80', '25.0', '4e1']], 'Swimming'),
+    (['RUN', ['15000', '0', '75']], 'range'),
+    (['RUN', ['15000', '1', '-75']], 'range'),
+    (['WLK', ['9000', '1', '75', '0']], 'range'),
+    (['RUN', ['1e308', '1', '1e308']], 'Running'),
+])
+def test_decode_package(input_data, expected):
+    result = homework.decode_package(*input_data)
+    if isinstance(result, homework.PackageError):
+        assert result.reason == expected, (
+            '`decode_package` должна возвращать причину ошибки.'
+        )
+    else:
+        assert type(result).__name__ == expected, (
+            '`decode_package` должна возвращать объект тренировки.'
+        )
+        assert all(
+            type(getattr(result, name)) is kind
+            for name, kind in zip(
+                result.FIELDS, homework.DECODERS[input_data[0]].types
+            )
+        ), 'Целые поля должны приводиться к `int`.'
+
+
+def test_dead_letter_sink(tmp_path, capsys):
+    path = tmp_path / 'packages.csv'
+    path.write_text(
+        'RUN,15000,1,75\nBIKE,1,1\n\nRUN,abc,1,75\nRUN,1,0,75\n'
+        'SWM,720,1,80,25,40\n',
+        encoding='utf-8',
+    )
+    dead_letter_path = tmp_path / 'dead.csv'
+    homework.run([str(path), '--dead-letter', str(dead_letter_path)])
+    output = capsys.readouterr()
+    assert len(output.out.splitlines()) == 2, (
+        'Отклонённые пакеты не должны попадать в stdout.'
+    )
+    assert 'Отклонено пакетов: 3 (format: 1, range: 1, type: 1)' in (
+        output.err
+    )
+    rows = dead_letter_path.read_text(encoding='utf-8').splitlines()
+    assert [row.split(',')[:2] for row in rows] == [
+        ['2', 'type'], ['4', 'format'], ['5', 'range']
+    ], 'Карантин должен хранить номер строки и причину ошибки.'
+
+
+def test_message_writer():
+    rows = [[9000, 1, 75], [420, 4, 20], [1206.5, 12.25, 6]]
+    expected = ''.join(
+        homework.Running(*row).show_training_info().get_message() + '\n'
+        for row in rows
+    )
+    columns = list(zip(*rows))
+    output = io.StringIO()
+    writer = homework.MessageWriter(output, batch_size=2)
+    writer.write_columns(
+        'Running', columns[1], *homework.read_batch('RUN', *columns)
+    )
+    assert output.getvalue().count('\n') == 2, (
+        '`MessageWriter` должен писать в поток пачками по `batch_size`.'
+    )
+    writer.flush()
+    assert output.getvalue() == expected, (
+        '`MessageWriter` должен выводить тот же текст, что и `get_message`.'
+    )
+
+
+def test_flush_lines(tmp_path, monkeypatch):
+    class Stream(io.StringIO):
+        writes = 0
+
+        def write(self, text):
+            self.writes += 1
+            return super().write(text)
+
+    path = tmp_path / 'packages.csv'
+    path.write_text('RUN,15000,1,75\n' * 5, encoding='utf-8')
+    for argv, writes in ([], 1), (['--flush-lines', '2'], 3):
+        stream = Stream()
+        monkeypatch.setattr(homework.sys, 'stdout', stream)
+        homework.run([str(path), *argv])
+        assert stream.writes == writes, (
+            '`--flush-lines` должен задавать размер пачки вывода.'
+        )
+        assert stream.getvalue().count('\n') == 5
+    with pytest.raises(SystemExit):
+        homework.run([str(path), '--flush-lines', '0'])
+
+
+def test_stage_metrics(tmp_path, capsys):
+    path = tmp_path / 'packages.csv'
+    path.write_text(
+        'RUN,15000,1,75\nRUN,1206,12,6\nBIKE,1,1\nSWM,720,1,80,25,40\n',
+        encoding='utf-8',
+    )
+    metrics_path = tmp_path / 'metrics.prom'
+    homework.run([str(path), '--metrics', str(metrics_path)])
+    assert len(capsys.readouterr().out.splitlines()) == 4
+    text = metrics_path.read_text(encoding='utf-8')
+    assert (
+        'homework_stage_seconds_count{stage="calories",type="RUN"} 2'
+        in text
+    ), 'Метрики должны считать пакеты по этапам и типам тренировок.'
+    assert 'homework_rejected_total{reason="type"} 1' in text
+
+    metrics = homework.StageMetrics()
+    metrics.observe('decode', 'SWM', 3e-6)
+    metrics.observe('decode', 'SWM', 2.0)
+    snapshot = metrics.snapshot()['stages']['decode']['SWM']
+    assert snapshot['count'] == 2 and snapshot['buckets']['5e-06'] == 1
+    assert snapshot['buckets']['inf'] == 1
+    metrics.observe('decode', 'SWM@watch-1/1', 1e-6)
+    assert metrics.snapshot()['stages']['decode']['SWM']['count'] == 3, (
+        'Id пакета не должен превращать тип тренировки в `unknown`.'
+    )
+
+
+def test_athlete_aggregator(tmp_path):
+    aggregator = homework.AthleteAggregator()
+    monday, tuesday = date(2024, 1, 1), date(2024, 1, 2)
+    running = homework.Running(9000, 1, 75).show_training_info()
+    walking = homework.SportsWalking(9000, 1, 75, 180).show_training_info()
+    aggregator.add('anna', running, monday)
+    aggregator.add('anna', running, tuesday)
+    aggregator.add('anna', walking, tuesday)
+    aggregator.add('ivan', running, tuesday)
+    day = aggregator.day_totals('anna', 'Running', tuesday)
+    assert (day.count, day.distance) == (1, running.distance)
+    week = aggregator.week_totals('anna', 'Running', monday)
+    assert week.count == 2 and week.duration == 2
+    assert week.calories == pytest.approx(2 * running.calories)
+    assert week.mean_speed == pytest.approx(running.speed)
+
+    path = tmp_path / 'totals.json'
+    aggregator.save(str(path))
+    restored = homework.AthleteAggregator.load(str(path))
+    assert restored.daily == aggregator.daily, (
+        'Итоги должны восстанавливаться из файла без потерь.'
+    )
+    assert restored.weekly == aggregator.weekly
+
+    restored.prune(tuesday)
+    assert restored.day_totals('anna', 'Running', monday).count == 0
+    assert restored.day_totals('anna', 'Running', tuesday).count == 1
+
+
+def test_result_cache():
+    cache = homework.ResultCache(capacity=2)
+    first = cache.get_info('RUN', ['15000', '1', '75'])
+    assert cache.get_info('RUN', ['15000', '1', '75']) is first, (
+        'Повторный пакет должен браться из кэша.'
+    )
+    assert first == homework.Running(15000, 1, 75).show_training_info()
+    assert cache.get_info('RUN@watch-1/1', ['15000', '1', '75']) is first, (
+        'Id пакета не должен мешать попаданию.'
+    )
+    assert isinstance(
+        cache.get_info('BIKE', ['1']), homework.PackageError
+    )
+    cache.get_info('WLK', ['9000', '1', '75', '180'])
+    assert len(cache) == 2, 'Кэш не должен расти больше `capacity`.'
+    assert cache.stats() == {
+        'size': 2, 'capacity': 2, 'hits': 2, 'misses': 3,
+        'evictions': 1, 'hit_ratio': 0.4, 'bypassed': False,
+    }
+    cache.get_info('RUN', ['15000', '1', '75'])
+    assert cache.misses == 4, 'Давний результат должен быть вытеснен.'
+
+    cache = homework.ResultCache()
+    packages = [
+        (number, 'RUN', [str(number), '1', '75'])
+        for number in range(cache.WINDOW)
+    ]
+    assert list(homework.process_packages(packages, cache=cache)) == [
+        homework.info_package(*package[1:]) for package in packages
+    ]
+    assert cache.bypassed and cache.misses == cache.WINDOW - 1, (
+        'Кэш без попаданий должен отключаться.'
+    )
+    for _ in range(cache.PAUSE_WINDOWS - 1):
+        assert cache.next_window() is homework.info_package
+    assert cache.next_window() == cache.get_info, (
+        'После паузы кэш должен пробоваться снова.'
+    )
+
+
+def test_file_follower(tmp_path):
+    path = tmp_path / 'packages.csv'
+    checkpoint = tmp_path / 'packages.offset'
+    path.write_bytes(b'RUN,15000,1,75\nSWM,720,1,80')
+
+    follower = homework.FileFollower(str(path), str(checkpoint), 0.01)
+    lines = follower.lines()
+    assert next(lines) == 'RUN,15000,1,75'
+    with open(path, 'ab') as file:
+        file.write(b',25,40\nWLK,9000')
+    assert next(lines) == 'SWM,720,1,80,25,40', (
+        'Незаконченная строка должна ждать окончания.'
+    )
+    follower.stop()
+    assert list(lines) == []
+    assert checkpoint.read_text() == str(len(
+        b'RUN,15000,1,75\nSWM,720,1,80,25,40\n'
+    )), 'Позиция должна сохраняться после полных строк.'
+
+    with open(path, 'ab') as file:
+        file.write(b',1,75,180\n')
+    resumed = homework.FileFollower(str(path), str(checkpoint), 0.01)
+    resumed.stop()
+    assert list(resumed.lines()) == ['WLK,9000,1,75,180'], (
+        'После перезапуска чтение должно продолжаться с сохранённой позиции.'
+    )
+
+    growing = tmp_path / 'growing.csv'
+    growing.write_bytes(b'RUN,15000,1,75\n')
+    follower = homework.FileFollower(str(growing), interval=0.01)
+    checkpoints = []
+
+    def grow():
+        checkpoints.append(follower.offset)
+        if len(checkpoints) < 100:
+            with open(growing, 'ab') as file:
+                file.write(b'RUN,15000,1,75\n')
+        follower.stop()
+
+    assert list(follower.lines(grow)) == ['RUN,15000,1,75']
+    assert len(checkpoints) == 1, (
+        'Остановка не должна ждать, пока файл перестанет расти.'
+    )
+
+    with open(path, 'ab') as file:
+        start = file.tell()
+        file.write(b'BIKE,1,1\n')
+    follower = homework.FileFollower(str(path), str(checkpoint), 0.01)
+    follower.stop()
+    dead_letter_path = tmp_path / 'dead.csv'
+    with homework.DeadLetterSink(str(dead_letter_path)) as dead_letters:
+        homework.print_messages(str(path), dead_letters, follower=follower)
+    assert dead_letter_path.read_text(encoding='utf-8').startswith(
+        f'{start},type,'
+    ), 'В режиме слежения карантин должен хранить смещение строки.'
+
+
+def test_package_file(tmp_path, capsys):
+    packages = [
+        ('SWM', [720, 1, 80, 25, 40]),
+        ('RUN', [15000, 1, 75]),
+        ('WLK', [9000, 1, 75, 180]),
+        ('RUN', [1206, 12, 6]),
+    ]
+    source = tmp_path / 'packages.csv'
+    source.write_text(
+        ''.join(
+            ','.join(map(str, [workout_type, *data])) + '\n'
+            for workout_type, data in packages
+        ) + 'BIKE,1,1\n',
+        encoding='utf-8',
+    )
+    path = tmp_path / 'packages.bin'
+    homework.run([str(source), '--to-binary', str(path)])
+    assert 'Записано пакетов: 4, отклонено: 1' in capsys.readouterr().err
+
+    with homework.PackageFile(str(path)) as package_file:
+        assert len(package_file) == 4
+        action = package_file.column(1)
+        assert list(action) == [720, 15000, 9000, 1206], (
+            'Столбцы должны читаться из файла в порядке пакетов.'
+        )
+        action.release()
+        distance, speed, calories = package_file.read_batch('RUN')
+        assert list(calories) == [
+            homework.Running(*data).get_spent_calories()
+            for workout_type, data in packages if workout_type == 'RUN'
+        ]
+        assert len(package_file.columns('SWM')) == 5
+
+
+def test_package_file_wrong_format(tmp_path):
+    path = tmp_path / 'packages.bin'
+    record = bytes(8 * homework.BINARY_FIELDS)
+    for content in (
+        b'RUN,15000,1,75\n', b'', homework.BINARY_MAGIC + record[:-3],
+        homework.BINARY_MAGIC + record + record[:8],
+    ):
+        path.write_bytes(content)
+        with pytest.raises(
+            Exception, match='Неправильный формат файла пакетов'
+        ):
+            homework.PackageFile(str(path))
+    path.write_bytes(homework.BINARY_MAGIC)
+    with homework.PackageFile(str(path)) as packages:
+        assert len(packages) == 0
+
+
+def test_result_writer(tmp_path, capsys):
+    source = tmp_path / 'packages.csv'
+    source.write_text(
+        'SWM,720,1,80,25,40\nRUN,15000,1,75\nBIKE,1,1\nWLK,9000,1,75,180\n',
+        encoding='utf-8',
+    )
+    directory = tmp_path / 'results'
+    homework.run([str(source), '--results-dir', str(directory)])
+    captured = capsys.readouterr()
+    assert captured.out == '', 'Результаты не должны печататься текстом.'
+    assert 'Неправильные входные данные' in captured.err
+
+    header = (directory / 'speed.npy').read_bytes()[:128]
+    assert header.startswith(b'\x93NUMPY\x01\x00')
+    assert b"'descr': '<f8'" in header and b"'shape': (3,)" in header
+    assert header.endswith(b'\n')
+
+    expected = [
+        homework.Swimming(720, 1, 80, 25, 40).show_training_info(),
+        homework.Running(15000, 1, 75).show_training_info(),
+        homework.SportsWalking(9000, 1, 75, 180).show_training_info(),
+    ]
+    with homework.ResultColumns(str(directory)) as columns:
+        assert len(columns) == 3
+        calories = columns.column('calories')
+        assert list(calories) == [
+            message.calories for message in expected
+        ]
+        calories.release()
+        assert [
+            columns.message(index).get_message() for index in range(3)
+        ] == [message.get_message() for message in expected], (
+            'Прочитанные столбцы должны совпадать с результатами расчёта.'
+        )
+    for options in (['-w', '2'], ['--pipeline']):
+        with pytest.raises(SystemExit):
+            homework.run(
+                [str(source), '--results-dir', str(directory), *options]
+            )
+    assert '--results-dir' in capsys.readouterr().err
+
+
+def test_worker_daemon(tmp_path):
+    import worker_client
+
+    source = tmp_path / 'packages.csv'
+    source.write_text('RUN,1206,12,6\nBIKE,1,1\n', encoding='utf-8')
+    path = str(tmp_path / 'worker.sock')
+
+    async def session():
+        daemon = homework.WorkerDaemon()
+        await daemon.start_unix(path)
+        reader, writer = await asyncio.open_unix_connection(path)
+        writer.write(f'!FILE {source}\nWLK,9000,1,75,180\n!PING\n'.encode())
+        writer.write_eof()
+        answer = (await reader.read()).decode().splitlines()
+        writer.close()
+        output = io.BytesIO()
+        await asyncio.to_thread(
+            worker_client.request, path, [b'!RELOAD\n'], output
+        )
+        fd = daemon.inherit_socket()
+        await daemon.close()
+        homework.os.close(fd)
+        return answer, output.getvalue(), daemon.reload.is_set()
+
+    answer, reloaded, reload = asyncio.run(session())
+    assert answer[:3] == [
+        homework.Running(1206, 12, 6).show_training_info().get_message(),
+        'Неправильные входные данные: '
+        "неизвестный тип тренировки: 'BIKE'",
+        homework.SportsWalking(9000, 1, 75, 180)
+        .show_training_info().get_message(),
+    ], 'Обработчик должен отвечать на пакеты из файла и из соединения.'
+    assert answer[3] == f'OK {homework.os.getpid()} 3', (
+        'Проверка состояния должна возвращать число обработанных пакетов.'
+    )
+    assert reloaded == b'OK reload\n' and reload
+
+
+def test_register_workout():
+    @homework.register_workout('TST')
+    class Rowing(homework.Training):
+        LEN_STEP = 2.5
+        CALORIES_SPEED_MULTIPLIER = 0.4
+        CALORIES = 'CALORIES_SPEED_MULTIPLIER * speed * weight * duration'
+
+    try:
+        training = homework.read_package('TST', [4000, 0.5, 70])
+        assert training.get_spent_calories() == (
+            0.4 * (4000 * 2.5 / 1000 / 0.5) * 70 * 0.5
+        ), 'Методы показателей должны собираться из формул класса.'
+        assert homework.render_package('TST', ['4000', '0.5', '70']) == (
+            training.show_training_info().get_message()
+        ), 'Новый вид тренировки должен обрабатываться в потоке пакетов.'
+        distance, speed, calories = homework.read_batch(
+            'TST', [4000, 2000], [0.5, 1], [70, 80]
+        )
+        assert list(calories) == [
+            Rowing(*row).get_spent_calories()
+            for row in [(4000, 0.5, 70), (2000, 1, 80)]
+        ], 'Пакетный расчёт должен совпадать с расчётом по одному пакету.'
+        with pytest.raises(Exception):
+            homework.register_workout('TST')(Rowing)
+    finally:
+        del homework.TYPE_DICT['TST'], homework.DECODERS['TST']
+        del homework.TYPE_CODES['Rowing']
+
+    with pytest.raises(Exception):
+        @homework.register_workout('BAD')
+        class Broken(homework.Training):
+            CALORIES = 'unknown * weight'
+
+
+def test_register_workout_negative_constant():
+    @homework.register_workout('NEG')
+    class Negative(homework.Training):
+        K = -2
+        CALORIES = 'K ** 2 * weight'
+
+    try:
+        assert Negative.kernel(1000, 1, 1)[2] == 4, (
+            'Отрицательная константа должна вставляться в скобках.'
+        )
+        assert Negative(1000, 1, 1).get_spent_calories() == 4
+        assert list(homework.read_batch('NEG', [1000], [1], [1])[2]) == [4]
+    finally:
+        del homework.TYPE_DICT['NEG'], homework.DECODERS['NEG']
+        del homework.TYPE_CODES['Negative']
+
+
+def test_register_workout_without_annotations():
+    @homework.register_workout('ROW')
+    class Rowing(homework.Training):
+        CALORIES = 'resistance * speed * weight * duration'
+
+        def __init__(self, action, duration, weight, resistance):
+            super().__init__(action, duration, weight)
+            self.resistance = resistance
+
+    try:
+        assert homework.DECODERS['ROW'].types == (float,) * 4
+        assert homework.info_package('ROW', ['4000', '1', '70', '2']) == (
+            Rowing(4000, 1, 70, 2).show_training_info()
+        ), 'Поля без аннотаций должны разбираться как `float`.'
+    finally:
+        del homework.TYPE_DICT['ROW'], homework.DECODERS['ROW']
+        del homework.TYPE_CODES['Rowing']
+
+
+def test_seen_index(tmp_path, capsys):
+    source = tmp_path / 'day1.csv'
+    source.write_text(
+        'RUN@watch-1/1,15000,1,75\nRUN@watch-1/2,9000,1,75\n'
+        'RUN@watch-1/1,15000,1,75\nWLK,9000,1,75,180\n',
+        encoding='utf-8',
+    )
+    path = tmp_path / 'seen.db'
+    homework.run([str(source), '--seen', str(path)])
+    captured = capsys.readouterr()
+    assert len(captured.out.splitlines()) == 3, (
+        'Повтор id в одном файле должен пропускаться.'
+    )
+    assert 'Новых id: 2, пропущено повторов: 1' in captured.err
+
+    overlap = tmp_path / 'day2.csv'
+    overlap.write_text(
+        'RUN@watch-1/2,9000,1,75\nRUN@watch-1/3,15000,1,75\n',
+        encoding='utf-8',
+    )
+    homework.run([str(overlap), '--seen', str(path)])
+    assert capsys.readouterr().out == (
+        homework.Running(15000, 1, 75).show_training_info().get_message()
+        + '\n'
+    ), 'Id из прошлых запусков должны пропускаться.'
+
+    (tmp_path / 'seen.db.bloom').unlink()
+    with homework.SeenIndex(str(path), memory=1, capacity=1) as seen:
+        assert 'watch-1/3' in seen, (
+            'Фильтр Блума должен восстанавливаться из базы.'
+        )
+        assert [
+            seen.add(f'watch-2/{number}') for number in range(100)
+        ] == [True] * 100, (
+            'Ложные срабатывания фильтра не должны терять новые id.'
+        )
+        assert not seen.add('watch-2/7')
+    assert homework.info_package('RUN@watch-9/1', ['15000', '1', '75']) == (
+        homework.Running(15000, 1, 75).show_training_info()
+    ), 'Без индекса id должен отбрасываться при разборе.'
+
+
+def test_seen_index_accepted_only(tmp_path, capsys, monkeypatch):
+    import sqlite3
+
+    path = tmp_path / 'seen.db'
+    source = tmp_path / 'packages.csv'
+    source.write_text('RUN@watch-1/1,15000,0,75\n', encoding='utf-8')
+    homework.run([str(source), '--seen', str(path)])
+    assert 'Неправильные входные данные' in capsys.readouterr().out
+    source.write_text('RUN@watch-1/1,15000,1,75\n', encoding='utf-8')
+    homework.run([str(source), '--seen', str(path)])
+    assert capsys.readouterr().out.startswith('Тип тренировки: Running'), (
+        'Id отклонённого пакета не должен запоминаться.'
+    )
+
+    monkeypatch.setattr(homework.SeenIndex, 'BATCH_SIZE', 2)
+    packages = [
+        (number, f'RUN@watch-2/{number}', ['15000', '1', '75'])
+        for number in range(3)
+    ]
+    flushed = []
+
+    def flush_output():
+        with sqlite3.connect(str(path)) as database:
+            flushed.append(database.execute(
+                "SELECT count(*) FROM seen WHERE id LIKE 'watch-2/%'"
+            ).fetchone()[0])
+
+    with homework.SeenIndex(str(path)) as seen:
+        messages = seen.accepted(
+            homework.process_packages(seen.filter(packages)), flush_output
+        )
+        assert len(list(messages)) == 3
+        assert flushed == [0], (
+            'Вывод должен сбрасываться до записи пачки id в базу.'
+        )
+    with homework.SeenIndex(str(path)) as seen:
+        assert all(f'watch-2/{number}' in seen for number in range(3))
+
+
+def test_live_session():
+    session = homework.LiveSession('RUN', 75, window=120, buckets=4, start=0)
+    for timestamp in range(60, 660, 60):
+        window, total = session.add(timestamp, 150)
+    expected = homework.Running(1500, 600 / 3600, 75).show_training_info()
+    assert total == expected, (
+        'Итоги сессии должны считаться по формулам `Running`.'
+    )
+    expected = homework.Running(300, 120 / 3600, 75).show_training_info()
+    assert window == expected, (
+        'Окно должно содержать только последние отсчёты.'
+    )
+    window, total = session.add(6000, 0)
+    assert window.distance == 0 and total.distance == 1500 * 0.65 / 1000, (
+        'После долгой паузы окно должно опустеть.'
+    )
+
+    swimming = homework.LiveSession('SWM', 80, 25, start=0)
+    for timestamp in range(360, 3960, 360):
+        window, total = swimming.add(timestamp, 72, 4)
+    assert total == homework.Swimming(720, 1, 80, 25, 40).show_training_info()
+    with pytest.raises(Exception):
+        swimming.add(4000, 10)
+    assert swimming.check(4000, float('nan'), 1).reason == 'format'
+    with pytest.raises(Exception, match='height'):
+        homework.LiveSession('WLK', 75, 0)
+    with pytest.raises(Exception):
+        homework.LiveSession('RUN', 75, window=0)
+
+
+def test_print_live(tmp_path, capsys):
+    path = tmp_path / 'samples.csv'
+    path.write_text('60,150\n120,x\n180,1,2\nnan,1\n240,150\n')
+    homework.run([str(path), '--live', 'WLK,75,180', '--window', '60'])
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 7
+    assert all(
+        line.startswith('Неправильные входные данные: ')
+        for line in lines[2:5]
+    ), 'Ошибочные отсчёты должны печататься с префиксом ошибки.'
+    assert lines[6].startswith('Всего: Тип тренировки: SportsWalking')
+
+
+def test_shared_pipeline(tmp_path, capsys):
+    path = tmp_path / 'packages.csv'
+    path.write_text(
+        'RUN,15000,1,75\nSWM,720,1,80,25,40\nBIKE,1,1\n'
+        'WLK,9000,1,75,180\nRUN,1,x,75\n' * 20,
+        encoding='utf-8',
+    )
+    homework.print_messages(str(path))
+    expected = capsys.readouterr().out
+    results = list(homework.process_file_shared(
+        str(path), 2, 2, rows=3, slots=2, shard_size=64,
+    ))
+    assert ''.join(text for text, _ in results) == expected, (
+        'Конвейер должен сохранять порядок и тексты ошибок.'
+    )
+    assert sum(count for _, count in results) == 60
+
+    path.write_text(
+        'RUN,15000,1,75\nRUN,9000,2,80\nRUN,1e300,1e-300,75\n' * 4,
+        encoding='utf-8',
+    )
+    homework.print_messages(str(path))
+    expected = capsys.readouterr().out
+    results = list(homework.process_file_shared(
+        str(path), 1, 1, rows=2, slots=2, shard_size=64,
+    ))
+    assert ''.join(text for text, _ in results) == expected, (
+        'Слоты с пакетами одного типа должны считаться так же.'
+    )
+    assert sum(count for _, count in results) == 8
+
+
+def test_package_arithmetic_error(tmp_path, capsys):
+    result = homework.info_package('WLK', ['1e308', '1', '75', '180'])
+    assert isinstance(result, homework.PackageError), (
+        'Переполнение в формуле должно отклонять пакет.'
+    )
+    assert result.reason == 'range'
+    result = homework.info_package('RUN', ['1e300', '1e-300', '75'])
+    assert isinstance(result, homework.PackageError), (
+        'Бесконечная скорость должна отклонять пакет.'
+    )
+    assert result.reason == 'range'
+    path = tmp_path / 'packages.csv'
+    path.write_text(
+        'WLK,1e308,1,75,180\nRUN,15000,1,75\nWLK,9000,1,75,0\n'
+        'RUN,1e300,1e-300,75\n',
+        encoding='utf-8',
+    )
+    homework.print_messages(str(path))
+    expected = capsys.readouterr().out
+    assert expected.count('Неправильные входные данные') == 3
+    assert 'inf' not in expected
+    results = list(homework.process_file_shared(str(path), 1, 1))
+    assert ''.join(text for text, _ in results) == expected, (
+        'Конвейер должен отклонять пакет с переполнением так же.'
+    )
+    assert sum(count for _, count in results) == 1
+
+
+def test_quantile_sketch():
+    sketch = homework.QuantileSketch(alpha=0.01)
+    values = [1.5 ** power for power in range(-20, 40)] + [0.0, -3.0]
+    for value in values:
+        sketch.add(value)
+    sketch.add(float('nan'))
+    values.sort()
+    for q in (0, 0.25, 0.5, 0.9, 1):
+        exact = values[int(q * (len(values) - 1))]
+        assert sketch.quantile(q) == pytest.approx(exact, rel=0.01), (
+            'Относительная ошибка квантиля не должна превышать `alpha`.'
+        )
+    other = homework.QuantileSketch(alpha=0.01)
+    other.add(1e9)
+    sketch.merge(other)
+    assert sketch.count == len(values) + 1
+    assert sketch.quantile(1) == pytest.approx(1e9, rel=0.01)
+    with pytest.raises(Exception):
+        sketch.merge(homework.QuantileSketch(alpha=0.05))
+
+
+def test_spilling_report(tmp_path, monkeypatch, capsys):
+    lines = [
+        f'RUN@watch-{number % 7}/{number},{1000 + number},1,75\n'
+        for number in range(50)
+    ] + ['WLK,9000,1,75,180\n', 'BIKE,1,1\n']
+    packages = list(homework.read_rows(lines))
+
+    with homework.SpillingReport(10 ** 9, top=3) as report:
+        assert homework.fill_report(report, packages) == (51, 1)
+        expected = list(report.report())
+        assert report.spills == 0
+    monkeypatch.setattr(homework, 'REPORT_FAN_IN', 2)
+    with homework.SpillingReport(
+        2 * homework.REPORT_GROUP_SIZE, top=3, directory=str(tmp_path)
+    ) as report:
+        homework.fill_report(report, packages)
+        assert report.spills > homework.REPORT_FAN_IN
+        spilled = list(report.report())
+    for section, other in zip(spilled, expected):
+        assert (section.training_type, section.athletes, section.speed) == (
+            other.training_type, other.athletes, other.speed
+        ), 'Отчёт со сбросом серий должен совпадать с отчётом в памяти.'
+        assert section.totals.calories == pytest.approx(other.totals.calories)
+        assert [name for name, _ in section.top] == [
+            name for name, _ in other.top
+        ]
+    assert not list(tmp_path.iterdir()), 'Серии должны удаляться.'
+
+    running, walking = expected
+    assert running.athletes == 7 and running.totals.count == 50
+    assert [name for name, _ in running.top] == [
+        'watch-0', 'watch-6', 'watch-5'
+    ], 'У watch-0 на одну тренировку больше.'
+    assert walking.top == [('', walking.totals.calories)]
+
+    path = tmp_path / 'packages.csv'
+    path.write_text(
+        ''.join(lines),
+        encoding='utf-8',
+    )
+    homework.run([str(path), '--report', '--report-top', '2'])
+    output = capsys.readouterr().out
+    assert output.startswith('Running: тренировок 50, спортсменов 7,')
+    assert 'Больше всего калорий: watch-0' in output
+
+
+def test_batch_http_server():
+    import http.client
+    import json
+    import threading
+
+    server = homework.BatchHTTPServer(('127.0.0.1', 0), max_body=1024)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        connection = http.client.HTTPConnection(*server.server_address)
+        body = json.dumps(
+            [['RUN', 15000, 1, 75], 'SWM,720,1,80,25,40', ['BIKE', 1], 5,
+             ['RUN', 1e300, 1e-300, 75], ['SWM', 720, 1, 80, 25.0, 40]]
+        )
+        connection.request('POST', '/batch', body)
+        response = connection.getresponse()
+        result = json.loads(response.read())
+        assert response.status == 200
+        assert result['accepted'] == 3 and result['rejected'] == 3
+        running = homework.Running(15000, 1, 75).show_training_info()
+        assert result['results'][0] == {
+            field: getattr(running, field)
+            for field in homework.RESULT_FIELDS
+        }, 'Ответ должен содержать поля `InfoMessage`.'
+        assert result['results'][2]['error'] == 'type'
+        assert result['results'][3]['error'] == 'format'
+        assert result['results'][4]['error'] == 'range'
+        assert result['results'][5] == result['results'][1]
+
+        sock = connection.sock
+        connection.request('POST', '/batch', 'nope')
+        response = connection.getresponse()
+        assert response.status == 400
+        response.read()
+        connection.request('GET', '/health')
+        assert json.loads(connection.getresponse().read()) == {'status': 'ok'}
+        assert connection.sock is sock, 'Соединение должно переиспользоваться.'
+
+        connection.request('POST', '/batch', '[' + '1,' * 1024 + '1]')
+        response = connection.getresponse()
+        assert response.status == 413
+        assert response.getheader('Connection') == 'close'
+        connection.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def test_batch_http_server_errors(monkeypatch):
+    import http.client
+    import json
+    import threading
+
+    info_package = homework.info_package
+
+    def failing_info(workout_type, data):
+        if workout_type == 'WLK':
+            raise RuntimeError('сбой расчёта')
+        return info_package(workout_type, data)
+
+    monkeypatch.setattr(homework, 'info_package', failing_info)
+    server = homework.BatchHTTPServer(('127.0.0.1', 0))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        connection = http.client.HTTPConnection(*server.server_address)
+        body = json.dumps(['WLK,9000,1,75,180', 'RUN,15000,1,75'])
+        connection.request('POST', '/batch', body)
+        response = connection.getresponse()
+        result = json.loads(response.read())
+        assert response.status == 200
+        assert result['accepted'] == 1 and result['rejected'] == 1, (
+            'Упавший пакет должен получать ошибку, не мешая остальным.'
+        )
+        assert result['results'][0]['error'] == 'format'
+
+        def failing_results(packages):
+            raise RuntimeError('сбой ответа')
+
+        monkeypatch.setattr(homework, 'batch_results', failing_results)
+        connection.request('POST', '/batch', body)
+        response = connection.getresponse()
+        assert response.status == 500, (
+            'При сбое обработки сервер должен отвечать ошибкой 500.'
+        )
+        assert 'error' in json.loads(response.read())
+        connection.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def test_micro_batcher():
+    packages = [
+        ('RUN', ['15000', '1', '75']), ('SWM', ['720', '1', '80', '25', '40']),
+        ('WLK@watch-1/2', ['9000', '1', '75', '180']), ('BIKE', ['1', '1']),
+        ('RUN', ['1', 'x', '75']),
+    ] * 200
+
+    async def burst():
+        batcher = homework.MicroBatcher(max_latency=0.05, max_batch=16)
+        for workout_type, data in packages[:3]:
+            await batcher.info(workout_type, data)
+        futures = [batcher.submit(*package) for package in packages]
+        depth = batcher.snapshot()['types']['RUN']['queue_depth']
+        results = await asyncio.gather(*futures)
+        return batcher, depth, results
+
+    batcher, depth, results = asyncio.run(burst())
+    assert results == [
+        homework.info_package(*package) for package in packages
+    ], 'Микропакеты должны давать те же результаты, что и `info_package`.'
+    assert depth > 0, 'Частые пакеты должны копиться в очереди.'
+    assert batcher.packages == 603 and batcher.batches < 100, (
+        'Под потоком пакетов размер микропакета должен расти.'
+    )
+    snapshot = batcher.snapshot()['types']
+    assert all(0 < values['batch_size'] <= 16 for values in snapshot.values())
+    assert all(values['queue_depth'] == 0 for values in snapshot.values())
+    assert 'homework_batch_size{type="RUN"}' in batcher.to_prometheus()
+
+    async def sparse():
+        batcher = homework.MicroBatcher(max_latency=0.01)
+        loop = asyncio.get_running_loop()
+        delays = []
+        for _ in range(5):
+            started = loop.time()
+            await batcher.info('RUN', ['15000', '1', '75'])
+            delays.append(loop.time() - started)
+            await asyncio.sleep(0.02)
+        return batcher, max(delays)
+
+    batcher, delay = asyncio.run(sparse())
+    assert batcher.batches == 5 and delay < 0.01, (
+        'Редкие пакеты должны считаться сразу, не дожидаясь срока сброса.'
+    )
+
+
+def test_training_server_micro_batches():
+    import csv
+
+    lines = (
+        b'RUN,1206,12,6\nBIKE,1,1\n\nSWM,720,1,80,25,40\n'
+        b'WLK,1e308,1,75,180\nWLK,9000,1,75,180\n'
+    ) * 50
+
+    async def session():
+        server = homework.TrainingServer(
+            batcher=homework.MicroBatcher(max_latency=0.01)
+        )
+        tcp_server = await server.start('127.0.0.1', 0)
+        port = tcp_server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(lines)
+        writer.write_eof()
+        answer = await reader.read()
+        writer.close()
+        await server.close()
+        return answer.decode().splitlines(), server.batcher
+
+    answer, batcher = asyncio.run(session())
+    expected = [
+        homework.render_package(row[0], row[1:]) if row else ''
+        for row in csv.reader(lines.decode().splitlines())
+    ]
+    assert answer == expected, 'Ответы должны идти в порядке пакетов.'
+    assert batcher.packages == 200
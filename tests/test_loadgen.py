@@ -0,0 +1,66 @@
+import json
+
+import homework
+import loadgen
+
+
+def test_generate_packages():
+    packages = list(loadgen.generate_packages(3000, seed=1))
+    assert packages == list(loadgen.generate_packages(3000, seed=1)), (
+        'Одно зерно должно давать одни и те же пакеты.'
+    )
+    for code, data in packages:
+        info = homework.info_package(code, data)
+        assert isinstance(info, homework.InfoMessage), (
+            f'Без --malformed пакет {code},{data} должен быть правильным.'
+        )
+        assert 0 < info.speed < 30 and info.calories > 0
+
+    only_running = loadgen.generate_packages(
+        100, mix={'RUN': 1.0, 'SWM': 0.0}, athletes=5
+    )
+    assert {code.partition('@')[0] for code, _ in only_running} == {'RUN'}
+
+
+def test_malformed_packages():
+    packages = list(loadgen.generate_packages(2000, malformed=0.2, seed=2))
+    reasons = [
+        info.reason for info in (
+            homework.info_package(code, data) for code, data in packages
+        )
+        if isinstance(info, homework.PackageError)
+    ]
+    assert 300 < len(reasons) < 500, 'Доля неправильных пакетов около 20%.'
+    assert set(reasons) == set(loadgen.MALFORMED_KINDS)
+
+
+def test_soak_stdin(capsys):
+    assert loadgen.main([
+        '--count', '3000', '--malformed', '0.05', '--interval', '0.01',
+    ]) == 0
+    captured = capsys.readouterr()
+    result = json.loads(captured.out)
+    assert result['sent'] == result['received'] == 3000, (
+        'На каждый пакет обработчик должен ответить строкой.'
+    )
+    assert result['p99_ms'] >= result['p50_ms'] > 0
+    assert result['peak_rss_kb'] > 0
+    assert all(json.loads(line) for line in captured.err.splitlines()
+               if line.startswith('{'))
+
+
+def test_soak_stdin_flushes_chunks(monkeypatch, capsys):
+    calls = []
+    spawn = loadgen.spawn
+
+    def record(argv, stdin):
+        calls.append(argv)
+        return spawn(argv, stdin)
+
+    monkeypatch.setattr(loadgen, 'spawn', record)
+    for argv in ['--rate', '10000'], ['--', '--flush-lines=7']:
+        assert loadgen.main(['--count', '500', *argv]) == 0
+        assert json.loads(capsys.readouterr().out)['received'] == 500
+    assert calls == [
+        ['-', '--flush-lines', '100'], ['-', '--flush-lines=7'],
+    ], 'Обработчик должен сбрасывать вывод по порциям генератора.'
@@ -0,0 +1,77 @@
+"""Клиент постоянного обработчика фитнес-трекера.
+
+Передаёт пакеты обработчику, запущенному `python homework.py --worker`,
+и печатает ответы. Модуль фитнес-трекера не импортируется, поэтому запуск
+клиента занимает доли времени запуска самого расчёта.
+
+    python worker_client.py /tmp/homework.sock packages.csv
+    cat packages.csv | python worker_client.py /tmp/homework.sock -
+    python worker_client.py /tmp/homework.sock --ping
+    python worker_client.py /tmp/homework.sock --reload
+"""
+
+from typing import BinaryIO, Iterable, Optional, Sequence
+import os
+import socket
+import sys
+import threading
+
+READ_SIZE = 64 * 1024
+
+COMMANDS = {'--ping': b'!PING\n', '--reload': b'!RELOAD\n'}
+
+
+def send(client: socket.socket, chunks: Iterable[bytes]) -> None:
+    """Отправляет данные и закрывает сокет на запись."""
+
+    try:
+        for chunk in chunks:
+            client.sendall(chunk)
+        client.shutdown(socket.SHUT_WR)
+    except OSError:
+        pass
+
+
+def request(
+    path: str, chunks: Iterable[bytes], output: BinaryIO
+) -> None:
+    """Отправляет запрос обработчику и пишет ответ в `output`.
+
+    Запрос отправляется в отдельном потоке, пока ответ читается, поэтому
+    большой поток пакетов не упирается в заполненный буфер сокета.
+    """
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(path)
+        sender = threading.Thread(target=send, args=(client, chunks))
+        sender.start()
+        while data := client.recv(READ_SIZE):
+            output.write(data)
+        sender.join()
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    """Разбирает аргументы, выполняет запрос и возвращает код выхода."""
+
+    args = sys.argv[1:] if argv is None else list(argv)
+    if len(args) != 2:
+        print(__doc__, file=sys.stderr)
+        return 2
+    path, target = args
+    if target in COMMANDS:
+        chunks: Iterable[bytes] = [COMMANDS[target]]
+    elif target == '-':
+        chunks = iter(lambda: sys.stdin.buffer.read(READ_SIZE), b'')
+    else:
+        chunks = [f'!FILE {os.path.abspath(target)}\n'.encode()]
+    try:
+        request(path, chunks, sys.stdout.buffer)
+    except OSError as error:
+        print(f'Обработчик недоступен: {error}', file=sys.stderr)
+        return 1
+    sys.stdout.flush()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())